@@ -6,6 +6,12 @@ from app_run.models import(
     Position,
     CollectibleItem,
     Subscribe,
+    ImportJob,
+    ChallengeSummary,
+    ChallengeSummaryAthlete,
+    CoachRating,
+    TrackLevel,
+    ResourceVersion,
 )    
 
 admin.site.register(Run)
@@ -13,4 +19,10 @@ admin.site.register(AthleteInfo)
 admin.site.register(Challenge)
 admin.site.register(Position)
 admin.site.register(CollectibleItem)
-admin.site.register(Subscribe)
\ No newline at end of file
+admin.site.register(Subscribe)
+admin.site.register(ImportJob)
+admin.site.register(ChallengeSummary)
+admin.site.register(ChallengeSummaryAthlete)
+admin.site.register(CoachRating)
+admin.site.register(TrackLevel)
+admin.site.register(ResourceVersion)
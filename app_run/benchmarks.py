@@ -0,0 +1,311 @@
+""" Нагрузочные сценарии для горячих путей API
+
+Каждый сценарий готовит данные заданного объёма и возвращает функцию одного
+запроса; run_scenario измеряет задержку и число SQL-запросов каждого вызова.
+Сценарии работают с текущей базой, поэтому запускать их нужно на тестовой
+(это делает команда benchmark_api) или внутри TestCase.
+"""
+import asyncio
+import datetime
+import json
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from openpyxl import Workbook
+from rest_framework.test import APIClient
+
+from app_run import ingest
+from app_run.models import CollectibleItem, Position, Run, Subscribe
+
+
+START_LATITUDE = 55.75
+START_LONGITUDE = 37.62
+START_TIME = datetime.datetime(2025, 10, 10, 18, 0, tzinfo=datetime.timezone.utc)
+STEP_DEGREES = 0.0001
+
+
+def create_athlete(username, **kwargs):
+    return User.objects.create(username=username, **kwargs)
+
+
+def make_positions(count, start=0):
+    """ Трек на северо-восток: шаг ~13 м за 5 секунд """
+    return [Position(latitude=round(START_LATITUDE + index * STEP_DEGREES, 4),
+                     longitude=round(START_LONGITUDE + index * STEP_DEGREES, 4),
+                     date_time=START_TIME + datetime.timedelta(seconds=5 * index))
+            for index in range(start, start + count)]
+
+
+def create_run(athlete, positions=0):
+    run = Run.objects.create(athlete=athlete, comment='benchmark', status='in_progress')
+    if positions:
+        run.add_positions(make_positions(positions))
+    return run
+
+
+def position_ingest(client, sizes, iterations):
+    """ POST api/positions/ по одной координате """
+    run = create_run(create_athlete('bench_ingest'))
+    points = make_positions(iterations)
+    url = reverse('position-list')
+
+    def request(index):
+        point = points[index]
+        return client.post(url, {'run': run.id,
+                                 'latitude': str(point.latitude),
+                                 'longitude': str(point.longitude),
+                                 'date_time': point.date_time.strftime('%Y-%m-%dT%H:%M:%S.%f')},
+                           format='json')
+    return request
+
+
+def position_bulk(client, sizes, iterations):
+    """ POST api/positions/bulk/ пачками по batch координат """
+    run = create_run(create_athlete('bench_bulk'))
+    batch = sizes['batch']
+    url = reverse('position-bulk')
+
+    def request(index):
+        points = make_positions(batch, start=index * batch)
+        return client.post(url, {'run': run.id,
+                                 'positions': [{'latitude': str(point.latitude),
+                                                'longitude': str(point.longitude),
+                                                'date_time': point.date_time.isoformat()}
+                                               for point in points]},
+                           format='json')
+    return request
+
+
+def run_stop(client, sizes, iterations):
+    """ Завершение забегов с треком из positions координат """
+    athlete = create_athlete('bench_stop')
+    runs = [create_run(athlete, sizes['positions']) for _ in range(iterations)]
+
+    def request(index):
+        return client.post(reverse('run-stop', kwargs={'pk': runs[index].id}))
+    return request
+
+
+def artifact_matching(client, sizes, iterations):
+    """ Координата атлета рядом с items артефактами: сбор через пространственный индекс """
+    create_artifacts(sizes['items'])
+    return position_ingest(client, sizes, iterations)
+
+
+def xlsx_import(client, sizes, iterations):
+    """ Синхронная загрузка xlsx из rows артефактов """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Name', 'UID', 'Value', 'Latitude', 'Longitude', 'URL'])
+    for index in range(sizes['rows']):
+        sheet.append([f'item {index}', f'uid{index}', index,
+                      START_LATITUDE + index / 10000, START_LONGITUDE, 'https://example.com'])
+    content = BytesIO()
+    workbook.save(content)
+    url = reverse('upload-file')
+
+    def request(index):
+        file = BytesIO(content.getvalue())
+        file.name = 'items.xlsx'
+        return client.post(url, {'file': file})
+    return request
+
+
+def user_list(client, sizes, iterations):
+    """ Список users атлетов, у каждого завершённый забег """
+    users = User.objects.bulk_create([User(username=f'bench_user{index}',
+                                           first_name=f'user{index}')
+                                      for index in range(sizes['users'])])
+    Run.objects.bulk_create([Run(athlete=user, comment='benchmark', status='finished')
+                             for user in users])
+    url = reverse('user-list')
+
+    def request(index):
+        return client.get(url, {'type': 'athlete'})
+    return request
+
+
+def coach_analytics(client, sizes, iterations):
+    """ Аналитика тренера с users подписчиками; кэш сбрасывается перед запросом """
+    coach = create_athlete('bench_coach', is_staff=True)
+    users = User.objects.bulk_create([User(username=f'bench_athlete{index}')
+                                      for index in range(sizes['users'])])
+    Subscribe.objects.bulk_create([Subscribe(athlete=user, coach=coach) for user in users])
+    Run.objects.bulk_create([Run(athlete=user, comment='benchmark', status='finished',
+                                 distance=index % 42, speed=index % 7)
+                             for index, user in enumerate(users) for _ in range(3)])
+    url = reverse('analytics-for-coach', kwargs={'coach_id': coach.id})
+
+    def request(index):
+        cache.clear()
+        return client.get(url)
+    return request
+
+
+SCENARIOS = {
+    'position_ingest': position_ingest,
+    'position_bulk': position_bulk,
+    'run_stop': run_stop,
+    'artifact_matching': artifact_matching,
+    'xlsx_import': xlsx_import,
+    'user_list': user_list,
+    'coach_analytics': coach_analytics,
+}
+
+DEFAULT_SIZES = {
+    'positions': 5000,
+    'batch': 100,
+    'items': 10000,
+    'rows': 1000,
+    'users': 1000,
+}
+
+
+def percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def run_scenario(name, sizes=None, iterations=20):
+    """ Задержка (мс) и число запросов к БД на каждый вызов сценария """
+    sizes = DEFAULT_SIZES | (sizes or {})
+    client = APIClient()
+    latencies, queries = [], []
+    # данные сценария откатываются, чтобы не влиять на следующие
+    with transaction.atomic():
+        request = SCENARIOS[name](client, sizes, iterations)
+        for index in range(iterations):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request(index)
+                latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: HTTP {response.status_code} '
+                                   f'{getattr(response, "data", "")}')
+            queries.append(len(context.captured_queries))
+        transaction.set_rollback(True)
+
+    return {
+        'requests': iterations,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries_avg': round(statistics.mean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def create_artifacts(count):
+    rng = random.Random(0)
+    CollectibleItem.objects.bulk_create(
+        [CollectibleItem(name=f'item {index}', uid=f'bench{index}', value=1,
+                         latitude=START_LATITUDE + rng.uniform(-0.5, 0.5),
+                         longitude=START_LONGITUDE + rng.uniform(-0.5, 0.5),
+                         picture='https://example.com')
+         for index in range(count)],
+        batch_size=1000)
+
+
+INGEST_MODES = {
+    'wsgi': 'position-list',
+    'asgi': 'position-async',
+    'buffered': 'position-list',
+}
+
+
+def _get_ingest_payloads(run_ids, requests):
+    """ По requests координат на каждый забег (каждому параллельному клиенту свой забег) """
+    return [[json.dumps({'run': run_id,
+                         'latitude': str(point.latitude),
+                         'longitude': str(point.longitude),
+                         'date_time': point.date_time.strftime('%Y-%m-%dT%H:%M:%S.%f')})
+             for point in make_positions(requests)]
+            for run_id in run_ids]
+
+
+def _ingest_wsgi(url, payloads):
+    """ Синхронный PositionViewSet: клиенты в потоках, как потоки WSGI-сервера """
+    def worker(bodies):
+        client = Client(raise_request_exception=False)
+        latencies = []
+        for body in bodies:
+            started = time.perf_counter()
+            response = client.post(url, body, content_type='application/json')
+            latencies.append((time.perf_counter() - started, response.status_code))
+            close_old_connections()
+        return latencies
+
+    with ThreadPoolExecutor(len(payloads)) as executor:
+        return list(executor.map(worker, payloads))
+
+
+def _ingest_asgi(url, payloads):
+    """ Async-представление: клиенты в одном цикле событий; запрос в своём
+    ThreadSensitiveContext, как в ASGIHandler """
+    async def worker(bodies):
+        client = AsyncClient(raise_request_exception=False)
+        latencies = []
+        for body in bodies:
+            async with ThreadSensitiveContext():
+                started = time.perf_counter()
+                response = await client.post(url, body, content_type='application/json')
+                latencies.append((time.perf_counter() - started, response.status_code))
+                await sync_to_async(close_old_connections)()
+        return latencies
+
+    async def main():
+        return await asyncio.gather(*(worker(bodies) for bodies in payloads))
+
+    return asyncio.run(main())
+
+
+def run_ingest_throughput(mode, requests, concurrency, items=0):
+    """ Пропускная способность приёма координат при concurrency параллельных клиентах
+
+    Каждый клиент отправляет requests координат в свой забег. Запросы идут из
+    разных потоков, поэтому данные фиксируются и удаляются после замера.
+    В режиме buffered координаты принимает буфер отложенной записи
+    (app_run/ingest.py), и замер заканчивается сохранением его остатка.
+    """
+    athlete = create_athlete(f'bench_ingest_{mode}')
+    runs = Run.objects.bulk_create([Run(athlete=athlete, comment='benchmark', status='in_progress')
+                                    for _ in range(concurrency)])
+    create_artifacts(items)
+    payloads = _get_ingest_payloads([run.id for run in runs], requests)
+    send = _ingest_asgi if mode == 'asgi' else _ingest_wsgi
+    try:
+        with tempfile.TemporaryDirectory() as journal_dir, \
+             override_settings(POSITION_BUFFER_ENABLED=mode == 'buffered',
+                               POSITION_BUFFER_JOURNAL_DIR=journal_dir):
+            started = time.perf_counter()
+            results = send(reverse(INGEST_MODES[mode]), payloads)
+            # замер включает сохранение остатка буфера
+            ingest.close_buffer()
+            elapsed = time.perf_counter() - started
+        stored = Position.objects.filter(run__athlete=athlete).count()
+    finally:
+        athlete.delete()
+        CollectibleItem.objects.filter(uid__startswith='bench').delete()
+
+    latencies = [latency * 1000 for worker in results for latency, _ in worker]
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'errors': sum(code >= 400 for worker in results for _, code in worker),
+        'stored': stored,
+    }
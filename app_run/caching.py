@@ -0,0 +1,72 @@
+import functools
+
+from django.core.cache import cache
+from django.views.decorators.http import condition
+from rest_framework.response import Response
+
+from app_run import metrics
+
+
+def get_key(name, *parts):
+    return ':'.join([name, *map(str, parts)])
+
+
+def get(name, key):
+    """ Значение из кэша с учётом попаданий и промахов в счётчиках name """
+    value = cache.get(key)
+    metrics.CACHE_LOOKUPS.labels(name, 'hits' if value is not None else 'misses').inc()
+    return value
+
+
+def get_stats(name):
+    return {result: int(metrics.get_value('app_run_cache_lookups_total', cache=name, result=result))
+            for result in ('hits', 'misses')}
+
+
+def resource_condition(get_version):
+    """ Условный GET по версии ресурса: ETag, Last-Modified и ответ 304
+
+    get_version(request, *args, **kwargs) возвращает (версия, время изменения)
+    или None, если ресурс не поддерживает условные запросы. Версия читается
+    один раз за запрос и доступна представлению как request.resource_version.
+    """
+    def get_resource_version(request, *args, **kwargs):
+        if not hasattr(request, 'resource_version'):
+            request.resource_version = get_version(request, *args, **kwargs)
+        return request.resource_version
+
+    def etag(request, *args, **kwargs):
+        version = get_resource_version(request, *args, **kwargs)
+        return None if version is None else str(version[0])
+
+    def last_modified(request, *args, **kwargs):
+        version = get_resource_version(request, *args, **kwargs)
+        return None if version is None else version[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def cached_response_data(name, timeout=None):
+    """ Кэш данных ответа по версии ресурса и пути запроса
+
+    Новая версия ресурса даёт новый ключ, поэтому изменения видны сразу;
+    без версии (request.resource_version is None) кэш не используется.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            version = getattr(request, 'resource_version', None)
+            if version is None:
+                return method(view, request, *args, **kwargs)
+            updated_at = version[1].timestamp() if version[1] else ''
+            key = get_key(name, version[0], updated_at, request.get_full_path())
+            data = get(name, key)
+            if data is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                data = response.data
+                cache.set(key, data, timeout=timeout)
+            return Response(data)
+        return wrapper
+    return decorator
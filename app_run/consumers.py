@@ -0,0 +1,58 @@
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from app_run import live
+from app_run.models import Position, Run, RunNotInProgress
+from app_run.serializers import RUN_NOT_IN_PROGRESS, PositionBulkSerializer
+
+
+# Код закрытия соединения для несуществующего забега
+CLOSE_NOT_FOUND = 4404
+
+
+class RunConsumer(JsonWebsocketConsumer):
+    """ WebSocket забега: часы присылают координаты, подписчики получают новые точки
+
+    Входящее сообщение -- {"positions": [{"latitude", "longitude", "date_time"}, ...]},
+    как в api/positions/bulk/; отправителю отвечает {"type": "ack", "created": N}.
+    Подписчики после подключения получают состояние забега ("state"), затем
+    новые координаты ("positions") и завершение забега ("finished").
+    """
+    def connect(self):
+        self.run_id = self.scope['url_route']['kwargs']['run_id']
+        run = Run.objects.filter(pk=self.run_id).first()
+        if run is None:
+            self.close(code=CLOSE_NOT_FOUND)
+            return
+        async_to_sync(self.channel_layer.group_add)(live.get_group_name(self.run_id),
+                                                    self.channel_name)
+        self.accept()
+        self.send_json(live.get_state(run))
+
+    def disconnect(self, code):
+        async_to_sync(self.channel_layer.group_discard)(live.get_group_name(self.run_id),
+                                                        self.channel_name)
+
+    def receive_json(self, content, **kwargs):
+        positions = content.get('positions') if isinstance(content, dict) else None
+        serializer = PositionBulkSerializer(data={'run': self.run_id, 'positions': positions})
+        if not serializer.is_valid():
+            self.send_json({'type': 'error', 'errors': serializer.errors})
+            return
+        run = serializer.validated_data['run']
+        try:
+            created = run.add_positions([Position(**data)
+                                         for data in serializer.validated_data['positions']],
+                                        skip_stale=True)
+        except RunNotInProgress:
+            self.send_json({'type': 'error', 'errors': {'run': [RUN_NOT_IN_PROGRESS]}})
+            return
+        live.broadcast_positions(run.id, created, sender=self.channel_name)
+        self.send_json({'type': 'ack', 'created': len(created)})
+
+    def run_positions(self, event):
+        if event['sender'] != self.channel_name:
+            self.send_json(event['data'])
+
+    def run_finished(self, event):
+        self.send_json(event['data'])
@@ -0,0 +1,100 @@
+""" Потоковый экспорт забегов в GPX и CSV
+
+Координаты читаются одним запросом через iterator(chunk_size) -- серверным
+курсором, где он поддерживается, -- и сразу превращаются в текст, поэтому
+потребление памяти не зависит от длины трека. Архивированные забеги
+читаются из архива по одному.
+"""
+import csv
+import itertools
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+
+from app_run.models import Position
+
+
+FIELDS = ('id', 'latitude', 'longitude', 'date_time', 'speed', 'distance')
+CSV_HEADERS = ['run', 'position', 'latitude', 'longitude', 'date_time', 'speed', 'distance']
+CONTENT_TYPES = {
+    'gpx': 'application/gpx+xml',
+    'csv': 'text/csv',
+}
+
+
+def iter_run_positions(runs, chunk_size=None):
+    """ Пары (забег, строки FIELDS в порядке date_time) для забегов в порядке id """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    runs = runs.order_by('id')
+    rows = Position.objects.filter(run__in=runs.filter(positions_archive='')) \
+                           .order_by('run_id', 'date_time', 'id') \
+                           .values_list('run_id', *FIELDS) \
+                           .iterator(chunk_size=chunk_size)
+    groups = itertools.groupby(rows, key=lambda row: row[0])
+    group = next(groups, None)
+    for run in runs.iterator(chunk_size=chunk_size):
+        if run.positions_archive:
+            yield run, iter(run.get_track_rows(*FIELDS))
+            continue
+        while group is not None and group[0] < run.id:
+            group = next(groups, None)
+        if group is not None and group[0] == run.id:
+            yield run, (row[1:] for row in group[1])
+            group = next(groups, None)
+        else:
+            yield run, iter(())
+
+
+def batched(lines, size):
+    """ Склейка строк в куски по size штук, чтобы не отдавать ответ построчно """
+    lines = iter(lines)
+    while batch := list(itertools.islice(lines, size)):
+        yield ''.join(batch)
+
+
+def _format_date_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def iter_gpx(runs, chunk_size=None):
+    """ GPX 1.1: по треку на забег """
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    for run, rows in iter_run_positions(runs, chunk_size):
+        yield (f'<trk><name>Run {run.id}</name><desc>{escape(run.comment)}</desc>'
+               f'<type>{escape(run.status)}</type>\n<trkseg>\n')
+        for _, latitude, longitude, date_time, _, _ in rows:
+            point = f'<trkpt lat={quoteattr(str(latitude))} lon={quoteattr(str(longitude))}>'
+            if date_time is not None:
+                point += f'<time>{_format_date_time(date_time)}</time>'
+            yield point + '</trkpt>\n'
+        yield '</trkseg>\n</trk>\n'
+    yield '</gpx>\n'
+
+
+class Echo:
+    """ Буфер для csv.writer, возвращающий записанную строку """
+    def write(self, value):
+        return value
+
+
+def iter_csv(runs, chunk_size=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADERS)
+    for run, rows in iter_run_positions(runs, chunk_size):
+        for position_id, latitude, longitude, date_time, speed, distance in rows:
+            yield writer.writerow([run.id, position_id, latitude, longitude,
+                                   _format_date_time(date_time) if date_time else '',
+                                   speed, distance])
+
+
+EXPORTERS = {
+    'gpx': iter_gpx,
+    'csv': iter_csv,
+}
+
+
+def export(runs, file_format, chunk_size=None):
+    """ Поток кусков текста экспорта в формате gpx или csv """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    return batched(EXPORTERS[file_format](runs, chunk_size), chunk_size)
@@ -0,0 +1,147 @@
+""" Векторизованный расчёт расстояний между координатами (NumPy)
+
+Все функции принимают массивы широт и долгот в градусах и возвращают
+расстояния в метрах. Доступные методы и их погрешность относительно
+geopy.distance.geodesic (алгоритм Karney, эллипсоид WGS-84):
+
+- ``geodesic`` -- geopy/geographiclib для каждой пары точек; эталон,
+  погрешность ~15 нм, но без векторизации.
+- ``vincenty`` -- формула Винсенти на эллипсоиде WGS-84, векторизована.
+  Расхождение с geodesic не превышает 0.1 мм. Для почти
+  диаметрально противоположных точек, где итерации не сходятся,
+  расстояние считается через geodesic.
+- ``haversine`` -- сфера среднего радиуса 6371008.8 м. Относительная
+  погрешность до 0.6 % (в среднем около 0.2 %); подходит для оценок,
+  но не для расчёта дистанции забега.
+
+Метод по умолчанию задаётся настройкой GEODISTANCE_METHOD.
+"""
+import numpy as np
+from django.conf import settings
+from geopy import distance
+
+
+GEODESIC = 'geodesic'
+VINCENTY = 'vincenty'
+HAVERSINE = 'haversine'
+METHODS = (GEODESIC, VINCENTY, HAVERSINE)
+
+MEAN_EARTH_RADIUS = 6371008.8
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 200
+
+
+def get_method(method=None):
+    method = method or getattr(settings, 'GEODISTANCE_METHOD', VINCENTY)
+    if method not in METHODS:
+        raise ValueError(f'Unknown geodistance method {method!r}, expected one of {METHODS}')
+    return method
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def _geodesic(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    return np.array([distance.geodesic((lat_1, lon_1), (lat_2, lon_2)).meters
+                     for lat_1, lon_1, lat_2, lon_2
+                     in zip(latitudes_1, longitudes_1, latitudes_2, longitudes_2)],
+                    dtype=np.float64)
+
+
+def _haversine(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    phi_1, phi_2 = np.radians(latitudes_1), np.radians(latitudes_2)
+    delta_phi = phi_2 - phi_1
+    delta_lambda = np.radians(longitudes_2 - longitudes_1)
+    h = (np.sin(delta_phi / 2) ** 2
+         + np.cos(phi_1) * np.cos(phi_2) * np.sin(delta_lambda / 2) ** 2)
+    return 2 * MEAN_EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def _vincenty(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    f, a, b = WGS84_F, WGS84_A, WGS84_B
+    u_1 = np.arctan((1 - f) * np.tan(np.radians(latitudes_1)))
+    u_2 = np.arctan((1 - f) * np.tan(np.radians(latitudes_2)))
+    big_l = np.radians(longitudes_2 - longitudes_1)
+    sin_u_1, cos_u_1 = np.sin(u_1), np.cos(u_1)
+    sin_u_2, cos_u_2 = np.sin(u_2), np.cos(u_2)
+
+    lam = big_l.copy()
+    active = np.ones(lam.shape, dtype=bool)
+    sin_sigma = cos_sigma = sigma = cos_sq_alpha = cos_2_sigma_m = np.zeros(lam.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u_2 * sin_lam,
+                                 cos_u_1 * sin_u_2 - sin_u_1 * cos_u_2 * cos_lam)
+            cos_sigma = sin_u_1 * sin_u_2 + cos_u_1 * cos_u_2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0, cos_u_1 * cos_u_2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2_sigma_m = np.where(cos_sq_alpha == 0, 0,
+                                     cos_sigma - 2 * sin_u_1 * sin_u_2 / cos_sq_alpha)
+            c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+            lam_prev = lam
+            lam = big_l + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2_sigma_m
+                                         + c * cos_sigma * (-1 + 2 * cos_2_sigma_m ** 2)))
+            active = np.abs(lam - lam_prev) > VINCENTY_TOLERANCE
+            if not active.any():
+                break
+
+        u_sq = cos_sq_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (
+            cos_2_sigma_m + big_b / 4 * (
+                cos_sigma * (-1 + 2 * cos_2_sigma_m ** 2)
+                - big_b / 6 * cos_2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2_sigma_m ** 2)))
+        result = b * big_a * (sigma - delta_sigma)
+
+    failed = active | ~np.isfinite(result)
+    if failed.any():
+        result[failed] = _geodesic(latitudes_1[failed], longitudes_1[failed],
+                                   latitudes_2[failed], longitudes_2[failed])
+    return result
+
+
+_IMPLEMENTATIONS = {
+    GEODESIC: _geodesic,
+    VINCENTY: _vincenty,
+    HAVERSINE: _haversine,
+}
+
+
+def pairwise_distances(latitudes_1, longitudes_1, latitudes_2, longitudes_2, method=None):
+    """ Расстояния между парами точек, в метрах """
+    arrays = np.broadcast_arrays(_as_array(latitudes_1), _as_array(longitudes_1),
+                                 _as_array(latitudes_2), _as_array(longitudes_2))
+    arrays = [np.atleast_1d(array).astype(np.float64) for array in arrays]
+    if arrays[0].size == 0:
+        return np.zeros(0)
+    return _IMPLEMENTATIONS[get_method(method)](*arrays)
+
+
+def segment_distances(latitudes, longitudes, method=None):
+    """ Длины отрезков трека между соседними точками, в метрах (n - 1 значений) """
+    latitudes, longitudes = _as_array(latitudes), _as_array(longitudes)
+    if latitudes.size < 2:
+        return np.zeros(0)
+    return pairwise_distances(latitudes[:-1], longitudes[:-1],
+                              latitudes[1:], longitudes[1:], method)
+
+
+def distances_to_point(latitudes, longitudes, latitude, longitude, method=None):
+    """ Расстояния от набора точек до одной точки, в метрах """
+    return pairwise_distances(latitudes, longitudes, latitude, longitude, method)
+
+
+def path_length(coordinates, method=None):
+    """ Длина пути по списку пар (широта, долгота), в метрах """
+    if len(coordinates) < 2:
+        return 0.0
+    latitudes, longitudes = zip(*coordinates)
+    return float(segment_distances(latitudes, longitudes, method).sum())
@@ -0,0 +1,122 @@
+import datetime
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import transaction
+from openpyxl import load_workbook
+
+from app_run.models import CollectibleItem, Position, Run
+from app_run.serializers import CollectibleItemSerializer
+
+
+COLLECTIBLE_ITEM_HEADERS = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+COORDINATE_QUANTUM = Decimal('0.0001')
+
+
+def iter_workbook_rows(file, min_row=2):
+    """ Построчное чтение активного листа без загрузки книги в память """
+    workbook = load_workbook(filename=file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(min_row=min_row, values_only=True)
+    finally:
+        workbook.close()
+
+
+def import_collectible_items(rows, chunk_size=None, on_chunk=None):
+    """ Импорт артефактов: одна валидация на строку, запись пачками через bulk_create
+
+    Каждая пачка из chunk_size прочитанных строк сохраняется отдельной транзакцией;
+    on_chunk(rows_read, items_saved, errors_row) вызывается внутри неё, что позволяет
+    сохранить прогресс и строки с ошибками вместе с данными.
+    """
+    chunk_size = chunk_size or settings.COLLECTIBLE_ITEMS_IMPORT_CHUNK_SIZE
+    chunk, chunk_errors, rows_read = [], [], 0
+
+    def save_chunk():
+        with transaction.atomic():
+            CollectibleItem.objects.bulk_create(chunk)
+            if on_chunk:
+                on_chunk(rows_read, len(chunk), chunk_errors)
+
+    for row in rows:
+        rows_read += 1
+        if not all(value is None for value in row):
+            data = dict(zip(COLLECTIBLE_ITEM_HEADERS, row))
+            serializer = CollectibleItemSerializer(data=data)
+            if serializer.is_valid():
+                chunk.append(CollectibleItem(**serializer.validated_data))
+            else:
+                chunk_errors.append(list(data.values()))
+        if rows_read >= chunk_size:
+            save_chunk()
+            chunk, chunk_errors, rows_read = [], [], 0
+    if rows_read:
+        save_chunk()
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _find_text(element, name):
+    for child in element.iter():
+        if _local_name(child.tag) == name:
+            return child.text
+    return None
+
+
+def iter_track_points(file):
+    """ Потоковый разбор GPX или TCX: (широта, долгота, время) каждой точки трека
+
+    Разобранные точки удаляются из дерева, поэтому память не растёт с длиной файла.
+    Точки TCX без координат (например, только пульс) пропускаются.
+    """
+    stack = []
+    for event, element in ElementTree.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            continue
+        stack.pop()
+        name = _local_name(element.tag)
+        if name == 'trkpt':
+            point = (element.get('lat'), element.get('lon'), _find_text(element, 'time'))
+        elif name == 'Trackpoint':
+            point = (_find_text(element, 'LatitudeDegrees'),
+                     _find_text(element, 'LongitudeDegrees'),
+                     _find_text(element, 'Time'))
+        else:
+            continue
+        if stack:
+            stack[-1].remove(element)
+        if point[0] is not None and point[1] is not None:
+            yield point
+
+
+def parse_track_point(latitude, longitude, date_time):
+    latitude = Decimal(latitude.strip()).quantize(COORDINATE_QUANTUM)
+    longitude = Decimal(longitude.strip()).quantize(COORDINATE_QUANTUM)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f'Coordinates out of range: {latitude}, {longitude}')
+    if date_time:
+        date_time = datetime.datetime.fromisoformat(date_time.strip())
+        if date_time.tzinfo is None:
+            date_time = date_time.replace(tzinfo=datetime.timezone.utc)
+    return Position(latitude=latitude, longitude=longitude, date_time=date_time or None)
+
+
+def import_run(file, athlete, comment=''):
+    """ Завершённый забег из файла GPX/TCX одной транзакцией
+
+    Координаты сохраняются одним bulk_create, дистанция и скорость считаются
+    за один проход по треку, челенджи проверяются один раз в конце.
+    """
+    positions = [parse_track_point(*point) for point in iter_track_points(file)]
+    if not positions:
+        raise ValueError('Track has no points')
+    with transaction.atomic():
+        run = Run.objects.create(athlete=athlete, comment=comment, status='in_progress')
+        run.add_positions(positions)
+        run.refresh_from_db()
+        run.finish()
+    return run
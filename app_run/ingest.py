@@ -0,0 +1,317 @@
+""" Отложенная запись координат (write-behind): буфер процесса со сбросом пачками
+
+При POSITION_BUFFER_ENABLED координата из POST api/positions/ попадает в буфер,
+а ответ 202 приходит без id, дистанции и скорости. Буфер сохраняется одной
+транзакцией по размеру, по таймеру, при завершении забега и процесса.
+Принятые координаты пишутся в журнал, который после падения процесса
+сохраняет команда replay_position_journal. Буфер у каждого процесса свой,
+поэтому запросы одного забега направляют в один процесс.
+"""
+import atexit
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+
+from app_run import live, metrics
+from app_run.models import Position, Run, RunNotInProgress
+
+
+JOURNAL_SUFFIX = '.jsonl'
+
+logger = logging.getLogger(__name__)
+
+_buffer = None
+
+
+def dump_position(position):
+    """ Строка журнала: исходные поля координаты без потери точности """
+    return json.dumps({
+        'run': position.run_id,
+        'latitude': str(position.latitude),
+        'longitude': str(position.longitude),
+        'date_time': position.date_time.isoformat() if position.date_time else None,
+    })
+
+
+def load_position(line):
+    data = json.loads(line)
+    return Position(run_id=data['run'],
+                    latitude=Decimal(data['latitude']),
+                    longitude=Decimal(data['longitude']),
+                    date_time=(datetime.datetime.fromisoformat(data['date_time'])
+                               if data['date_time'] else None))
+
+
+def sort_positions(positions):
+    """ Координаты забега по времени, из повторов времени -- первая, как в пакетной загрузке """
+    unique_positions = {position.date_time: position for position in reversed(positions)}
+    return sorted(unique_positions.values(), key=lambda position: position.date_time)
+
+
+def save_positions(positions):
+    """ Сохранение координат нескольких забегов одной транзакцией
+
+    Координаты забега упорядочиваются по времени, дистанция и скорость
+    считаются от последней сохранённой координаты забега. Строки забегов
+    блокируются до чтения последних координат, как в Run.save_positions.
+    Координаты забегов, которые уже не в процессе, отбрасываются.
+    """
+    runs_positions = {}
+    for position in positions:
+        runs_positions.setdefault(position.run_id, []).append(position)
+    runs_positions = {run_id: sort_positions(run_positions)
+                      for run_id, run_positions in runs_positions.items()}
+
+    with transaction.atomic():
+        runs = list(Run.objects.select_for_update()
+                               .filter(pk__in=runs_positions, status='in_progress')
+                               .order_by('pk'))
+        last_ids = Position.objects.filter(run__in=runs).values('run') \
+                                   .annotate(last_id=Max('pk')).values('last_id')
+        last_positions = {position.run_id: position
+                          for position in Position.objects.filter(pk__in=last_ids)}
+        runs_positions = [(run, run.chain_positions(runs_positions[run.pk],
+                                                    last_positions.get(run.pk)))
+                          for run in runs]
+        created = Position.objects.bulk_create([position for _, run_positions in runs_positions
+                                                for position in run_positions])
+        for run, run_positions in runs_positions:
+            run.update_totals(run_positions)
+            live.broadcast_positions(run.pk, run_positions)
+        Run.collect_items_for_runs(runs_positions)
+        metrics.inc_on_commit(metrics.POSITIONS_INGESTED, len(created))
+    metrics.POSITION_BUFFER_FLUSH_SIZE.observe(len(positions))
+    return created
+
+
+class PositionBuffer:
+    """ Буфер принятых координат процесса
+
+    max_points -- размер пачки, max_delay -- период фонового сброса в
+    секундах (0 -- без фонового потока), journal_dir -- каталог журнала,
+    max_retries -- число неудачных сбросов подряд, после которого пачка
+    отбрасывается.
+    """
+    def __init__(self, max_points, max_delay, journal_dir=None, fsync=False, max_retries=3):
+        self.max_points = max_points
+        self.max_delay = max_delay
+        self.journal_dir = journal_dir
+        self.fsync = fsync
+        self.max_retries = max_retries
+        self.failures = 0
+        self.positions = []
+        # заблокированные файлы сегментов журнала с координатами буфера;
+        # в self.journal, последний из них, идёт запись
+        self.segments = []
+        self.journal = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, position):
+        """ Приём координаты: запись в журнал, в буфер и сброс полной пачки """
+        with self.lock:
+            self.write_journal(position)
+            self.positions.append(position)
+            full = len(self.positions) >= self.max_points
+            self.start_timer()
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                # координата принята и останется в буфере до следующего сброса
+                logger.exception('Position buffer flush failed')
+
+    def write_journal(self, position):
+        if self.journal_dir is None:
+            return
+        if self.journal is None:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            path = os.path.join(self.journal_dir, f'{os.getpid()}-{uuid.uuid4().hex}{JOURNAL_SUFFIX}')
+            self.journal = open(path, 'a', encoding='utf-8')
+            fcntl.flock(self.journal, fcntl.LOCK_EX)
+            self.segments.append(self.journal)
+        self.journal.write(dump_position(position) + '\n')
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def flush(self):
+        """ Сохранение содержимого буфера; возвращает сохранённые координаты """
+        with self.flush_lock:
+            with self.lock:
+                positions, segments = self.positions, self.segments
+                self.positions, self.segments = [], []
+                self.journal = None
+            if not positions:
+                return []
+            try:
+                created = save_positions(positions)
+            except Exception:
+                self.failures += 1
+                if self.failures > self.max_retries:
+                    self.failures = 0
+                    self.drop(positions, segments)
+                else:
+                    with self.lock:
+                        self.positions[:0] = positions
+                        self.segments[:0] = segments
+                raise
+            self.failures = 0
+            for file in segments:
+                os.remove(file.name)
+                file.close()
+            return created
+
+    def drop(self, positions, segments):
+        """ Отказ от пачки после max_retries неудачных сбросов: сегменты остаются для replay """
+        for file in segments:
+            file.close()
+        metrics.POSITION_BUFFER_DROPPED.inc(len(positions))
+        logger.error('Position buffer dropped %d positions after %d failed flushes, '
+                     'journal segments left for replay: %s',
+                     len(positions), self.max_retries + 1,
+                     [file.name for file in segments] or 'no journal')
+
+    def release(self):
+        """ Закрытие сегментов журнала без сброса буфера """
+        with self.lock:
+            for file in self.segments:
+                file.close()
+            self.positions, self.segments = [], []
+            self.journal = None
+
+    def start_timer(self):
+        if self.max_delay and self.thread is None:
+            self.thread = threading.Thread(target=self.run_timer, name='position-buffer',
+                                           daemon=True)
+            self.thread.start()
+
+    def run_timer(self):
+        while not self.stopped.wait(self.max_delay):
+            if not self.positions:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Position buffer flush failed')
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """ Остановка фонового сброса и сохранение остатка """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.flush()
+
+
+def get_buffer():
+    """ Буфер процесса или None, если отложенная запись выключена """
+    global _buffer
+    if _buffer is None and settings.POSITION_BUFFER_ENABLED:
+        _buffer = PositionBuffer(settings.POSITION_BUFFER_MAX_POINTS,
+                                 settings.POSITION_BUFFER_MAX_DELAY_MS / 1000,
+                                 settings.POSITION_BUFFER_JOURNAL_DIR,
+                                 settings.POSITION_BUFFER_FSYNC,
+                                 settings.POSITION_BUFFER_MAX_RETRIES)
+        atexit.register(_buffer.close)
+    return _buffer
+
+
+def flush_buffer():
+    """ Сброс буфера процесса, если он есть """
+    return _buffer.flush() if _buffer is not None else []
+
+
+def close_buffer():
+    """ Сброс и закрытие буфера процесса; следующий get_buffer создаст новый """
+    global _buffer
+    buffer, _buffer = _buffer, None
+    if buffer is None:
+        return []
+    atexit.unregister(buffer.close)
+    return buffer.close()
+
+
+def lock_segment(path):
+    """ Открытый сегмент под блокировкой или None, если его держит работающий процесс """
+    try:
+        file = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        file.close()
+        return None
+    return file
+
+
+def list_segments(journal_dir, pids=None):
+    """ Незаблокированные сегменты журнала процессов pids (по умолчанию -- любых)
+
+    Возвращает открытые файлы под блокировкой; их закрывает вызывающий.
+    """
+    segments = []
+    for path in sorted(glob.glob(os.path.join(glob.escape(str(journal_dir)), f'*{JOURNAL_SUFFIX}'))):
+        pid = int(os.path.basename(path).split('-', 1)[0])
+        if pids is not None and pid not in pids:
+            continue
+        file = lock_segment(path)
+        if file is not None:
+            segments.append(file)
+    return segments
+
+
+def read_segment(file):
+    """ Координаты сегмента; недописанная при падении последняя строка пропускается """
+    positions = []
+    for line in file:
+        try:
+            positions.append(load_position(line))
+        except (ValueError, KeyError):
+            continue
+    return positions
+
+
+def replay_journal(pids=None, journal_dir=None):
+    """ Сохранение координат из сегментов журнала, не заблокированных процессами
+
+    Возвращает (число сегментов, координат в них, сохранено).
+    """
+    journal_dir = journal_dir or settings.POSITION_BUFFER_JOURNAL_DIR
+    if journal_dir is None:
+        return 0, 0, 0
+    segments = list_segments(journal_dir, pids)
+    try:
+        runs_positions = {}
+        for file in segments:
+            for position in read_segment(file):
+                runs_positions.setdefault(position.run_id, []).append(position)
+
+        saved = 0
+        for run in Run.objects.filter(pk__in=runs_positions, status='in_progress'):
+            positions = sorted(runs_positions[run.pk], key=lambda position: position.date_time)
+            try:
+                saved += len(run.add_positions(positions, skip_stale=True))
+            except RunNotInProgress:
+                # забег завершился после выборки
+                continue
+        for file in segments:
+            os.remove(file.name)
+    finally:
+        for file in segments:
+            file.close()
+    return len(segments), sum(map(len, runs_positions.values())), saved
@@ -0,0 +1,133 @@
+import datetime
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from app_run import importers
+from app_run.models import ImportJob, ImportJobErrorRow, Run
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+class LeaseLost(Exception):
+    """ Задание захвачено другим обработчиком после истечения аренды """
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMPORT_JOBS_WORKERS,
+                                       thread_name_prefix='app-run-job')
+    return _executor
+
+
+def submit_import_jobs():
+    """ Запуск обработки очереди в локальном пуле потоков """
+    return get_executor().submit(run_import_jobs)
+
+
+def submit_track_levels(run_id):
+    """ Построение уровней детализации трека завершённого забега в локальном пуле потоков """
+    return get_executor().submit(run_track_levels, run_id)
+
+
+def run_track_levels(run_id):
+    close_old_connections()
+    try:
+        build_track_levels(run_id)
+    except Exception:
+        # уровни построит первый запрос трека с zoom
+        logger.exception('Track levels build failed for run %s', run_id)
+    finally:
+        close_old_connections()
+
+
+def build_track_levels(run_id):
+    """ Уровни детализации трека; удалённый или незавершённый забег пропускается """
+    run = Run.objects.only('id', 'positions_archive').filter(pk=run_id, status='finished').first()
+    return run.build_track_levels() if run else []
+
+
+def run_import_jobs():
+    """ Обработка заданий из очереди в БД, пока они есть """
+    close_old_connections()
+    try:
+        while process_import_job():
+            pass
+    finally:
+        close_old_connections()
+
+
+def claim_import_job():
+    """ Захват следующего задания: ожидающего или брошенного упавшим обработчиком """
+    now = timezone.now()
+    with transaction.atomic():
+        job = ImportJob.objects.select_for_update(skip_locked=True) \
+                               .filter(Q(status='pending')
+                                       | Q(status='running', locked_until__lt=now)) \
+                               .order_by('pk') \
+                               .first()
+        if job is None:
+            return None
+        job.status = 'running'
+        job.locked_until = now + datetime.timedelta(seconds=settings.IMPORT_JOBS_LEASE_SECONDS)
+        job.lease_token = uuid.uuid4()
+        job.save(update_fields=['status', 'locked_until', 'lease_token', 'updated_at'])
+    return job
+
+
+def process_import_job():
+    """ Обработка одного задания; продолжает с последней сохранённой пачки """
+    job = claim_import_job()
+    if job is None:
+        return None
+    return execute_import_job(job)
+
+
+def execute_import_job(job):
+    """ Импорт файла захваченного задания
+
+    Все записи задания проверяют аренду (lease_token): если после её истечения
+    задание захватил другой обработчик, текущая пачка откатывается вместе с
+    прогрессом, а статус задания остаётся за новым обработчиком.
+    """
+    leased = ImportJob.objects.filter(pk=job.pk, lease_token=job.lease_token)
+
+    def on_chunk(rows_read, items_saved, errors_row):
+        extended = leased.update(
+            rows_read=F('rows_read') + rows_read,
+            rows_processed=F('rows_processed') + items_saved + len(errors_row),
+            rows_failed=F('rows_failed') + len(errors_row),
+            locked_until=timezone.now() + datetime.timedelta(
+                                seconds=settings.IMPORT_JOBS_LEASE_SECONDS),
+            updated_at=timezone.now())
+        if not extended:
+            raise LeaseLost(job.pk)
+        ImportJobErrorRow.objects.bulk_create([ImportJobErrorRow(job=job, row=row)
+                                               for row in errors_row])
+
+    try:
+        with job.file.open('rb') as file:
+            rows = importers.iter_workbook_rows(file, min_row=2 + job.rows_read)
+            importers.import_collectible_items(rows, on_chunk=on_chunk)
+    except LeaseLost:
+        return job
+    except Exception as exc:
+        job.status = 'failed'
+        job.error = str(exc)
+    else:
+        job.status = 'finished'
+    leased.update(status=job.status,
+                  error=job.error,
+                  locked_until=None,
+                  lease_token=None,
+                  updated_at=timezone.now())
+    return job
@@ -0,0 +1,82 @@
+""" Трансляция забега в реальном времени через слой каналов (channels)
+
+Новые координаты и завершение забега рассылаются группе ``run_<id>`` после
+фиксации транзакции -- независимо от того, пришли координаты по WebSocket
+(app_run/consumers.py) или HTTP. Без настроенного CHANNEL_LAYERS рассылка
+не выполняется.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from app_run.serializers import PositionSerializer
+
+
+def get_group_name(run_id):
+    return f'run_{run_id}'
+
+
+def serialize_positions(positions):
+    return [dict(data) for data in PositionSerializer(positions, many=True).data]
+
+
+def get_state(run):
+    """ Состояние забега для нового подписчика """
+    last_position = run.positions.order_by('date_time', 'id').last()
+    return {
+        'type': 'state',
+        'run': run.id,
+        'status': run.status,
+        'distance': round(run.distance, 2),
+        'positions_count': run.positions_count,
+        'last_position': serialize_positions([last_position])[0] if last_position else None,
+    }
+
+
+def get_message(event_type, data, sender=None):
+    return {'type': event_type, 'data': data, 'sender': sender}
+
+
+def get_positions_data(run_id, positions):
+    return {
+        'type': 'positions',
+        'run': run_id,
+        'positions': serialize_positions(positions),
+    }
+
+
+def broadcast(run_id, event_type, data, sender=None):
+    """ Рассылка события группе забега после фиксации транзакции """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    message = get_message(event_type, data, sender)
+    transaction.on_commit(
+        lambda: async_to_sync(channel_layer.group_send)(get_group_name(run_id), message))
+
+
+def broadcast_positions(run_id, positions, sender=None):
+    """ Новые координаты с дистанцией и скоростью; sender не получает свою рассылку """
+    if positions:
+        broadcast(run_id, 'run.positions', get_positions_data(run_id, positions), sender)
+
+
+async def abroadcast_positions(run_id, positions, sender=None):
+    """ broadcast_positions для async-кода: координаты уже сохранены, рассылка сразу """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not positions:
+        return
+    await channel_layer.group_send(get_group_name(run_id),
+                                   get_message('run.positions',
+                                               get_positions_data(run_id, positions),
+                                               sender))
+
+
+def broadcast_finished(run):
+    broadcast(run.id, 'run.finished', {
+        'type': 'finished',
+        'run': run.id,
+        'distance': round(run.distance, 2),
+        'run_time_seconds': run.run_time_seconds,
+        'speed': run.speed,
+    })
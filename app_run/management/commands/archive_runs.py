@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Перенос координат завершённых забегов в архив (или обратно с --restore)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int,
+                            help='id забегов, по умолчанию все завершённые')
+        parser.add_argument('--days', type=int, default=0,
+                            help='только забеги, начатые раньше, чем N дней назад')
+        parser.add_argument('--restore', action='store_true',
+                            help='вернуть координаты из архива в таблицу')
+
+    def handle(self, *args, **options):
+        queryset = Run.objects.filter(status='finished').order_by('pk')
+        if options['run_ids']:
+            queryset = queryset.filter(pk__in=options['run_ids'])
+        if options['days']:
+            queryset = queryset.filter(created_at__lt=timezone.now() - timedelta(days=options['days']))
+
+        processed = 0
+        if options['restore']:
+            for run in queryset.exclude(positions_archive='').iterator():
+                run.restore_positions()
+                processed += 1
+            self.stdout.write(f'restored {processed}')
+            return
+
+        archived_bytes = 0
+        for run in queryset.filter(positions_archive='').iterator():
+            run.archive_positions()
+            processed += 1
+            archived_bytes += run.positions_archive.size
+            self.stdout.write(f'run {run.pk}: {run.positions_count} positions, '
+                              f'{run.positions_archive.size} bytes')
+        self.stdout.write(f'archived {processed}, {archived_bytes} bytes')
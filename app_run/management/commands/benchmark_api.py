@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from app_run import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочные сценарии API на тестовой базе (SQLite или Postgres из настроек): '
+            'p50/p95 задержки и число запросов на вызов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=f'сценарии: {", ".join(benchmarks.SCENARIOS)}; по умолчанию все')
+        parser.add_argument('--iterations', type=int, default=20)
+        for name, value in benchmarks.DEFAULT_SIZES.items():
+            parser.add_argument(f'--{name}', type=int, default=value)
+        parser.add_argument('--keepdb', action='store_true',
+                            help='не пересоздавать тестовую базу')
+        parser.add_argument('--json', dest='json_path',
+                            help='сохранить результаты в файл')
+        parser.add_argument('--baseline',
+                            help='сравнить с сохранённым ранее файлом результатов')
+        parser.add_argument('--tolerance', type=float, default=1.25,
+                            help='допустимый рост p95 относительно baseline')
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] for name in benchmarks.DEFAULT_SIZES}
+        scenarios = options['scenarios'] or list(benchmarks.SCENARIOS)
+        unknown = set(scenarios) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = {}
+            self.stdout.write(f'{"scenario":<18} {"requests":>8} {"p50, ms":>9} {"p95, ms":>9} '
+                              f'{"max, ms":>9} {"queries":>8} {"max q":>6}')
+            for name in scenarios:
+                result = benchmarks.run_scenario(name, sizes, options['iterations'])
+                results[name] = result
+                self.stdout.write(f'{name:<18} {result["requests"]:>8} {result["p50_ms"]:>9.2f} '
+                                  f'{result["p95_ms"]:>9.2f} {result["max_ms"]:>9.2f} '
+                                  f'{result["queries_avg"]:>8.2f} {result["queries_max"]:>6}')
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump({'sizes': sizes, 'results': results}, file, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def compare(self, results, path, tolerance):
+        with open(path) as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        for name, result in results.items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            if result['p95_ms'] > previous['p95_ms'] * tolerance:
+                regressions.append(f'{name}: p95 {previous["p95_ms"]} -> {result["p95_ms"]} ms')
+            if result['queries_max'] > previous['queries_max']:
+                regressions.append(f'{name}: queries {previous["queries_max"]} -> '
+                                   f'{result["queries_max"]}')
+        if regressions:
+            raise CommandError('Regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(f'no regressions against {path}')
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from app_run import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность приёма координат на тестовой базе при параллельных '
+            'клиентах: синхронный PositionViewSet (wsgi), async-представление (asgi) и '
+            'PositionViewSet с буфером отложенной записи (buffered)')
+
+    def add_arguments(self, parser):
+        # не choices: до Python 3.12 argparse отклоняет пустой список при nargs='*'
+        parser.add_argument('modes', nargs='*', metavar='{%s}' % ','.join(benchmarks.INGEST_MODES),
+                            help='по умолчанию все')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='координат от каждого клиента')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--items', type=int, default=10_000,
+                            help='артефактов в базе')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='не пересоздавать тестовую базу')
+        parser.add_argument('--json', dest='json_path',
+                            help='сохранить результаты в файл')
+
+    def handle(self, *args, **options):
+        modes = options['modes'] or list(benchmarks.INGEST_MODES)
+        unknown = [mode for mode in modes if mode not in benchmarks.INGEST_MODES]
+        if unknown:
+            raise CommandError(f'Unknown modes: {", ".join(unknown)}')
+        if connection.vendor == 'sqlite':
+            # общая in-memory база SQLite не ждёт блокировок между потоками:
+            # параллельные записи идут в файловую тестовую базу
+            test_settings = connection.settings_dict['TEST']
+            test_settings['NAME'] = os.path.join(tempfile.gettempdir(), 'benchmark_ingest.sqlite3')
+            connection.settings_dict['OPTIONS'].setdefault('transaction_mode', 'IMMEDIATE')
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = []
+            self.stdout.write(f'{"mode":<8} {"clients":>7} {"requests":>8} {"req/s":>8} '
+                              f'{"p50, ms":>9} {"p95, ms":>9} {"errors":>6} {"stored":>7}')
+            for concurrency in options['concurrency']:
+                for mode in modes:
+                    result = benchmarks.run_ingest_throughput(mode, options['requests'],
+                                                              concurrency, options['items'])
+                    results.append({'mode': mode, **result})
+                    self.stdout.write(f'{mode:<8} {concurrency:>7} {result["requests"]:>8} '
+                                      f'{result["throughput_rps"]:>8.1f} {result["p50_ms"]:>9.2f} '
+                                      f'{result["p95_ms"]:>9.2f} {result["errors"]:>6} {result["stored"]:>7}')
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump(results, file, indent=2)
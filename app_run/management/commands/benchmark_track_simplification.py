@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_run import geodistance, simplify, utils
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Сравнение уровней упрощения трека: число точек, отклонение в метрах и время расчёта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int,
+                            help='id забегов; без них используется синтетический трек')
+        parser.add_argument('--points', type=int, default=40000,
+                            help='число точек синтетического трека')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--zooms', nargs='+', type=int,
+                            default=sorted(settings.TRACK_SIMPLIFICATION_ZOOMS))
+
+    def handle(self, *args, **options):
+        if options['run_ids']:
+            tracks = [(f'run {run.pk}', run.get_track_rows('latitude', 'longitude'))
+                      for run in Run.objects.filter(pk__in=options['run_ids']).order_by('pk')]
+        else:
+            tracks = [(f'synthetic, seed {options["seed"]}',
+                       self.synthetic_track(options['points'], options['seed']))]
+
+        for name, coordinates in tracks:
+            self.benchmark(name, coordinates, options['zooms'])
+
+    def benchmark(self, name, coordinates, zooms):
+        tolerances = [simplify.get_zoom_tolerance(zoom) for zoom in zooms]
+        started = time.perf_counter()
+        levels = simplify.simplify(coordinates, tolerances)
+        elapsed = time.perf_counter() - started
+        full_size = len(utils.encode_polyline(coordinates))
+
+        self.stdout.write(f'{name}: {len(coordinates)} points, polyline {full_size} bytes, '
+                          f'simplified in {elapsed * 1000:.1f} ms')
+        self.stdout.write(f'{"zoom":>5} {"tolerance, m":>13} {"points":>8} {"reduction":>10} '
+                          f'{"max error, m":>13} {"polyline, b":>12}')
+        for zoom, tolerance, (indices, max_error) in zip(zooms, tolerances, levels):
+            reduction = 1 - len(indices) / len(coordinates) if coordinates else 0
+            size = len(utils.encode_polyline([coordinates[index] for index in indices]))
+            self.stdout.write(f'{zoom:>5} {tolerance:>13.2f} {len(indices):>8} {reduction:>10.1%} '
+                              f'{max_error:>13.2f} {size:>12}')
+
+    @staticmethod
+    def synthetic_track(points, seed):
+        """ Трек бегуна: шаг ~3 м в секунду, плавные повороты и шум GPS ~2 м """
+        generator = np.random.default_rng(seed)
+        heading = np.cumsum(generator.normal(0, 0.05, points))
+        step = 3 + generator.normal(0, 0.3, points)
+        north = np.cumsum(step * np.cos(heading)) + generator.normal(0, 2, points)
+        east = np.cumsum(step * np.sin(heading)) + generator.normal(0, 2, points)
+        latitude, longitude = 55.75, 37.62
+        latitudes = latitude + np.degrees(north / geodistance.MEAN_EARTH_RADIUS)
+        longitudes = longitude + np.degrees(east / (geodistance.MEAN_EARTH_RADIUS
+                                                    * np.cos(np.radians(latitude))))
+        return list(zip(latitudes.tolist(), longitudes.tolist()))
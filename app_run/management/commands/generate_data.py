@@ -0,0 +1,85 @@
+import multiprocessing
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from app_run import synthetic
+
+
+def init_worker():
+    django.setup()
+
+
+def create_runs(task):
+    return synthetic.create_runs(*task)
+
+
+class Command(BaseCommand):
+    help = ('Генерация синтетических данных production-объёма из seed: атлеты, тренеры, '
+            'подписки, забеги с правдоподобными треками и артефакты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--coaches', type=int, default=1_000,
+                            help='сколько из users будут тренерами')
+        parser.add_argument('--subscribed', type=float, default=0.5,
+                            help='доля атлетов с подпиской на тренера')
+        parser.add_argument('--runs', type=int, default=20_000)
+        parser.add_argument('--positions', type=int, default=250,
+                            help='медиана числа координат в забеге (5 секунд между точками)')
+        parser.add_argument('--items', type=int, default=20_000)
+        parser.add_argument('--batch-size', type=int, default=2_000)
+        parser.add_argument('--chunk', type=int, default=200,
+                            help='забегов в одной задаче процесса')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='процессов для забегов и координат (для Postgres)')
+        parser.add_argument('--clear', action='store_true',
+                            help='удалить ранее созданные с этим seed данные и выйти')
+
+    def handle(self, *args, **options):
+        seed, batch_size = options['seed'], options['batch_size']
+        if options['clear']:
+            self.stdout.write(f'deleted {synthetic.clear(seed)} objects')
+            return
+        if options['coaches'] >= options['users']:
+            raise CommandError('--coaches must be less than --users')
+        if synthetic.exists(seed):
+            raise CommandError(f'Data for --seed {seed} already exists, remove it with --clear first')
+        if options['processes'] > 1 and connection.vendor == 'sqlite':
+            self.stderr.write('SQLite allows a single writer, --processes only adds lock waits')
+
+        started = time.perf_counter()
+        coach_ids, athlete_ids = synthetic.create_users(seed, options['users'],
+                                                        options['coaches'], batch_size)
+        self.report(started, f'users: {len(coach_ids)} coaches, {len(athlete_ids)} athletes')
+
+        subscriptions = synthetic.create_subscriptions(seed, coach_ids, athlete_ids,
+                                                       options['subscribed'], batch_size)
+        self.report(started, f'subscriptions: {subscriptions}')
+
+        items = synthetic.create_items(seed, options['items'], batch_size)
+        self.report(started, f'items: {items}')
+
+        plan = synthetic.plan_runs(seed, athlete_ids, options['runs'])
+        tasks = [(seed, first, plan[first:first + options['chunk']], options['positions'], batch_size)
+                 for first in range(0, len(plan), options['chunk'])]
+        runs = positions = 0
+        for created_runs, created_positions in self.map(tasks, options['processes']):
+            runs += created_runs
+            positions += created_positions
+            self.report(started, f'runs: {runs}/{len(plan)}, positions: {positions}')
+
+    def map(self, tasks, processes):
+        if processes <= 1:
+            yield from map(create_runs, tasks)
+            return
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes, initializer=init_worker) as pool:
+            yield from pool.imap_unordered(create_runs, tasks)
+
+    def report(self, started, message):
+        self.stdout.write(f'[{time.perf_counter() - started:7.1f} s] {message}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app_run import jobs
+from app_run.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = 'Обработка очереди фонового импорта артефактов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='вернуть в очередь задания, завершившиеся ошибкой')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            retried = ImportJob.objects.filter(status='failed').update(status='pending', error='')
+            self.stdout.write(f'requeued {retried}')
+
+        processed = 0
+        while job := jobs.process_import_job():
+            processed += 1
+            self.stdout.write(f'job {job.pk}: {job.status}')
+        self.stdout.write(f'processed {processed}')
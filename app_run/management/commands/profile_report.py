@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run import profiling
+
+
+SORT_KEYS = ['cumulative', 'tottime', 'ncalls']
+
+
+class Command(BaseCommand):
+    help = ('Сводка дампов профилировщика запросов по маршрутам: top-N самых '
+            'затратных функций (или токен заголовка X-Profile-Token с --token)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*',
+                            help='имена маршрутов, например run-detail; по умолчанию все')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative')
+        parser.add_argument('--delete', action='store_true',
+                            help='удалить дампы после отчёта')
+        parser.add_argument('--token', action='store_true',
+                            help='вывести токен заголовка X-Profile-Token и выйти')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profiling.make_token())
+            return
+
+        profiles = profiling.list_profiles(options['endpoints'])
+        missing = set(options['endpoints']) - set(profiles)
+        if missing:
+            raise CommandError(f'No profiles for {", ".join(sorted(missing))}')
+
+        for endpoint, names in profiles.items():
+            if not names:
+                continue
+            stats = profiling.aggregate(names)
+            self.stdout.write(f'{endpoint}: {len(names)} requests, '
+                              f'{stats.total_tt:.3f} s total, '
+                              f'{stats.total_tt / len(names) * 1000:.1f} ms per request')
+            self.stdout.write(profiling.format_report(stats, options['top'], options['sort']))
+            if options['delete']:
+                storage = profiling.get_profile_storage()
+                for name in names:
+                    storage.delete(name)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.models import ChallengeSummary
+
+
+class Command(BaseCommand):
+    help = 'Пересборка итоговой таблицы челенджей'
+
+    def handle(self, *args, **options):
+        ChallengeSummary.rebuild()
+        self.stdout.write(f'challenges {ChallengeSummary.objects.count()}')
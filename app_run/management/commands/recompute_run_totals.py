@@ -0,0 +1,48 @@
+import math
+
+from django.core.management.base import BaseCommand
+
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Сверка накопленных итогов забегов с пересчётом по координатам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int,
+                            help='id забегов, по умолчанию все')
+        parser.add_argument('--fix', action='store_true',
+                            help='записать пересчитанные итоги при расхождении')
+
+    def handle(self, *args, **options):
+        queryset = Run.objects.order_by('pk')
+        if options['run_ids']:
+            queryset = queryset.filter(pk__in=options['run_ids'])
+
+        checked = mismatched = 0
+        for run in queryset.iterator():
+            checked += 1
+            totals = run.calc_totals()
+            if run.status == 'finished':
+                totals['distance'] = round(totals['distance'], 2)
+            differences = {field: (getattr(run, field), value)
+                           for field, value in totals.items()
+                           if not self.is_equal(getattr(run, field), value)}
+            if not differences:
+                continue
+
+            mismatched += 1
+            details = ', '.join(f'{field}: {stored} != {value}'
+                                for field, (stored, value) in differences.items())
+            self.stdout.write(f'run {run.pk}: {details}')
+            if options['fix']:
+                Run.objects.filter(pk=run.pk).update(**totals)
+
+        self.stdout.write(f'checked {checked}, mismatched {mismatched}'
+                          + (', fixed' if options['fix'] and mismatched else ''))
+
+    @staticmethod
+    def is_equal(stored, value):
+        if isinstance(stored, float) or isinstance(value, float):
+            return math.isclose(stored, value, rel_tol=1e-9, abs_tol=1e-6)
+        return stored == value
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app_run import ingest
+
+
+class Command(BaseCommand):
+    help = ('Сохранение координат из журнала буфера отложенной записи, оставшегося '
+            'после падения процессов или отброшенных пачек (сегменты, которые не '
+            'заблокированы работающими процессами)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('pids', nargs='*', type=int,
+                            help='только сегменты этих процессов')
+        parser.add_argument('--journal-dir',
+                            help='каталог журнала, по умолчанию POSITION_BUFFER_JOURNAL_DIR')
+
+    def handle(self, *args, **options):
+        segments, positions, saved = ingest.replay_journal(options['pids'] or None,
+                                                           options['journal_dir'])
+        self.stdout.write(f'segments {segments}, positions {positions}, saved {saved}, '
+                          f'skipped {positions - saved}')
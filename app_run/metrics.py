@@ -0,0 +1,83 @@
+""" Метрики Prometheus: задержки запросов по маршрутам и доменные события
+
+В нескольких процессах (gunicorn) значения пишутся в файлы каталога из
+переменной окружения PROMETHEUS_MULTIPROC_DIR, и экспорт суммирует их по всем
+воркерам. Каталог нужно очищать перед запуском сервера, а в хуке gunicorn
+child_exit вызывать mark_process_dead(worker.pid).
+"""
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                               Histogram, generate_latest, multiprocess)
+
+
+UNRESOLVED = 'unresolved'
+
+REQUEST_LATENCY = Histogram(
+    'app_run_request_duration_seconds', 'Время обработки запроса', ['route', 'method'])
+REQUEST_DB_TIME = Histogram(
+    'app_run_request_db_seconds', 'Время запросов к БД за запрос', ['route', 'method'])
+REQUEST_RENDER_TIME = Histogram(
+    'app_run_request_serialization_seconds', 'Время сериализации тела ответа рендерером DRF',
+    ['route', 'method'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf')))
+RESPONSES = Counter(
+    'app_run_responses', 'Ответы по кодам статуса', ['route', 'method', 'status'])
+
+POSITIONS_INGESTED = Counter('app_run_positions_ingested', 'Сохранённые координаты')
+RUNS_FINISHED = Counter('app_run_runs_finished', 'Завершённые забеги')
+ARTIFACTS_COLLECTED = Counter('app_run_artifacts_collected',
+                              'Артефакты в радиусе сбора от новых координат')
+CHALLENGES_AWARDED = Counter('app_run_challenges_awarded', 'Выданные челенджи')
+CACHE_LOOKUPS = Counter('app_run_cache_lookups', 'Обращения к кэшу ответов', ['cache', 'result'])
+POSITION_BUFFER_FLUSH_SIZE = Histogram(
+    'app_run_position_buffer_flush_size', 'Координат в сбросе буфера отложенной записи',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, float('inf')))
+POSITION_BUFFER_DROPPED = Counter(
+    'app_run_position_buffer_dropped',
+    'Координаты, убранные из буфера после неудачных сбросов (остаются в журнале)')
+
+
+def get_route(request):
+    """ Имя маршрута запроса: ограниченный набор значений метки route """
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else UNRESOLVED
+
+
+def check_token(request):
+    """ Заголовок Authorization: Bearer <METRICS_TOKEN>; без токена в настройках -- отказ """
+    token = settings.METRICS_TOKEN
+    return bool(token) and constant_time_compare(request.headers.get('Authorization', ''),
+                                                 f'Bearer {token}')
+
+
+def inc_on_commit(counter, amount=1):
+    """ Учёт события после фиксации транзакции, чтобы откаты не попадали в счётчик """
+    if amount:
+        transaction.on_commit(lambda: counter.inc(amount))
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def get_value(name, **labels):
+    """ Текущее значение метрики по всем процессам; 0, если её ещё не было """
+    return get_registry().get_sample_value(name, labels) or 0
+
+
+def export():
+    """ (тело, Content-Type) в текстовом формате Prometheus """
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
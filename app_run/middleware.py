@@ -0,0 +1,211 @@
+import collections
+import contextlib
+import cProfile
+import random
+import time
+import types
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from app_run import metrics, profiling
+
+
+class QueryStats:
+    """ Запросы к БД за время HTTP-запроса: число, суммарное время и повторы
+
+    Используется как execute_wrapper соединений, поэтому работает и без DEBUG.
+    Повтор -- тот же SQL с теми же параметрами (например, двойной get_object),
+    похожие -- тот же SQL с любыми параметрами (запрос в цикле, N+1).
+    Повторы считаются только с track_repeated: число и время -- всегда.
+    """
+    def __init__(self, track_repeated=True):
+        self.count = 0
+        self.time = 0.0
+        self.track_repeated = track_repeated
+        self.statements = collections.Counter()
+        self.queries = collections.Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            if self.track_repeated:
+                self.statements[sql] += 1
+                self.queries[sql, repr(params)] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.queries.values())
+
+    @property
+    def similar(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def get_repeated(self):
+        """ SQL, выполненный больше одного раза, с числом выполнений """
+        return {sql: count for sql, count in self.statements.most_common() if count > 1}
+
+    def get_headers(self):
+        return {
+            'X-DB-Query-Count': str(self.count),
+            'X-DB-Time-Ms': f'{self.time * 1000:.2f}',
+            'X-DB-Duplicate-Queries': str(self.duplicates),
+            'X-DB-Similar-Queries': str(self.similar),
+        }
+
+
+@contextlib.contextmanager
+def capture_query_stats(track_repeated=True):
+    """ Сбор QueryStats по всем соединениям в пределах блока """
+    stats = QueryStats(track_repeated)
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        yield stats
+
+
+class HookMiddleware:
+    """ Основа middleware, работающих и в sync (WSGI), и в async (ASGI) цепочке
+
+    Подкласс реализует контекстный менеджер process(request), который отдаёт
+    объект с полем response; после выхода из блока ответ уже заполнен.
+    Async-представления при этом не переводятся в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with self.process(request) as result:
+            result.response = self.get_response(request)
+        return result.response
+
+    async def __acall__(self, request):
+        with self.process(request) as result:
+            result.response = await self.get_response(request)
+        return result.response
+
+
+class QueryStatsMiddleware:
+    """ Статистика запросов к БД за HTTP-запрос
+
+    Доступна представлениям и тестам как request.query_stats, а при
+    QUERY_STATS_HEADERS (по умолчанию в DEBUG) отдаётся в заголовках X-DB-*,
+    тогда же считаются повторы. Запросы потокового ответа выполняются после
+    middleware и не учитываются.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with capture_query_stats(settings.QUERY_STATS_HEADERS) as stats:
+            request.query_stats = stats
+            response = self.get_response(request)
+        return self.add_headers(response, stats)
+
+    async def __acall__(self, request):
+        # соединения с БД привязаны к потоку: в async-цепочке запросы идут
+        # в потоке sync_to_async, и обёртки ставятся там же
+        context = capture_query_stats(settings.QUERY_STATS_HEADERS)
+        stats = await sync_to_async(context.__enter__)()
+        try:
+            request.query_stats = stats
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(context.__exit__)(None, None, None)
+        return self.add_headers(response, stats)
+
+    def add_headers(self, response, stats):
+        if settings.QUERY_STATS_HEADERS:
+            for header, value in stats.get_headers().items():
+                response.headers[header] = value
+        return response
+
+
+class ProfilingMiddleware(HookMiddleware):
+    """ Профилирование запроса cProfile по запросу или выборочно
+
+    Профилируются запросы с действующим токеном в заголовке X-Profile-Token
+    (команда profile_report --token) и доля PROFILING_SAMPLE_RATE остальных.
+    Дамп сохраняется в хранилище 'profiles', его имя -- в заголовке X-Profile.
+    В async-цепочке учитывается только код, выполняемый в потоке цикла событий.
+    """
+    def should_profile(self, request):
+        token = request.headers.get(profiling.TOKEN_HEADER)
+        if token:
+            return profiling.check_token(token)
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    @contextlib.contextmanager
+    def process(self, request):
+        result = types.SimpleNamespace(response=None)
+        if not self.should_profile(request):
+            yield result
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # уже работает другой профилировщик
+            yield result
+            return
+        try:
+            yield result
+        finally:
+            profiler.disable()
+        result.response.headers['X-Profile'] = profiling.save_profile(
+            profiler, profiling.get_endpoint(request))
+
+
+class MetricsMiddleware(HookMiddleware):
+    """ Метрики запроса: задержка, время БД и сериализации, код ответа
+
+    Время БД берётся из request.query_stats (QueryStatsMiddleware должен
+    стоять ниже), время сериализации -- от вызова process_template_response
+    до окончания рендеринга ответа DRF.
+    """
+    @contextlib.contextmanager
+    def process(self, request):
+        result = types.SimpleNamespace(response=None)
+        started = time.perf_counter()
+        yield result
+        duration = time.perf_counter() - started
+
+        route, method = metrics.get_route(request), request.method
+        metrics.REQUEST_LATENCY.labels(route, method).observe(duration)
+        stats = getattr(request, 'query_stats', None)
+        if stats is not None:
+            metrics.REQUEST_DB_TIME.labels(route, method).observe(stats.time)
+        metrics.RESPONSES.labels(route, method, result.response.status_code).inc()
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def observe(response):
+            metrics.REQUEST_RENDER_TIME.labels(metrics.get_route(request), request.method) \
+                                       .observe(time.perf_counter() - started)
+
+        response.add_post_render_callback(observe)
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 17:04
+
+from django.conf import settings
+import math
+
+from django.db import migrations, models
+
+
+# копия app_run.utils на момент миграции: дальнейшие изменения не должны её менять
+GRID_CELL_DEGREES = 0.01
+
+
+def get_grid_cell(latitude, longitude):
+    return (math.floor(float(latitude) / GRID_CELL_DEGREES),
+            math.floor(float(longitude) / GRID_CELL_DEGREES))
+
+
+def set_grid_cells(apps, schema_editor):
+    CollectibleItem = apps.get_model('app_run', 'CollectibleItem')
+    items = list(CollectibleItem.objects.all())
+    for item in items:
+        item.cell_latitude, item.cell_longitude = get_grid_cell(item.latitude, item.longitude)
+    CollectibleItem.objects.bulk_update(items, ['cell_latitude', 'cell_longitude'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0028_rename_raiting_subscribe_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='cell_latitude',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='cell_longitude',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_grid_cells, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='collectibleitem',
+            index=models.Index(fields=['cell_latitude', 'cell_longitude'], name='app_run_col_cell_la_6a6f2b_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-18 17:07
+
+from django.db import migrations, models
+from geopy import distance
+
+
+# копия app_run.utils.get_track_totals на момент миграции с дистанцией по geodesic
+def get_track_totals(rows):
+    rows = list(rows)
+    coordinates = [(row[0], row[1]) for row in rows]
+    dates = [row[2] for row in rows if row[2] is not None]
+    return {
+        'distance': sum(distance.geodesic(start, end).km
+                        for start, end in zip(coordinates, coordinates[1:])),
+        'positions_count': len(rows),
+        'speed_sum': sum(row[3] or 0 for row in rows),
+        'first_position_at': min(dates) if dates else None,
+        'last_position_at': max(dates) if dates else None,
+    }
+
+
+def set_run_totals(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    Position = apps.get_model('app_run', 'Position')
+    for run in Run.objects.all().iterator():
+        rows = Position.objects.filter(run=run) \
+                               .order_by('pk') \
+                               .values_list('latitude', 'longitude', 'date_time', 'speed')
+        totals = get_track_totals(rows)
+        if run.status == 'finished':
+            del totals['distance']
+        Run.objects.filter(pk=run.pk).update(**totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0029_collectibleitem_grid_cell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='first_position_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_position_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='positions_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='speed_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_run_totals, migrations.RunPython.noop),
+    ]
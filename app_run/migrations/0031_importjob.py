@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 17:10
+
+import app_run.models
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0030_run_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(storage=app_run.models.get_imports_storage, upload_to='')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending')),
+                ('rows_read', models.IntegerField(default=0, editable=False)),
+                ('rows_processed', models.IntegerField(default=0)),
+                ('rows_failed', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('lease_token', models.UUIDField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportJobErrorRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors_row', to='app_run.importjob')),
+            ],
+        ),
+    ]
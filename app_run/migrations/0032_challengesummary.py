@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_challenge_summary(apps, schema_editor):
+    Challenge = apps.get_model('app_run', 'Challenge')
+    ChallengeSummary = apps.get_model('app_run', 'ChallengeSummary')
+    ChallengeSummaryAthlete = apps.get_model('app_run', 'ChallengeSummaryAthlete')
+    records = {}
+    queryset = Challenge.objects.filter(athlete__is_staff=False) \
+                                .order_by('full_name', 'pk') \
+                                .values_list('full_name', 'athlete_id')
+    for full_name, athlete_id in queryset.iterator():
+        records.setdefault(full_name, []).append(athlete_id)
+    summaries = ChallengeSummary.objects.bulk_create([
+        ChallengeSummary(full_name=full_name, athletes_count=len(athlete_ids))
+        for full_name, athlete_ids in records.items()])
+    ChallengeSummaryAthlete.objects.bulk_create(
+        [ChallengeSummaryAthlete(summary_id=summary.pk, athlete_id=athlete_id)
+         for summary in summaries for athlete_id in records[summary.full_name]],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0031_importjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_name', models.CharField(unique=True)),
+                ('athletes_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChallengeSummaryAthlete',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('summary', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='athletes', to='app_run.challengesummary')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['summary', 'id'], name='app_run_cha_summary_5d229c_idx')],
+            },
+        ),
+        migrations.RunPython(build_challenge_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 17:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def set_coach_ratings(apps, schema_editor):
+    Subscribe = apps.get_model('app_run', 'Subscribe')
+    CoachRating = apps.get_model('app_run', 'CoachRating')
+    ratings = Subscribe.objects.filter(rating__isnull=False) \
+                               .values('coach_id') \
+                               .annotate(rating_sum=Sum('rating'), rating_count=Count('rating'))
+    CoachRating.objects.bulk_create([CoachRating(coach_id=obj['coach_id'],
+                                                 rating_sum=obj['rating_sum'],
+                                                 rating_count=obj['rating_count'])
+                                     for obj in ratings])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0032_challengesummary'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoachRating',
+            fields=[
+                ('coach', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='coach_rating', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(set_coach_ratings, migrations.RunPython.noop),
+    ]
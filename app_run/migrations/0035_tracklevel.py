@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 17:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0034_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackLevel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('tolerance', models.FloatField()),
+                ('points', models.IntegerField()),
+                ('max_error', models.FloatField()),
+                ('polyline', models.TextField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_levels', to='app_run.run')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('run', 'zoom'), name='unique_run_track_level')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 17:19
+
+import app_run.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0035_tracklevel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='positions_archive',
+            field=models.FileField(blank=True, editable=False, storage=app_run.models.get_archive_storage, upload_to='positions/'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0036_run_positions_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceVersion',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 18:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+from app_run import archive
+
+
+def fill_archive_ids(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    for run in Run.objects.exclude(positions_archive='').iterator():
+        with run.positions_archive.open('rb') as file:
+            ids = [row[0] for row in archive.unpack(file.read())]
+        Run.objects.filter(pk=run.pk).update(positions_archive_first_id=min(ids, default=None),
+                                             positions_archive_last_id=max(ids, default=None))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0037_resource_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='positions_archive_first_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='positions_archive_last_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['positions_archive_first_id', 'positions_archive_last_id'], name='app_run_run_positio_06f966_idx'),
+        ),
+        migrations.RunPython(fill_archive_ids, migrations.RunPython.noop),
+    ]
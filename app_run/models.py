@@ -1,8 +1,34 @@
-from django.db import models
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Cast, Coalesce, Floor, Greatest, Least
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 
-from app_run import utils
+from app_run import archive, geodistance, metrics, simplify, utils
+
+
+COLLECT_RADIUS_METERS = 100
+
+
+def get_archive_storage():
+    return storages['archive']
+
+
+def get_imports_storage():
+    return storages['imports']
+
+
+class RunNotInProgress(ValueError):
+    """ Координаты пришли в забег, который не в процессе (например, уже завершён) """
 
 
 class Run(models.Model):
@@ -20,15 +46,391 @@ class Run(models.Model):
     status = models.CharField(choices=STATUS_CHOICES, default='init')
     distance = models.FloatField(blank=True, default=0)
     created_at = models.DateTimeField(auto_now_add=True)    
+    updated_at = models.DateTimeField(auto_now=True)
     run_time_seconds = models.IntegerField(blank=True, default=0)
     speed = models.FloatField(blank=True, default=0)
+    positions_count = models.IntegerField(default=0, editable=False)
+    speed_sum = models.FloatField(default=0, editable=False)
+    first_position_at = models.DateTimeField(blank=True, null=True, editable=False)
+    last_position_at = models.DateTimeField(blank=True, null=True, editable=False)
+    positions_archive = models.FileField(storage=get_archive_storage,
+                                         upload_to='positions/',
+                                         blank=True,
+                                         editable=False)
+    positions_archive_first_id = models.BigIntegerField(blank=True, null=True, editable=False)
+    positions_archive_last_id = models.BigIntegerField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['positions_archive_first_id', 'positions_archive_last_id']),
+        ]
+
+    def get_run_time_seconds(self):
+        if self.first_position_at is None or self.last_position_at is None:
+            return 0
+        return utils.get_seconds_between_dates(self.last_position_at, self.first_position_at)
+
+    def get_avg_speed(self):
+        if self.first_position_at is None or not self.positions_count:
+            return 0
+        return self.speed_sum / self.positions_count
+
+    def get_finish_values(self):
+        """ Итоговые значения полей завершённого забега """
+        return {
+            'status': 'finished',
+            'distance': round(self.distance, 2),
+            'run_time_seconds': self.get_run_time_seconds(),
+            'speed': self.get_avg_speed(),
+        }
+
+    def finish(self):
+        """ Завершение забега по накопленным итогам """
+        values = self.get_finish_values()
+        for field, value in values.items():
+            setattr(self, field, value)
+        self.save(update_fields=[*values, 'updated_at'])
+        self.on_finished()
+
+    def on_finished(self):
+        self.award_challenges()
+        metrics.inc_on_commit(metrics.RUNS_FINISHED)
+
+    def award_challenges(self):
+        """ Челенджи атлета, заработанные завершением забега """
+        totals = Run.objects.filter(athlete_id=self.athlete_id, status='finished') \
+                            .aggregate(total_finished=models.Count('id'),
+                                       total_distance=models.Sum('distance'))
+
+        awarded = []
+        if totals['total_finished'] == 10:
+            awarded.append(Challenge.objects.create(athlete_id=self.athlete_id,
+                                                    full_name='Сделай 10 Забегов!'))
+        if totals['total_distance'] >= 50:
+            awarded.append(Challenge.objects.create(athlete_id=self.athlete_id,
+                                                    full_name='Пробеги 50 километров!'))
+        if self.distance >= 2 and self.run_time_seconds <= 600:
+            awarded.append(Challenge.objects.create(athlete_id=self.athlete_id,
+                                                    full_name='2 километра за 10 минут!'))
+        metrics.inc_on_commit(metrics.CHALLENGES_AWARDED, len(awarded))
+        return awarded
+
+    def get_track_rows(self, *fields):
+        """ Поля координат забега в порядке (date_time, id), в том числе из архива """
+        if self.positions_archive:
+            indexes = [archive.FIELDS.index(field) for field in fields]
+            return [tuple(row[index] for index in indexes) for row in self.get_archived_rows()]
+        return list(self.positions.order_by('date_time', 'id').values_list(*fields))
+
+    def get_archived_rows(self):
+        with self.positions_archive.open('rb') as file:
+            return archive.unpack(file.read())
+
+    def get_archived_positions(self):
+        """ Координаты из архива в виде несохранённых объектов Position """
+        return [Position(run=self, **dict(zip(archive.FIELDS, row)))
+                for row in self.get_archived_rows()]
+
+    def archive_positions(self):
+        """ Перенос координат завершённого забега из таблицы в архив """
+        if self.status != 'finished':
+            raise ValueError(f'Run {self.pk} is not finished')
+        if self.positions_archive:
+            return
+        with transaction.atomic():
+            run = Run.objects.select_for_update().only('id', 'positions_archive').get(pk=self.pk)
+            if run.positions_archive:
+                self.positions_archive = run.positions_archive.name
+                return
+            rows = self.get_track_rows(*archive.FIELDS)
+            ids = [row[0] for row in rows]
+            self.positions_archive_first_id = min(ids, default=None)
+            self.positions_archive_last_id = max(ids, default=None)
+            self.positions_archive.save(f'{self.pk}.npz', ContentFile(archive.pack(rows)), save=False)
+            try:
+                Run.objects.filter(pk=self.pk).update(positions_archive=self.positions_archive.name,
+                                                      positions_archive_first_id=self.positions_archive_first_id,
+                                                      positions_archive_last_id=self.positions_archive_last_id)
+                self.positions.all().delete()
+            except Exception:
+                # файл без ссылки на него не остаётся
+                self.positions_archive.delete(save=False)
+                raise
+
+    def restore_positions(self):
+        """ Возврат координат из архива в таблицу """
+        if not self.positions_archive:
+            return
+        positions = self.get_archived_positions()
+        name, storage = self.positions_archive.name, self.positions_archive.storage
+        with transaction.atomic():
+            Position.objects.bulk_create(positions)
+            Run.objects.filter(pk=self.pk).update(positions_archive='',
+                                                  positions_archive_first_id=None,
+                                                  positions_archive_last_id=None)
+            transaction.on_commit(lambda: storage.delete(name))
+        self.positions_archive = ''
+        self.positions_archive_first_id = self.positions_archive_last_id = None
+
+    @classmethod
+    def get_archived_position(cls, position_id):
+        """ Координата из архива по id, архивы отбираются по диапазону id координат """
+        runs = cls.objects.exclude(positions_archive='') \
+                          .filter(positions_archive_first_id__lte=position_id,
+                                  positions_archive_last_id__gte=position_id)
+        for run in runs:
+            for position in run.get_archived_positions():
+                if position.id == position_id:
+                    return position
+        return None
+
+    def get_track(self):
+        """ Трек забега: encoded polyline и delta-кодированные время (мс) и скорость (см/с) """
+        rows = self.get_track_rows('latitude', 'longitude', 'date_time', 'speed')
+        timestamps = [round(row[2].timestamp() * 1000) if row[2] else None for row in rows]
+        return {
+            'run': self.id,
+            'points': len(rows),
+            'precision': utils.POLYLINE_PRECISION,
+            'polyline': utils.encode_polyline([(row[0], row[1]) for row in rows],
+                                              utils.POLYLINE_PRECISION),
+            'timestamps': utils.delta_encode(timestamps),
+            'speeds': utils.delta_encode([round((row[3] or 0) * 100) for row in rows]),
+        }
+
+    def simplify_track(self, tolerances, coordinates=None):
+        """ Упрощённые варианты трека для списка допусков в метрах """
+        if coordinates is None:
+            coordinates = self.get_track_rows('latitude', 'longitude')
+        levels = []
+        for tolerance, (indices, max_error) in zip(tolerances,
+                                                   simplify.simplify(coordinates, tolerances)):
+            levels.append(TrackLevel(run=self,
+                                     tolerance=tolerance,
+                                     points=len(indices),
+                                     max_error=max_error,
+                                     polyline=utils.encode_polyline([coordinates[index]
+                                                                     for index in indices],
+                                                                    utils.POLYLINE_PRECISION)))
+        return levels
+
+    def build_track_levels(self):
+        """ Предрасчёт уровней детализации трека для масштабов TRACK_SIMPLIFICATION_ZOOMS
+
+        Уровни, уже сохранённые параллельным запросом, не перезаписываются.
+        """
+        zooms = sorted(settings.TRACK_SIMPLIFICATION_ZOOMS)
+        levels = self.simplify_track([simplify.get_zoom_tolerance(zoom) for zoom in zooms])
+        for zoom, level in zip(zooms, levels):
+            level.zoom = zoom
+        with transaction.atomic():
+            self.track_levels.all().delete()
+            return TrackLevel.objects.bulk_create(levels, ignore_conflicts=True)
+
+    def calc_totals(self):
+        """ Итоги забега, пересчитанные по всем координатам """
+        rows = sorted(self.get_track_rows('id', 'latitude', 'longitude', 'date_time', 'speed'))
+        return utils.get_track_totals([row[1:] for row in rows])
 
-    def get_total_distance(self):
-        coordinates = [(obj.latitude, obj.longitude) for obj in self.positions.all()]
-        return utils.get_distance_in_km(coordinates)
+    def recompute_totals(self, positions=None):
+        """ Пересчёт накопленных итогов забега по всем координатам
+
+        positions -- уже прочитанные координаты забега в порядке записи.
+        """
+        if positions is None:
+            totals = self.calc_totals()
+        else:
+            totals = utils.get_track_totals([(position.latitude, position.longitude,
+                                              position.date_time, position.speed)
+                                             for position in positions])
+        Run.objects.filter(pk=self.pk).update(**totals, updated_at=timezone.now())
+        for field, value in totals.items():
+            setattr(self, field, value)
+        return totals
+
+    @transaction.atomic
+    def delete_position(self, position):
+        """ Удаление координаты забега в процессе с пересчётом цепочки и итогов
+
+        Дистанция и скорость оставшихся координат пересчитываются заново, чтобы
+        следующая координата продолжила цепочку без удалённой точки.
+        """
+        run = Run.objects.select_for_update().only('id', 'status').get(pk=self.pk)
+        if run.status != 'in_progress':
+            raise RunNotInProgress(f'Run {self.pk} is {run.status}')
+        position.delete()
+        positions = list(self.positions.order_by('pk'))
+        if positions:
+            positions[0].distance = positions[0].speed = 0
+            self.chain_positions(positions)
+            Position.objects.bulk_update(positions, ['distance', 'speed'], batch_size=1000)
+        self.recompute_totals(positions)
+
+    def update_totals(self, positions):
+        """ Учёт новых координат в накопленных итогах забега """
+        if not positions:
+            return
+        values = {
+            'distance': positions[-1].distance,
+            'positions_count': models.F('positions_count') + len(positions),
+            'speed_sum': models.F('speed_sum') + sum(position.speed for position in positions),
+            'updated_at': timezone.now(),
+        }
+        dates = [position.date_time for position in positions if position.date_time is not None]
+        if dates:
+            values['first_position_at'] = Least(Coalesce('first_position_at', min(dates)), min(dates))
+            values['last_position_at'] = Greatest(Coalesce('last_position_at', max(dates)), max(dates))
+        Run.objects.filter(pk=self.pk).update(**values)
+
+    def chain_positions(self, positions, last_position=None):
+        """ Расчёт дистанции и скорости новых координат относительно предыдущих """
+        previous = last_position
+        track = [last_position, *positions] if last_position else positions
+        segments = iter(geodistance.segment_distances([obj.latitude for obj in track],
+                                                      [obj.longitude for obj in track]))
+        for position in positions:
+            position.run = self
+            if previous:
+                distance_last_position = next(segments) / 1000
+                position.distance = distance_last_position + previous.distance
+                position.speed = utils.get_speed(distance_last_position,
+                                                 position.date_time,
+                                                 previous.date_time)
+            previous = position
+        return positions
+
+    def add_positions(self, positions, skip_stale=False):
+        """ Добавление координат в забег одной транзакцией """
+        with transaction.atomic():
+            positions = self.save_positions(positions, skip_stale)
+            self.collect_items(positions)
+        return positions
+
+    async def aadd_positions(self, positions, skip_stale=False):
+        """ Асинхронный add_positions
+
+        Транзакции в async ORM не поддерживаются, поэтому координаты и итоги
+        забега сохраняются одной транзакцией в потоке, а сбор артефактов
+        (идемпотентный) выполняется после неё через async ORM.
+        """
+        positions = await sync_to_async(self.save_positions)(positions, skip_stale)
+        await self.acollect_items(positions)
+        return positions
+
+    def prepare_positions(self, positions, last_position, skip_stale=False):
+        """ Новые координаты после last_position с рассчитанными дистанцией и скоростью """
+        if skip_stale and last_position and last_position.date_time:
+            positions = [obj for obj in positions
+                         if obj.date_time and obj.date_time > last_position.date_time]
+        return self.chain_positions(positions, last_position)
+
+    @transaction.atomic(savepoint=False)
+    def save_positions(self, positions, skip_stale=False):
+        """ Сохранение координат после последней и учёт их в итогах забега одной транзакцией
+
+        Строка забега блокируется до чтения последней координаты, поэтому
+        параллельные загрузки (и повторы пакета) в один забег выполняются по
+        очереди и не продолжают цепочку от одной и той же точки. Статус
+        проверяется под блокировкой: забег мог завершиться после валидации.
+        """
+        run = Run.objects.select_for_update().only('id', 'status').get(pk=self.pk)
+        if run.status != 'in_progress':
+            raise RunNotInProgress(f'Run {self.pk} is {run.status}')
+        positions = self.prepare_positions(positions, self.positions.last(), skip_stale)
+        positions = Position.objects.bulk_create(positions)
+        self.update_totals(positions)
+        metrics.inc_on_commit(metrics.POSITIONS_INGESTED, len(positions))
+        return positions
+
+    def collect_items(self, positions):
+        """ Сбор артефактов, находящихся рядом с координатами атлета """
+        Run.collect_items_for_runs([(self, positions)])
+
+    @staticmethod
+    def collect_items_for_runs(runs_positions):
+        """ collect_items для пар (забег, координаты): одна выборка артефактов на все забеги """
+        coordinates = {run.pk: [(position.latitude, position.longitude) for position in positions]
+                       for run, positions in runs_positions}
+        candidates = list(CollectibleItem.objects.nearby(
+            [point for points in coordinates.values() for point in points], COLLECT_RADIUS_METERS))
+        pairs = set()
+        for run, _ in runs_positions:
+            collected = utils.find_within_radius(coordinates[run.pk], candidates,
+                                                 COLLECT_RADIUS_METERS)
+            pairs.update((run.athlete_id, artifact_id) for artifact_id in collected)
+        if not pairs:
+            return
+        pairs.difference_update(Run.get_collected_pairs(pairs))
+        CollectibleItem.user.through.objects.bulk_create(Run.get_item_links(pairs),
+                                                         ignore_conflicts=True)
+        metrics.inc_on_commit(metrics.ARTIFACTS_COLLECTED, len(pairs))
+
+    async def acollect_items(self, positions):
+        """ Асинхронный collect_items вне транзакции """
+        coordinates = [(position.latitude, position.longitude) for position in positions]
+        candidates = [artifact async for artifact
+                      in CollectibleItem.objects.nearby(coordinates, COLLECT_RADIUS_METERS)]
+        pairs = {(self.athlete_id, artifact_id) for artifact_id
+                 in utils.find_within_radius(coordinates, candidates, COLLECT_RADIUS_METERS)}
+        if not pairs:
+            return
+        pairs.difference_update([pair async for pair in Run.get_collected_pairs(pairs)])
+        await CollectibleItem.user.through.objects.abulk_create(Run.get_item_links(pairs),
+                                                                ignore_conflicts=True)
+        metrics.ARTIFACTS_COLLECTED.inc(len(pairs))
+
+    @staticmethod
+    def get_collected_pairs(pairs):
+        """ Уже собранные из пар (атлет, артефакт): в метрике учитываются только новые """
+        return CollectibleItem.user.through.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            collectibleitem_id__in={artifact_id for _, artifact_id in pairs},
+        ).values_list('user_id', 'collectibleitem_id')
+
+    @staticmethod
+    def get_item_links(pairs):
+        return [CollectibleItem.user.through(user_id=user_id, collectibleitem_id=artifact_id)
+                for user_id, artifact_id in pairs]
+
+
+@receiver(post_delete, sender=Run)
+def delete_positions_archive(sender, instance, **kwargs):
+    """ Архив координат удаляется вместе с забегом, в том числе каскадно """
+    if instance.positions_archive:
+        name, storage = instance.positions_archive.name, instance.positions_archive.storage
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+class TrackLevel(models.Model):
+    """ Упрощённый трек забега для масштаба карты """
+    run = models.ForeignKey(Run,
+                            on_delete=models.CASCADE,
+                            related_name='track_levels')
+    zoom = models.PositiveSmallIntegerField(blank=True, null=True)
+    tolerance = models.FloatField()
+    points = models.IntegerField()
+    max_error = models.FloatField()
+    polyline = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'zoom'], name='unique_run_track_level'),
+        ]
+
+    def get_track(self):
+        return {
+            'run': self.run_id,
+            'zoom': self.zoom,
+            'tolerance': self.tolerance,
+            'max_error': self.max_error,
+            'points': self.points,
+            'precision': utils.POLYLINE_PRECISION,
+            'polyline': self.polyline,
+        }
 
     def __str__(self):
-        return f'run: {self.id}, {self.athlete_id}: {self.athlete.username}, STATUS {self.status}'
+        return f'run: {self.run_id}, zoom {self.zoom}, points {self.points}'
 
 
 class AthleteInfo(models.Model):
@@ -51,10 +453,90 @@ class Challenge(models.Model):
                                 related_name='challenges')
     full_name = models.CharField()
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                ChallengeSummary.add_athlete(self.full_name, self.athlete_id)
+
     def __str__(self):
         return f'{self.athlete_id}: {self.athlete.username}, full_name {self.full_name}'
 
 
+class ChallengeSummary(models.Model):
+    """ Итоговая таблица челенджей: челендж и число получивших его атлетов
+
+    Атлеты хранятся строками ChallengeSummaryAthlete в порядке награждения и
+    читаются постранично; rebuild() собирает таблицу заново.
+    """
+    full_name = models.CharField(unique=True)
+    athletes_count = models.IntegerField(default=0)
+
+    @classmethod
+    def add_athlete(cls, full_name, athlete_id):
+        """ Вызывается внутри транзакции награждения (Challenge.save)
+
+        Строка добавляется и для персонала, но не учитывается в athletes_count
+        и не выводится (см. get_athletes).
+        """
+        summary, _ = cls.objects.get_or_create(full_name=full_name)
+        ChallengeSummaryAthlete.objects.create(summary=summary, athlete_id=athlete_id)
+        is_athlete = models.Exists(User.objects.filter(pk=athlete_id, is_staff=False))
+        cls.objects.filter(pk=summary.pk).update(
+            athletes_count=models.F('athletes_count') + models.Case(
+                models.When(is_athlete, then=1), default=0))
+        ResourceVersion.bump(ResourceVersion.CHALLENGE_SUMMARY)
+
+    @staticmethod
+    def get_athletes(start=0, size=None):
+        """ Строки атлетов для prefetch: страница [start, start + size) каждого челенджа """
+        queryset = ChallengeSummaryAthlete.objects.select_related('athlete') \
+                                                  .filter(athlete__is_staff=False) \
+                                                  .order_by('pk')
+        return queryset[start:start + size] if size else queryset
+
+    @classmethod
+    def rebuild(cls):
+        records = {}
+        queryset = Challenge.objects.filter(athlete__is_staff=False) \
+                                    .order_by('full_name', 'pk') \
+                                    .values_list('full_name', 'athlete_id')
+        for full_name, athlete_id in queryset.iterator():
+            records.setdefault(full_name, []).append(athlete_id)
+        with transaction.atomic():
+            cls.objects.all().delete()
+            summaries = cls.objects.bulk_create([cls(full_name=full_name,
+                                                     athletes_count=len(athlete_ids))
+                                                 for full_name, athlete_ids in records.items()])
+            ChallengeSummaryAthlete.objects.bulk_create(
+                [ChallengeSummaryAthlete(summary=summary, athlete_id=athlete_id)
+                 for summary in summaries for athlete_id in records[summary.full_name]],
+                batch_size=1000)
+            ResourceVersion.bump(ResourceVersion.CHALLENGE_SUMMARY)
+
+    def __str__(self):
+        return f'full_name {self.full_name}, athletes {self.athletes_count}'
+
+
+class ChallengeSummaryAthlete(models.Model):
+    """ Атлет, получивший челендж, в итоговой таблице """
+    summary = models.ForeignKey(ChallengeSummary,
+                                on_delete=models.CASCADE,
+                                related_name='athletes')
+    athlete = models.ForeignKey(User,
+                                on_delete=models.CASCADE,
+                                related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['summary', 'id']),
+        ]
+
+    def __str__(self):
+        return f'summary {self.summary_id}, athlete {self.athlete_id}'
+
+
 class Position(models.Model):
     """ Координаты атлета """
     run = models.ForeignKey(Run,
@@ -71,11 +553,67 @@ class Position(models.Model):
     speed = models.FloatField(blank=True, default=0)
     distance = models.FloatField(blank=True, default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'date_time', 'id']),
+        ]
+
     def __str__(self):
         return (f'run: {self.run_id}, {self.run.athlete.id}: {self.run.athlete.username}, '
                 f'latitude {self.latitude}, longitude {self.longitude}, ')
 
 
+class CollectibleItemQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            obj.set_grid_cell()
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            ResourceVersion.bump(ResourceVersion.COLLECTIBLE_ITEMS)
+        return objs
+
+    def update(self, **kwargs):
+        # ячейка сетки пересчитывается вместе с координатой, иначе индекс устареет
+        for field, cell_field in (('latitude', 'cell_latitude'), ('longitude', 'cell_longitude')):
+            if field in kwargs and cell_field not in kwargs:
+                kwargs[cell_field] = self.get_cell_value(kwargs[field])
+        rows = super().update(**kwargs)
+        if rows:
+            ResourceVersion.bump(ResourceVersion.COLLECTIBLE_ITEMS)
+        return rows
+
+    def delete(self):
+        deleted, rows = super().delete()
+        if deleted:
+            ResourceVersion.bump(ResourceVersion.COLLECTIBLE_ITEMS)
+        return deleted, rows
+
+    @staticmethod
+    def get_cell_value(value):
+        """ Номер ячейки сетки для нового значения координаты (значение или выражение) """
+        if hasattr(value, 'resolve_expression'):
+            return Cast(Floor(value / utils.GRID_CELL_DEGREES), models.IntegerField())
+        return math.floor(float(value) / utils.GRID_CELL_DEGREES)
+
+    def nearby(self, coordinates, radius_meters):
+        """ Артефакты из ячеек сетки, покрывающих окрестности координат """
+        latitude_ranges, longitude_ranges = [], []
+        for latitude, longitude in coordinates:
+            latitude_cells, longitude_cells = utils.get_grid_bounds(latitude, longitude, radius_meters)
+            latitude_ranges.append(latitude_cells)
+            longitude_ranges.extend(longitude_cells)
+        if not latitude_ranges:
+            return self.none()
+
+        latitude_filter = models.Q()
+        for start, end in utils.merge_ranges(latitude_ranges):
+            latitude_filter |= models.Q(cell_latitude__range=(start, end))
+        longitude_filter = models.Q()
+        for start, end in utils.merge_ranges(longitude_ranges):
+            longitude_filter |= models.Q(cell_longitude__range=(start, end))
+        return self.filter(latitude_filter & longitude_filter)
+
+
 class CollectibleItem(models.Model):
     """ Коллекция предметов(артефакты) собираемые атлетом """
     user = models.ManyToManyField(User,
@@ -88,9 +626,34 @@ class CollectibleItem(models.Model):
                                              ])
     longitude = models.FloatField(validators=[MinValueValidator(-180.0),
                                               MaxValueValidator(180.0)])
+    cell_latitude = models.IntegerField(default=0, editable=False)
+    cell_longitude = models.IntegerField(default=0, editable=False)
     picture = models.URLField()
     value = models.IntegerField()
 
+    objects = CollectibleItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell_latitude', 'cell_longitude']),
+        ]
+
+    def set_grid_cell(self):
+        self.cell_latitude, self.cell_longitude = utils.get_grid_cell(self.latitude, self.longitude)
+
+    def save(self, *args, **kwargs):
+        self.set_grid_cell()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'cell_latitude', 'cell_longitude'}
+        super().save(*args, **kwargs)
+        ResourceVersion.bump(ResourceVersion.COLLECTIBLE_ITEMS)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        ResourceVersion.bump(ResourceVersion.COLLECTIBLE_ITEMS)
+        return result
+
     def __str__(self):
         return (f'name {self.name}, '
                 f'latitude {self.latitude}, longitude {self.longitude}')
@@ -113,4 +676,102 @@ class Subscribe(models.Model):
 
     def __str__(self):
         return (f'{self.athlete_id}: {self.athlete.username}, '
-                f'{self.coach_id}: {self.coach.username}, rating {self.rating}')
\ No newline at end of file
+                f'{self.coach_id}: {self.coach.username}, rating {self.rating}')
+
+
+class CoachRating(models.Model):
+    """ Сумма и количество оценок тренера """
+    coach = models.OneToOneField(User,
+                                 on_delete=models.CASCADE,
+                                 related_name='coach_rating',
+                                 primary_key=True)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+
+    @property
+    def rating(self):
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
+        return None
+
+    @classmethod
+    def update_rating(cls, coach_id, old_rating, new_rating):
+        """ Учёт изменения оценки в подписке: old_rating -> new_rating (None - нет оценки) """
+        delta_sum = (new_rating or 0) - (old_rating or 0)
+        delta_count = (new_rating is not None) - (old_rating is not None)
+        if not delta_sum and not delta_count:
+            return
+        cls.objects.get_or_create(coach_id=coach_id)
+        cls.objects.filter(coach_id=coach_id).update(
+            rating_sum=models.F('rating_sum') + delta_sum,
+            rating_count=models.F('rating_count') + delta_count)
+
+    def __str__(self):
+        return f'{self.coach_id}: {self.coach.username}, rating {self.rating}'
+
+
+class ImportJob(models.Model):
+    """ Фоновый импорт артефактов из файла """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('finished', 'Finished'),
+        ('failed', 'Failed'),
+    ]
+
+    file = models.FileField(storage=get_imports_storage)
+    status = models.CharField(choices=STATUS_CHOICES, default='pending')
+    rows_read = models.IntegerField(default=0, editable=False)
+    rows_processed = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    locked_until = models.DateTimeField(blank=True, null=True)
+    lease_token = models.UUIDField(blank=True, null=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return (f'import job: {self.id}, STATUS {self.status}, '
+                f'processed {self.rows_processed}, failed {self.rows_failed}')
+
+
+class ImportJobErrorRow(models.Model):
+    """ Строка файла импорта, не прошедшая валидацию """
+    job = models.ForeignKey(ImportJob,
+                            on_delete=models.CASCADE,
+                            related_name='errors_row')
+    row = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        return f'import job: {self.job_id}, row {self.row}'
+
+
+class ResourceVersion(models.Model):
+    """ Версия редко меняющегося ресурса: ETag, Last-Modified и ключ кэша ответов """
+    COLLECTIBLE_ITEMS = 'collectible_items'
+    CHALLENGE_SUMMARY = 'challenge_summary'
+
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def bump(cls, name):
+        """ Новая версия ресурса; кэш ответов прежней версии больше не используется """
+        now = timezone.now()
+        if cls.objects.filter(name=name).update(version=models.F('version') + 1, updated_at=now):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, version=1, updated_at=now)
+        except IntegrityError:
+            cls.objects.filter(name=name).update(version=models.F('version') + 1, updated_at=now)
+
+    @classmethod
+    def get_version(cls, name):
+        """ (версия, время изменения); для ресурса без изменений -- (0, None) """
+        row = cls.objects.filter(name=name).values_list('version', 'updated_at').first()
+        return row or (0, None)
+
+    def __str__(self):
+        return f'{self.name}: version {self.version}, updated {self.updated_at}'
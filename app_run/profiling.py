@@ -0,0 +1,98 @@
+""" Профилирование отдельных запросов: дампы cProfile в хранилище 'profiles'
+
+Дамп -- результат cProfile в формате marshal (как Profile.dump_stats), имя
+файла -- ``<маршрут>/<время>-<uuid>.prof``. Запрос профилируется, если в
+заголовке X-Profile-Token передан подписанный токен (make_token) или если он
+попал в выборку PROFILING_SAMPLE_RATE.
+"""
+import io
+import marshal
+import pstats
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.utils import timezone
+
+from app_run import metrics
+
+
+TOKEN_HEADER = 'X-Profile-Token'
+TOKEN_SALT = 'app_run.profiling'
+TOKEN_VALUE = 'profile'
+
+
+def get_profile_storage():
+    return storages['profiles']
+
+
+def make_token():
+    """ Токен заголовка X-Profile-Token, действует PROFILING_TOKEN_MAX_AGE секунд """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def check_token(token):
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def get_endpoint(request):
+    """ Имя маршрута запроса; символы вне [\\w.-] заменяются на _ """
+    return ''.join(char if char.isalnum() or char in '_.-' else '_'
+                   for char in metrics.get_route(request))
+
+
+def save_profile(profiler, endpoint):
+    """ Сохранение дампа профилировщика, возвращает имя файла в хранилище """
+    profiler.create_stats()
+    name = f'{endpoint}/{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex}.prof'
+    return get_profile_storage().save(name, ContentFile(marshal.dumps(profiler.stats)))
+
+
+class _Dump:
+    """ Источник для pstats.Stats из содержимого дампа """
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+def read_profile(name):
+    with get_profile_storage().open(name, 'rb') as file:
+        return _Dump(file.read())
+
+
+def list_profiles(endpoints=None):
+    """ Имена дампов по маршрутам: {маршрут: [имя, ...]} """
+    storage = get_profile_storage()
+    try:
+        directories, _ = storage.listdir('')
+    except FileNotFoundError:
+        return {}
+    return {endpoint: sorted(f'{endpoint}/{name}' for name in storage.listdir(endpoint)[1]
+                             if name.endswith('.prof'))
+            for endpoint in sorted(directories)
+            if not endpoints or endpoint in endpoints}
+
+
+def aggregate(names):
+    """ Суммарная статистика нескольких дампов """
+    stats = pstats.Stats()
+    for name in names:
+        stats.add(read_profile(name))
+    return stats
+
+
+def format_report(stats, top, sort):
+    """ Текст top-N функций по ключу сортировки pstats """
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return stream.getvalue()
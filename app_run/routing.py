@@ -0,0 +1,8 @@
+from django.urls import path
+
+from app_run import consumers
+
+
+websocket_urlpatterns = [
+    path('ws/runs/<int:run_id>/', consumers.RunConsumer.as_asgi(), name='run-live'),
+]
@@ -8,9 +8,15 @@ from app_run.models import(
     Position,
     CollectibleItem,
     Subscribe,
+    ImportJob,
+    ChallengeSummary,
+    CoachRating,
 )    
 
 
+RUN_NOT_IN_PROGRESS = 'Run must be status in_progress'
+
+
 class AthleteSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -66,7 +72,10 @@ class UserSerializer(serializers.ModelSerializer):
         return obj.runs_finished
 
     def get_rating(self, obj):
-        return self.context['avg_ratings'][obj.id]
+        try:
+            return obj.coach_rating.rating
+        except CoachRating.DoesNotExist:
+            return None
 
 
 class AthleteInfoSerializer(serializers.ModelSerializer):
@@ -91,6 +100,35 @@ class ChallengeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class ChallengeSummaryAthleteSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='athlete_id')
+    full_name = serializers.SerializerMethodField()
+    username = serializers.CharField(source='athlete.username')
+
+    def get_full_name(self, obj):
+        return f'{obj.athlete.first_name} {obj.athlete.last_name}'
+
+
+class ChallengeSummarySerializer(serializers.ModelSerializer):
+    """ Атлеты челенджа -- страница athletes_page, загруженная представлением (prefetch) """
+    name_to_display = serializers.CharField(source='full_name')
+    athletes = ChallengeSummaryAthleteSerializer(source='athletes_page', many=True)
+
+    class Meta:
+        model = ChallengeSummary
+        fields = ['name_to_display', 'athletes', 'athletes_count']
+
+
+class ChallengeSummaryQuerySerializer(serializers.Serializer):
+    size = serializers.IntegerField(min_value=1, required=False)
+    page = serializers.IntegerField(min_value=1, required=False, default=1)
+
+
+class TrackQuerySerializer(serializers.Serializer):
+    zoom = serializers.IntegerField(min_value=0, max_value=22, required=False)
+    tolerance = serializers.FloatField(min_value=0, required=False)
+
+
 class PositionSerializer(serializers.ModelSerializer):
     date_time = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S.%f')
     speed = serializers.SerializerMethodField()
@@ -121,7 +159,7 @@ class PositionSerializer(serializers.ModelSerializer):
 
     def validate_run(self, run):
         if run.status in ['init', 'finished']:
-            raise serializers.ValidationError('Run must be status in_progress')
+            raise serializers.ValidationError(RUN_NOT_IN_PROGRESS)
         return run
 
     def validate_latitude(self, value):
@@ -135,6 +173,63 @@ class PositionSerializer(serializers.ModelSerializer):
         raise serializers.ValidationError('The longitude must be between -180 and 180')
 
 
+class PositionPointSerializer(PositionSerializer):
+    class Meta(PositionSerializer.Meta):
+        fields = ['latitude',
+                  'longitude',
+                  'date_time',
+                  ]
+
+
+class PositionAcceptedSerializer(PositionSerializer):
+    """ Координата, принятая в буфер отложенной записи: без id, дистанции и скорости """
+    class Meta(PositionSerializer.Meta):
+        fields = ['run',
+                  'latitude',
+                  'longitude',
+                  'date_time',
+                  ]
+
+
+class PositionBulkSerializer(serializers.Serializer):
+    run = serializers.PrimaryKeyRelatedField(queryset=Run.objects.all())
+    positions = PositionPointSerializer(many=True, allow_empty=False)
+
+    def validate_run(self, run):
+        return PositionSerializer().validate_run(run)
+
+    def validate_positions(self, positions):
+        unique_positions = {data['date_time']: data for data in reversed(positions)}
+        return sorted(unique_positions.values(), key=lambda data: data['date_time'])
+
+
+class PositionAsyncSerializer(PositionPointSerializer):
+    """ Координата для асинхронного приёма: забег читается через async ORM в ais_valid """
+    run = serializers.IntegerField()
+
+    class Meta(PositionPointSerializer.Meta):
+        fields = ['run', *PositionPointSerializer.Meta.fields]
+
+    def validate_run(self, run_id):
+        return run_id
+
+    async def ais_valid(self):
+        if not self.is_valid():
+            return False
+        run = await Run.objects.filter(pk=self.validated_data['run']).afirst()
+        try:
+            if run is None:
+                raise serializers.ValidationError(
+                    serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+                    .format(pk_value=self.validated_data['run']))
+            self.validated_data['run'] = PositionSerializer().validate_run(run)
+        except serializers.ValidationError as exc:
+            self._validated_data = {}
+            self._errors = {'run': exc.detail}
+            return False
+        return True
+
+
 class CollectibleItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CollectibleItem
@@ -206,9 +301,9 @@ class UserDetailAthleteSerializer(UserSerializer):
                   ]
 
     def get_coach(self, obj):
-        athlete = obj.subscribes_athlete.first()
-        if athlete:
-            return athlete.coach_id
+        subscribes = obj.subscribes_athlete.all()
+        if subscribes:
+            return subscribes[0].coach_id
 
         
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -237,4 +332,33 @@ class RateCoachSerializer(serializers.Serializer):
 
 class AnalyticsForCoachSerializer(serializers.Serializer):
     coach_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.filter(is_staff=True),
-                                                  required=True)
\ No newline at end of file
+                                                  required=True)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    errors_row = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ['id',
+                  'file',
+                  'status',
+                  'rows_processed',
+                  'rows_failed',
+                  'errors_row',
+                  'error',
+                  'created_at',
+                  'updated_at',
+                  ]
+        read_only_fields = ['status', 'rows_processed', 'rows_failed', 'error']
+        extra_kwargs = {'file': {'write_only': True}}
+
+    def get_errors_row(self, obj):
+        return [error.row for error in obj.errors_row.all()]
+
+
+class RunImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    athlete = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.filter(is_staff=False, is_superuser=False))
+    comment = serializers.CharField(required=False, default='', allow_blank=True)
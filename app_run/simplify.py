@@ -0,0 +1,109 @@
+""" Упрощение трека алгоритмом Дугласа-Пекера (NumPy)
+
+Координаты переводятся в метры локальной равнопромежуточной проекцией
+относительно средней широты трека; на масштабе забега (десятки километров)
+её искажение пренебрежимо мало по сравнению с допуском упрощения.
+
+Один проход алгоритма вычисляет значимость каждой точки -- наибольший допуск
+в метрах, при котором точка ещё остаётся в треке. Значимость не превышает
+значимости «родительской» точки, поэтому отбор ``significance > tolerance``
+даёт ровно тот же результат, что и запуск алгоритма с этим допуском, и все
+уровни детализации получаются из одного расчёта.
+"""
+import numpy as np
+
+from app_run import geodistance
+
+
+# Метров на пиксель тайла 256 px на экваторе при масштабе 0
+ZOOM_0_METERS_PER_PIXEL = 2 * np.pi * geodistance.WGS84_A / 256
+
+
+def get_zoom_tolerance(zoom):
+    """ Допуск упрощения для масштаба карты: один пиксель, в метрах """
+    return float(ZOOM_0_METERS_PER_PIXEL / 2 ** zoom)
+
+
+def project(latitudes, longitudes):
+    """ Локальная проекция координат в метры: (x, y) относительно первой точки """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.degrees(np.unwrap(np.radians(np.asarray(longitudes, dtype=np.float64))))
+    if latitudes.size == 0:
+        return np.zeros(0), np.zeros(0)
+    scale = np.radians(geodistance.MEAN_EARTH_RADIUS)
+    x = (longitudes - longitudes[0]) * scale * np.cos(np.radians(latitudes.mean()))
+    y = (latitudes - latitudes[0]) * scale
+    return x, y
+
+
+def _distances_to_segment(x, y, x_1, y_1, x_2, y_2):
+    dx, dy = x_2 - x_1, y_2 - y_1
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        t = np.zeros(x.shape)
+    else:
+        t = np.clip(((x - x_1) * dx + (y - y_1) * dy) / length_sq, 0, 1)
+    return np.hypot(x - (x_1 + t * dx), y - (y_1 + t * dy))
+
+
+def significance(x, y, floor=0.0):
+    """ Значимость точек трека в метрах; у крайних точек -- бесконечность
+
+    Участки, где отклонение не превышает floor, дальше не делятся: значимость их
+    точек остаётся нулевой, что не меняет результата для допусков >= floor.
+    """
+    size = len(x)
+    result = np.zeros(size)
+    if size == 0:
+        return result
+    result[0] = result[-1] = np.inf
+    stack = [(0, size - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _distances_to_segment(x[first + 1:last], y[first + 1:last],
+                                          x[first], y[first], x[last], y[last])
+        index = int(np.argmax(distances))
+        if distances[index] <= floor:
+            continue
+        split = first + 1 + index
+        value = min(float(distances[index]), parent)
+        result[split] = value
+        stack.append((first, split, value))
+        stack.append((split, last, value))
+    return result
+
+
+def max_error(x, y, indices):
+    """ Наибольшее отклонение точек исходного трека от упрощённого, в метрах """
+    if len(indices) < 2:
+        return 0.0
+    indices = np.asarray(indices)
+    points = np.arange(len(x))
+    segment = np.clip(np.searchsorted(indices, points, side='right') - 1, 0, len(indices) - 2)
+    first, last = indices[segment], indices[segment + 1]
+    dx, dy = x[last] - x[first], y[last] - y[first]
+    length_sq = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length_sq == 0, 0,
+                     np.clip(((x - x[first]) * dx + (y - y[first]) * dy) / length_sq, 0, 1))
+    return float(np.hypot(x - (x[first] + t * dx), y - (y[first] + t * dy)).max())
+
+
+def simplify(coordinates, tolerances):
+    """ Упрощение трека сразу для нескольких допусков
+
+    Возвращает по каждому допуску пару (индексы оставленных точек, наибольшее
+    отклонение в метрах).
+    """
+    if not coordinates:
+        return [([], 0.0) for _ in tolerances]
+    latitudes, longitudes = zip(*coordinates)
+    x, y = project(latitudes, longitudes)
+    weights = significance(x, y, min(tolerances, default=0.0))
+    result = []
+    for tolerance in tolerances:
+        indices = np.flatnonzero(weights > tolerance)
+        result.append((indices.tolist(), max_error(x, y, indices)))
+    return result
@@ -0,0 +1,208 @@
+""" Детерминированная генерация данных production-объёма
+
+Все случайные величины берутся из numpy.random.default_rng([seed, ...]) с
+ключом сущности (номер забега, пачки и т. п.), поэтому результат не зависит
+от числа процессов и порядка обработки пачек.
+"""
+import datetime
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from app_run import geodistance, utils
+from app_run.models import CoachRating, CollectibleItem, Position, Run, Subscribe
+
+
+CITIES = [
+    (55.7558, 37.6173),  # Москва
+    (59.9343, 30.3351),  # Санкт-Петербург
+    (55.7963, 49.1088),  # Казань
+    (56.8389, 60.6057),  # Екатеринбург
+    (55.0084, 82.9357),  # Новосибирск
+]
+CITY_RADIUS_DEGREES = 0.1
+START_TIME = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+SEASON_SECONDS = 365 * 24 * 3600
+SAMPLE_SECONDS = 5
+GPS_NOISE_METERS = 3.0
+STATUS_WEIGHTS = {'finished': 0.9, 'in_progress': 0.08, 'init': 0.02}
+
+# Ключи генераторов случайных чисел для разных сущностей
+USERS_KEY, SUBSCRIPTIONS_KEY, RUNS_KEY, TRACK_KEY, ITEMS_KEY = range(5)
+
+
+def get_prefix(seed):
+    return f'gen{seed}_'
+
+
+def get_rng(seed, *keys):
+    return np.random.default_rng([seed, *keys])
+
+
+def generate_track(rng, points, start=None):
+    """ Трек бегуна: (широты, долготы, секунды от старта)
+
+    Темп около 5:30 на километр с медленным дрейфом, плавные повороты, редкие
+    повороты под прямым углом (кварталы), остановки на светофорах и шум GPS.
+    """
+    latitude, longitude = start or CITIES[rng.integers(len(CITIES))]
+    latitude += rng.uniform(-CITY_RADIUS_DEGREES, CITY_RADIUS_DEGREES)
+    longitude += rng.uniform(-CITY_RADIUS_DEGREES, CITY_RADIUS_DEGREES)
+
+    intervals = np.clip(np.round(rng.normal(SAMPLE_SECONDS, 0.7, points)), 1, None)
+    intervals[0] = 0
+    pace = np.clip(rng.normal(3.0, 0.4), 1.8, 5.5)
+    speeds = pace + np.cumsum(rng.normal(0, 0.05, points))
+    speeds = np.clip(speeds, 0.5 * pace, 1.5 * pace)
+    stops = rng.random(points) < 0.01
+    speeds[stops] = 0
+
+    turns = np.where(rng.random(points) < 0.02, rng.choice([-np.pi / 2, np.pi / 2], points), 0)
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.08, points) + turns)
+    steps = speeds * intervals
+    north = np.cumsum(steps * np.cos(heading)) + rng.normal(0, GPS_NOISE_METERS, points)
+    east = np.cumsum(steps * np.sin(heading)) + rng.normal(0, GPS_NOISE_METERS, points)
+
+    latitudes = latitude + np.degrees(north / geodistance.MEAN_EARTH_RADIUS)
+    longitudes = longitude + np.degrees(east / (geodistance.MEAN_EARTH_RADIUS
+                                                * np.cos(np.radians(latitude))))
+    return np.round(latitudes, 4), np.round(longitudes, 4), np.cumsum(intervals)
+
+
+def create_users(seed, users, coaches, batch_size):
+    """ Тренеры (первые coaches) и атлеты; пароль не задаётся """
+    prefix = get_prefix(seed)
+    rng = get_rng(seed, USERS_KEY)
+    names = ['Алексей', 'Мария', 'Иван', 'Анна', 'Дмитрий', 'Елена', 'Сергей', 'Ольга']
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{index}',
+              password='!',
+              first_name=names[rng.integers(len(names))],
+              last_name=f'Тестов{index}',
+              is_staff=index < coaches)
+         for index in range(users)],
+        batch_size=batch_size)
+    rows = User.objects.filter(username__startswith=prefix) \
+                       .order_by('id') \
+                       .values_list('id', 'is_staff')
+    coach_ids = [user_id for user_id, is_staff in rows if is_staff]
+    athlete_ids = [user_id for user_id, is_staff in rows if not is_staff]
+    return coach_ids, athlete_ids
+
+
+def create_subscriptions(seed, coach_ids, athlete_ids, share, batch_size):
+    """ Подписки share атлетов на одного-двух тренеров и согласованный CoachRating """
+    if not coach_ids:
+        return 0
+    rng = get_rng(seed, SUBSCRIPTIONS_KEY)
+    subscriptions = []
+    for athlete_id in athlete_ids:
+        if rng.random() >= share:
+            continue
+        count = 1 + (rng.random() < 0.2)
+        size = min(count, len(coach_ids))
+        for coach_index in rng.choice(len(coach_ids), size=size, replace=False):
+            rating = int(rng.integers(1, 6)) if rng.random() < 0.6 else None
+            subscriptions.append(Subscribe(athlete_id=athlete_id,
+                                           coach_id=coach_ids[coach_index],
+                                           rating=rating))
+    Subscribe.objects.bulk_create(subscriptions, batch_size=batch_size)
+
+    ratings = {}
+    for subscription in subscriptions:
+        if subscription.rating is not None:
+            rating_sum, rating_count = ratings.get(subscription.coach_id, (0, 0))
+            ratings[subscription.coach_id] = (rating_sum + subscription.rating, rating_count + 1)
+    CoachRating.objects.bulk_create(
+        [CoachRating(coach_id=coach_id, rating_sum=rating_sum, rating_count=rating_count)
+         for coach_id, (rating_sum, rating_count) in ratings.items()],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['coach'],
+        update_fields=['rating_sum', 'rating_count'])
+    return len(subscriptions)
+
+
+def plan_runs(seed, athlete_ids, runs):
+    """ Атлет каждого забега """
+    rng = get_rng(seed, RUNS_KEY)
+    return [int(athlete_id) for athlete_id in rng.choice(athlete_ids, size=runs)]
+
+
+def build_run(seed, run_index, athlete_id, positions):
+    """ Несохранённые забег и его координаты с дистанцией, скоростью и итогами """
+    rng = get_rng(seed, TRACK_KEY, run_index)
+    status = str(rng.choice(list(STATUS_WEIGHTS), p=list(STATUS_WEIGHTS.values())))
+    run = Run(athlete_id=athlete_id, comment=f'synthetic run {run_index}', status=status)
+    if status == 'init':
+        return run, []
+
+    points = max(2, int(rng.lognormal(np.log(positions), 0.5)))
+    latitudes, longitudes, seconds = generate_track(rng, points)
+    started = START_TIME + datetime.timedelta(seconds=int(rng.integers(SEASON_SECONDS)))
+    track = [Position(latitude=Decimal(f'{latitude:.4f}'),
+                      longitude=Decimal(f'{longitude:.4f}'),
+                      date_time=started + datetime.timedelta(seconds=int(offset)))
+             for latitude, longitude, offset in zip(latitudes, longitudes, seconds)]
+    run.chain_positions(track)
+
+    totals = utils.get_track_totals((position.latitude, position.longitude,
+                                     position.date_time, position.speed) for position in track)
+    for field, value in totals.items():
+        setattr(run, field, value)
+    if status == 'finished':
+        for field, value in run.get_finish_values().items():
+            setattr(run, field, value)
+    return run, track
+
+
+def create_runs(seed, first_index, athlete_ids, positions, batch_size):
+    """ Пачка забегов с номерами first_index.. для athlete_ids; вызывается и в процессах """
+    runs, tracks = [], []
+    for offset, athlete_id in enumerate(athlete_ids):
+        run, track = build_run(seed, first_index + offset, athlete_id, positions)
+        runs.append(run)
+        tracks.append(track)
+    with transaction.atomic():
+        Run.objects.bulk_create(runs, batch_size=batch_size)
+        track_positions = [position for track in tracks for position in track]
+        for position in track_positions:
+            position.run_id = position.run.pk
+        Position.objects.bulk_create(track_positions, batch_size=batch_size)
+    return len(runs), len(track_positions)
+
+
+def create_items(seed, items, batch_size):
+    rng = get_rng(seed, ITEMS_KEY)
+    prefix = get_prefix(seed)
+    cities = rng.integers(len(CITIES), size=items)
+    offsets = rng.uniform(-CITY_RADIUS_DEGREES, CITY_RADIUS_DEGREES, size=(items, 2))
+    values = rng.integers(1, 100, size=items)
+    CollectibleItem.objects.bulk_create(
+        [CollectibleItem(name=f'Артефакт {index}',
+                         uid=f'{prefix}{index}',
+                         value=int(values[index]),
+                         latitude=round(CITIES[cities[index]][0] + offsets[index][0], 6),
+                         longitude=round(CITIES[cities[index]][1] + offsets[index][1], 6),
+                         picture='https://example.com/artifact.png')
+         for index in range(items)],
+        batch_size=batch_size)
+    return items
+
+
+def exists(seed):
+    """ Есть ли данные, созданные с этим seed """
+    prefix = get_prefix(seed)
+    return (User.objects.filter(username__startswith=prefix).exists()
+            or CollectibleItem.objects.filter(uid__startswith=prefix).exists())
+
+
+def clear(seed):
+    """ Удаление данных, созданных с этим seed """
+    prefix = get_prefix(seed)
+    CollectibleItem.objects.filter(uid__startswith=prefix).delete()
+    coaches = User.objects.filter(username__startswith=prefix, is_staff=True)
+    CoachRating.objects.filter(coach__in=coaches).delete()
+    return User.objects.filter(username__startswith=prefix).delete()[0]
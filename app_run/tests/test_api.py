@@ -1,9 +1,25 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO
 import json
-from django.urls import reverse
+import os
+import tempfile
+from unittest import mock
+from django.urls import get_resolver, reverse
 from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from openpyxl import Workbook
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
 
 from app_run.models import(
@@ -11,7 +27,17 @@ from app_run.models import(
     AthleteInfo,
     Challenge,
     CollectibleItem,    
+    Position,
+    ImportJob,
+    TrackLevel,
+    ChallengeSummary,
+    Subscribe,
+    CoachRating,
 )    
+from app_run import (caching, consumers, exporters, ingest, jobs, metrics, profiling, routing,
+                     utils)
+from app_run.serializers import PositionSerializer
+from app_run.middleware import capture_query_stats
 
 
 class CompanyDetailApiTestCase(APITestCase):
@@ -25,18 +51,106 @@ class CompanyDetailApiTestCase(APITestCase):
 class RunApiTestCase(APITestCase):
     fixtures = ['data_db']
 
+    def test_track(self):
+        cache.clear()
+        run = Run.objects.get(pk=15)
+        run.add_positions([Position(latitude=20.008, longitude=50.008,
+                                    date_time=datetime.fromisoformat('2025-10-10T18:04:00+00:00'))])
+        url = reverse('run-track', kwargs={'pk': 15})
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, response.data['points'])
+        self.assertEqual(utils.encode_polyline([(20.0, 50.0), (20.008, 50.008)]),
+                         response.data['polyline'])
+        self.assertEqual([1760119200000, 240000], response.data['timestamps'])
+        self.assertEqual([0, 508], response.data['speeds'])
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_track_finished_cached(self):
+        cache.clear()
+        url = reverse('run-track', kwargs={'pk': 3})
+        self.client.get(url)
+        # только версия забега: координаты берутся из кэша
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(0, response.data['points'])
+
+    def test_track_cache_key_versioned(self):
+        url = reverse('run-track', kwargs={'pk': 3})
+        self.client.get(url)
+        Run.objects.get(pk=3).save(update_fields=['updated_at'])
+        Position.objects.create(run_id=3, latitude=20.0, longitude=50.0)
+        self.assertEqual(1, self.client.get(url).data['points'])
+
+    def test_track_tolerance(self):
+        run = Run.objects.get(pk=15)
+        run.add_positions([Position(latitude=20.008, longitude=50.0, date_time=None),
+                           Position(latitude=20.008, longitude=50.008, date_time=None)])
+        url = reverse('run-track', kwargs={'pk': 15})
+        response = self.client.get(url, {'tolerance': 10000})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, response.data['points'])
+        self.assertLess(response.data['max_error'], 10000)
+        response = self.client.get(url, {'tolerance': 1})
+        self.assertEqual(3, response.data['points'])
+        self.assertEqual(0, response.data['max_error'])
+
+    def test_track_zoom_without_levels(self):
+        url = reverse('run-track', kwargs={'pk': 13})
+        response = self.client.get(url, {'zoom': 5})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(5, response.data['zoom'])
+        self.assertEqual(2, response.data['points'])
+
+    def test_track_invalid_zoom(self):
+        response = self.client.get(reverse('run-track', kwargs={'pk': 15}), {'zoom': 30})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_track_not_found(self):
+        response = self.client.get(reverse('run-track', kwargs={'pk': 100}))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
     def test_num_queries(self):
          with self.assertNumQueries(1):
             url = reverse('run-list')
             response = self.client.get(url)
             self.assertEqual(status.HTTP_200_OK, response.status_code)
 
+    def fetch_all_pages(self, url, query_params):
+        ids = []
+        response = self.client.get(url, query_params=query_params)
+        while True:
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertNotIn('count', response.data)
+            ids.extend(obj['id'] for obj in response.data['results'])
+            if not response.data['next']:
+                return ids
+            with self.assertNumQueries(1):
+                response = self.client.get(response.data['next'])
+
+    def test_cursor_pagination(self):
+        ids = self.fetch_all_pages(reverse('run-list'), {'size': 4})
+        self.assertEqual(list(Run.objects.order_by('created_at', 'id').values_list('id', flat=True)),
+                         ids)
+
+    def test_cursor_pagination_ordering(self):
+        ids = self.fetch_all_pages(reverse('run-list'), {'size': 4, 'ordering': '-created_at'})
+        self.assertEqual(list(Run.objects.order_by('-created_at', '-id').values_list('id', flat=True)),
+                         ids)
+
+    def test_without_pagination(self):
+        response = self.client.get(reverse('run-list'))
+        self.assertEqual(15, len(response.data))
+
 
 class UserApiTestCase(APITestCase):
     fixtures = ['data_db']
 
     def test_filter_type_is_coach(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             url = reverse('user-list')
             query_params = {'type': 'coach'}
             response = self.client.get(url, query_params=query_params)
@@ -46,7 +160,7 @@ class UserApiTestCase(APITestCase):
             self.assertEqual('coach', obj['type'])
 
     def test_filter_type_is_athlete(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             url = reverse('user-list')
             query_params = {'type': 'athlete'}
             response = self.client.get(url, query_params=query_params)
@@ -56,7 +170,7 @@ class UserApiTestCase(APITestCase):
             self.assertEqual('athlete', obj['type'])
 
     def test_filter_type_is_wrong(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             url = reverse('user-list')
             query_params = {'type': 'blablabla'}
             response = self.client.get(url, query_params=query_params)
@@ -66,7 +180,7 @@ class UserApiTestCase(APITestCase):
             self.assertTrue(obj['type'] in ['coach', 'athlete'])
 
     def test_without_filter(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             url = reverse('user-list')
             response = self.client.get(url)
             self.assertEqual(status.HTTP_200_OK, response.status_code)
@@ -74,6 +188,35 @@ class UserApiTestCase(APITestCase):
         for obj in response.data:
             self.assertTrue(obj['type'] in ['coach', 'athlete'])
 
+    def test_detail_coach(self):
+        Subscribe.objects.create(athlete_id=1, coach_id=4)
+        Subscribe.objects.create(athlete_id=2, coach_id=4)
+        with self.assertNumQueries(2):
+            url = reverse('user-detail', kwargs={'pk': 4})
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('coach', response.data['type'])
+        self.assertEqual([1, 2], sorted(response.data['athletes']))
+
+    def test_detail_athlete(self):
+        Subscribe.objects.create(athlete_id=1, coach_id=5)
+        CollectibleItem.objects.get(uid='artifact1').user.add(1)
+        with self.assertNumQueries(3):
+            url = reverse('user-detail', kwargs={'pk': 1})
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('athlete', response.data['type'])
+        self.assertEqual(5, response.data['coach'])
+        self.assertEqual(['artifact1'], [obj['uid'] for obj in response.data['items']])
+
+    def test_list_query_budget_does_not_grow(self):
+        for i in range(20):
+            athlete = User.objects.create(username=f'athlete_extra_{i}')
+            Run.objects.create(athlete=athlete, comment='run', status='finished')
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-list'))
+        self.assertEqual(28, len(response.data))
+
 
 class RunStartApiTestCase(APITestCase):
     fixtures = ['data_db']
@@ -143,6 +286,31 @@ class RunStopApiTestCase(APITestCase):
         run = Run.objects.get(pk=3)
         self.assertEqual('finished', run.status)
 
+    def test_position_during_stop(self):
+        stop_url = reverse('run-stop', kwargs={'pk': 15})
+        validate_run = PositionSerializer.validate_run
+
+        def stop_after_validation(serializer, run):
+            # забег завершается между валидацией координаты и её сохранением
+            run = validate_run(serializer, run)
+            self.assertEqual(status.HTTP_200_OK, self.client.post(stop_url).status_code)
+            return run
+
+        with mock.patch.object(PositionSerializer, 'validate_run', stop_after_validation):
+            response = self.client.post(reverse('position-list'),
+                                        data={'run': 15, 'latitude': '20.0500',
+                                              'longitude': '50.0500',
+                                              'date_time': '2025-10-10T18:10:00.000000'},
+                                        format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(['Run must be status in_progress'], response.data['run'])
+
+        run = Run.objects.get(pk=15)
+        self.assertEqual('finished', run.status)
+        self.assertEqual(3, run.positions_count)
+        self.assertEqual(2.44, run.distance)
+        self.assertEqual(480, run.run_time_seconds)
+
     def test_calc_distance(self):
         url = reverse('run-stop', kwargs={'pk': 2})
         response = self.client.post(url)
@@ -175,6 +343,62 @@ class RunStopApiTestCase(APITestCase):
         self.assertEqual(480, response.data['run_time_seconds'])
         self.assertEqual(480, run.run_time_seconds)
 
+    def test_run_totals_incremental(self):
+        run = Run.objects.get(pk=15)
+        self.assertEqual(3, run.positions_count)
+        self.assertEqual(2.44, round(run.distance, 2))
+        self.assertEqual(datetime.fromisoformat('2025-10-10T18:00:00+00:00'), run.first_position_at)
+        self.assertEqual(datetime.fromisoformat('2025-10-10T18:08:00+00:00'), run.last_position_at)
+        self.assertEqual(3.39, round(run.speed_sum / run.positions_count, 2))
+
+    def test_stop_without_positions_scan(self):
+        url = reverse('run-stop', kwargs={'pk': 15})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        # уровни детализации трека строятся в фоне после фиксации
+        self.assertEqual(0, len([query for query in context.captured_queries
+                                 if 'app_run_position' in query['sql']]))
+
+    def test_stop_builds_track_levels(self):
+        url = reverse('run-stop', kwargs={'pk': 15})
+        with mock.patch('app_run.jobs.submit_track_levels') as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        submit.assert_called_once_with(15)
+
+        jobs.build_track_levels(15)
+        levels = TrackLevel.objects.filter(run_id=15).order_by('zoom')
+        self.assertEqual(sorted(settings.TRACK_SIMPLIFICATION_ZOOMS),
+                         [level.zoom for level in levels])
+        self.assertEqual({2}, {level.points for level in levels})
+
+        url = reverse('run-track', kwargs={'pk': 15})
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'zoom': 9})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(11, response.data['zoom'])
+        self.assertEqual(utils.encode_polyline([(20.0, 50.0), (20.016, 50.016)]),
+                         response.data['polyline'])
+
+    def test_track_levels_built_on_read_without_job(self):
+        # фоновое построение не успело или упало: уровни строит запрос трека
+        self.assertEqual(status.HTTP_200_OK,
+                         self.client.post(reverse('run-stop', kwargs={'pk': 15})).status_code)
+        self.assertFalse(TrackLevel.objects.filter(run_id=15).exists())
+        response = self.client.get(reverse('run-track', kwargs={'pk': 15}), {'zoom': 9})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(11, response.data['zoom'])
+        self.assertEqual(len(settings.TRACK_SIMPLIFICATION_ZOOMS),
+                         TrackLevel.objects.filter(run_id=15).count())
+
+    def test_track_levels_not_built_in_progress(self):
+        url = reverse('run-track', kwargs={'pk': 15})
+        response = self.client.get(url, {'zoom': 9})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertFalse(TrackLevel.objects.filter(run_id=15).exists())
+
     def test_challenge_2_km_in_10_minutes(self):
         url = reverse('run-stop', kwargs={'pk': 15})
         response = self.client.post(url)
@@ -255,6 +479,75 @@ class ChallengeApiTestCase(APITestCase):
         self.assertEqual(7, challenge.athlete_id)
 
 
+
+class ChallengeSummaryApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        User.objects.filter(pk=1).update(first_name='Иван', last_name='Иванов')
+        for athlete_id in [1, 2, 3]:
+            Challenge.objects.create(athlete=User.objects.get(pk=athlete_id),
+                                     full_name='Сделай 10 Забегов!')
+        Challenge.objects.create(athlete=User.objects.get(pk=2),
+                                 full_name='Пробеги 50 километров!')
+        Challenge.objects.create(athlete=User.objects.get(pk=4),
+                                 full_name='Пробеги 50 километров!')
+
+    def test_empty(self):
+        Challenge.objects.all().delete()
+        ChallengeSummary.rebuild()
+        response = self.client.get(reverse('challenge-summary'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([], response.data)
+
+    def test_summary(self):
+        cache.clear()
+        # версия ресурса, челенджи и страницы атлетов всех челенджей
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('challenge-summary'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['Пробеги 50 километров!', 'Сделай 10 Забегов!'],
+                         [obj['name_to_display'] for obj in response.data])
+        self.assertEqual([{'id': 2, 'full_name': ' ', 'username': 'athlete2'}],
+                         response.data[0]['athletes'])
+        self.assertEqual({'id': 1, 'full_name': 'Иван Иванов', 'username': 'athlete1'},
+                         response.data[1]['athletes'][0])
+        self.assertEqual(3, response.data[1]['athletes_count'])
+
+    def test_summary_pagination(self):
+        response = self.client.get(reverse('challenge-summary'), query_params={'size': 2, 'page': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([], response.data[0]['athletes'])
+        self.assertEqual([3], [obj['id'] for obj in response.data[1]['athletes']])
+        self.assertEqual(3, response.data[1]['athletes_count'])
+
+    def test_summary_award_on_run_stop(self):
+        response = self.client.post(reverse('run-stop', kwargs={'pk': 12}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        summary = ChallengeSummary.objects.get(full_name='Сделай 10 Забегов!')
+        self.assertEqual([1, 2, 3, 3], list(summary.athletes.order_by('pk')
+                                                            .values_list('athlete_id', flat=True)))
+        self.assertEqual(4, summary.athletes_count)
+
+    def test_award_queries(self):
+        # точка сохранения, челендж, челендж в таблице, строка атлета, счётчик
+        # (атлет -- подзапрос), версия ресурса, освобождение точки сохранения
+        with self.assertNumQueries(7):
+            Challenge.objects.create(athlete_id=3, full_name='Пробеги 50 километров!')
+        self.assertEqual(2, ChallengeSummary.objects.get(full_name='Пробеги 50 километров!')
+                                                    .athletes_count)
+
+    def test_rebuild(self):
+        def get_summary():
+            return [(summary.full_name, summary.athletes_count,
+                     [row.athlete_id for row in summary.athletes.filter(athlete__is_staff=False)
+                                                                .order_by('pk')])
+                    for summary in ChallengeSummary.objects.order_by('full_name')]
+
+        before = get_summary()
+        ChallengeSummary.rebuild()
+        self.assertEqual(before, get_summary())
+
 class FileUploadApiTestCase(APITestCase):
     def test_upload_file(self):
         path_file = settings.BASE_DIR / 'app_run' / 'tests' / 'upload_example.xlsx'
@@ -263,7 +556,111 @@ class FileUploadApiTestCase(APITestCase):
             response = self.client.post(url, data={'file': f_data})
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(2, CollectibleItem.objects.count())
+        self.assertEqual(['37729fh2', 'fh548ruh', 'fj39gb27', 'qude82dh'],
+                         [row[1] for row in response.data])
 
+    @override_settings(COLLECTIBLE_ITEMS_IMPORT_CHUNK_SIZE=2)
+    def test_upload_file_chunks(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Name', 'UID', 'Value', 'Latitude', 'Longitude', 'URL'])
+        for i in range(5):
+            sheet.append([f'item {i}', f'uid{i}', i, 20 + i / 1000, 50, 'https://example.com'])
+        sheet.append(['bad', 'uid_bad', 'x', 20, 50, 'https://example.com'])
+        file = BytesIO()
+        workbook.save(file)
+        file.seek(0)
+        file.name = 'items.xlsx'
+
+        url = reverse('upload-file')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, data={'file': file})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([['bad', 'uid_bad', 'x', 20, 50, 'https://example.com']], response.data)
+        self.assertEqual(5, CollectibleItem.objects.count())
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO "app_run_collectibleitem"')]
+        self.assertEqual(3, len(inserts))
+
+
+
+class ImportJobApiTestCase(APITestCase):
+    path_file = settings.BASE_DIR / 'app_run' / 'tests' / 'upload_example.xlsx'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # хранилище поля задаётся при загрузке модели, override_settings его не меняет
+        patcher = mock.patch.object(ImportJob._meta.get_field('file'), 'storage',
+                                    FileSystemStorage(location=directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_import_job(self):
+        with open(self.path_file, 'rb') as f_data:
+            url = reverse('import-job-create')
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with mock.patch('app_run.jobs.submit_import_jobs') as submit:
+                    response = self.client.post(url, data={'file': f_data})
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code, response.data)
+        self.assertEqual('pending', response.data['status'])
+        self.assertEqual(1, len(callbacks))
+        submit.assert_called_once()
+
+        jobs.process_import_job()
+
+        url = reverse('import-job-detail', kwargs={'pk': response.data['id']})
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('finished', response.data['status'])
+        self.assertEqual(6, response.data['rows_processed'])
+        self.assertEqual(4, response.data['rows_failed'])
+        self.assertEqual(['37729fh2', 'fh548ruh', 'fj39gb27', 'qude82dh'],
+                         [row[1] for row in response.data['errors_row']])
+        self.assertEqual(2, CollectibleItem.objects.count())
+
+    def test_import_job_restart_from_last_chunk(self):
+        with open(self.path_file, 'rb') as f_data:
+            job = ImportJob.objects.create(file=SimpleUploadedFile('items.xlsx', f_data.read()),
+                                           status='running',
+                                           rows_read=3,
+                                           rows_processed=3,
+                                           rows_failed=3,
+                                           locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(job.pk, jobs.process_import_job().pk)
+        job.refresh_from_db()
+        self.assertEqual('finished', job.status)
+        self.assertEqual(6, job.rows_processed)
+        self.assertEqual(4, job.rows_failed)
+        self.assertEqual(2, CollectibleItem.objects.count())
+
+    def test_import_job_locked(self):
+        ImportJob.objects.create(file='items.xlsx',
+                                 status='running',
+                                 locked_until=timezone.now() + timedelta(seconds=60))
+        self.assertIsNone(jobs.process_import_job())
+
+    def test_import_job_lease_lost(self):
+        with open(self.path_file, 'rb') as f_data:
+            ImportJob.objects.create(file=SimpleUploadedFile('items.xlsx', f_data.read()))
+        expired = jobs.claim_import_job()
+        ImportJob.objects.filter(pk=expired.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1))
+        current = jobs.claim_import_job()
+        self.assertEqual(expired.pk, current.pk)
+
+        # прежний обработчик не записывает ни артефакты, ни прогресс, ни статус
+        jobs.execute_import_job(expired)
+        job = ImportJob.objects.get(pk=current.pk)
+        self.assertEqual(('running', 0, current.lease_token),
+                         (job.status, job.rows_read, job.lease_token))
+        self.assertEqual(0, CollectibleItem.objects.count())
+
+        jobs.execute_import_job(current)
+        job.refresh_from_db()
+        self.assertEqual(('finished', 6, None), (job.status, job.rows_processed, job.lease_token))
+        self.assertEqual(2, CollectibleItem.objects.count())
 
 class PositionApiTestCase(APITestCase):
     fixtures = ['data_db']
@@ -282,6 +679,29 @@ class PositionApiTestCase(APITestCase):
         artifact = user.items.get(uid='artifact1')
         self.assertTrue('artifact1', artifact.uid)
 
+    def test_delete_rechains_positions(self):
+        response = self.client.delete(reverse('position-detail', kwargs={'pk': 3}))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertEqual([0, 0], list(Position.objects.filter(run_id=13).order_by('pk')
+                                                      .values_list('distance', flat=True)))
+        run = Run.objects.get(pk=13)
+        self.assertEqual(2, run.positions_count)
+        self.assertEqual(0, run.distance)
+
+        response = self.client.post(reverse('position-list'),
+                                    data={'run': 13, 'latitude': '20.0000', 'longitude': '50.4000',
+                                          'date_time': '2025-10-10T18:15:00.000000'},
+                                    format='json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertAlmostEqual(Run.objects.get(pk=13).calc_totals()['distance'],
+                               Position.objects.get(pk=response.data['id']).distance, places=6)
+
+    def test_delete_finished_run_position(self):
+        position = Position.objects.create(run_id=3, latitude=20.0, longitude=50.0)
+        response = self.client.delete(reverse('position-detail', kwargs={'pk': position.pk}))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertTrue(Position.objects.filter(pk=position.pk).exists())
+
     def test_distance_speed_beetwen_postition(self):
         url = reverse('position-list')
         data1 = {'run': 15,
@@ -308,4 +728,1084 @@ class PositionApiTestCase(APITestCase):
         self.assertEqual(1.22, round(run.positions.get(latitude=20.0080).distance, 2))
         self.assertEqual(5.08, round(run.positions.get(latitude=20.0080).speed, 2))
         self.assertEqual(2.44, round(run.positions.get(latitude=20.0160).distance, 2))
-        self.assertEqual(5.08, round(run.positions.get(latitude=20.0160).speed, 2))
\ No newline at end of file
+        self.assertEqual(5.08, round(run.positions.get(latitude=20.0160).speed, 2))
+
+    def test_cursor_pagination(self):
+        run = Run.objects.get(pk=15)
+        for minute in range(1, 6):
+            run.add_positions([Position(latitude=20 + minute / 1000,
+                                        longitude=50,
+                                        date_time=datetime.fromisoformat(
+                                            f'2025-10-10T18:0{minute}:00+00:00'))])
+        url = reverse('position-list')
+        response = self.client.get(url, query_params={'run': 15, 'size': 4})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        dates = [obj['date_time'] for obj in response.data['results']]
+        response = self.client.get(response.data['next'])
+        dates += [obj['date_time'] for obj in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(6, len(dates))
+        self.assertEqual(sorted(dates), dates)
+
+    def test_add_collectible_items_neighbour_cell(self):
+        CollectibleItem.objects.create(name='artifact3', uid='artifact3',
+                                       latitude=19.9999, longitude=49.9999,
+                                       picture='https://example.com', value=1)
+        url = reverse('position-list')
+        data = {'run': 14,
+                'latitude': 20.0001,
+                'longitude': 50.0001,
+                'date_time': '2025-10-10T18:15:00.000000'}
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual({'artifact1', 'artifact3'},
+                         set(User.objects.get(pk=8).items.values_list('uid', flat=True)))
+
+
+class PositionAsyncApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    async def post(self, data):
+        return await self.async_client.post(reverse('position-async'), data=json.dumps(data),
+                                            content_type='application/json')
+
+    async def test_create(self):
+        for data in [{'run': 15, 'latitude': '20.0080', 'longitude': '50.0080',
+                      'date_time': '2025-10-10T18:04:00.000000'},
+                     {'run': 15, 'latitude': '20.0160', 'longitude': '50.0160',
+                      'date_time': '2025-10-10T18:08:00.000000'}]:
+            response = await self.post(data)
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.json())
+        self.assertEqual({'id', 'run', 'latitude', 'longitude', 'date_time', 'speed', 'distance'},
+                         set(response.json()))
+        self.assertEqual((2.44, 5.08), (response.json()['distance'], response.json()['speed']))
+
+        run = await Run.objects.aget(pk=15)
+        self.assertEqual(3, run.positions_count)
+        self.assertEqual(2.44, round(run.distance, 2))
+        self.assertEqual((await sync_to_async(run.calc_totals)())['speed_sum'], run.speed_sum)
+
+    async def test_collect_items(self):
+        response = await self.post({'run': 14, 'latitude': 20.0001, 'longitude': 50.0001,
+                                    'date_time': '2025-10-10T18:15:00.000000'})
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(['artifact1'], [uid async for uid in (await User.objects.aget(pk=8))
+                                         .items.values_list('uid', flat=True)])
+
+    async def test_invalid(self):
+        position = {'latitude': '20.0', 'longitude': '50.0',
+                    'date_time': '2025-10-10T18:15:00.000000'}
+        for data, field in [({**position, 'run': 100}, 'run'),
+                            ({**position, 'run': 3}, 'run'),
+                            ({**position, 'run': 14, 'latitude': '91'}, 'latitude'),
+                            ({'run': 14}, 'date_time')]:
+            with self.subTest(data=data):
+                response = await self.post(data)
+                self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+                self.assertIn(field, response.json())
+        self.assertEqual(1, await Position.objects.filter(run_id=14).acount())
+
+        response = await self.async_client.post(reverse('position-async'), data='{',
+                                                content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = await self.async_client.get(reverse('position-async'))
+        self.assertEqual(status.HTTP_405_METHOD_NOT_ALLOWED, response.status_code)
+
+    @override_settings(QUERY_STATS_HEADERS=True)
+    async def test_async_middleware(self):
+        response = await self.post({'run': 14, 'latitude': '20.0', 'longitude': '50.0',
+                                    'date_time': '2025-10-10T18:15:00.000000'})
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        # забег, блокировка, последняя координата, вставка, итоги,
+        # артефакты: поиск, уже собранные, связь
+        self.assertEqual('8', response.headers['X-DB-Query-Count'])
+        self.assertEqual('0', response.headers['X-DB-Duplicate-Queries'])
+
+
+class PositionBulkApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def test_bulk_distance_speed(self):
+        url = reverse('position-bulk')
+        data = {'run': 15,
+                'positions': [{'latitude': '20.0160',
+                               'longitude': '50.0160',
+                               'date_time': '2025-10-10T18:08:00.000000'},
+                              {'latitude': '20.0080',
+                               'longitude': '50.0080',
+                               'date_time': '2025-10-10T18:04:00.000000'}]}
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        self.assertEqual(2, len(response.data))
+
+        run = Run.objects.get(pk=15)
+        self.assertEqual(1.22, round(run.positions.get(latitude=20.0080).distance, 2))
+        self.assertEqual(5.08, round(run.positions.get(latitude=20.0080).speed, 2))
+        self.assertEqual(2.44, round(run.positions.get(latitude=20.0160).distance, 2))
+        self.assertEqual(5.08, round(run.positions.get(latitude=20.0160).speed, 2))
+
+    def test_bulk_skip_duplicates(self):
+        url = reverse('position-bulk')
+        data = {'run': 15,
+                'positions': [{'latitude': '20.0000',
+                               'longitude': '50.0000',
+                               'date_time': '2025-10-10T18:00:00.000000'},
+                              {'latitude': '20.0080',
+                               'longitude': '50.0080',
+                               'date_time': '2025-10-10T18:04:00.000000'},
+                              {'latitude': '20.0080',
+                               'longitude': '50.0080',
+                               'date_time': '2025-10-10T18:04:00.000000'}]}
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        self.assertEqual(2, Run.objects.get(pk=15).positions.count())
+
+    def test_bulk_collectible_items(self):
+        url = reverse('position-bulk')
+        data = {'run': 14,
+                'positions': [{'latitude': 20.0001,
+                               'longitude': 50.0001,
+                               'date_time': '2025-10-10T18:15:00.000000'},
+                              {'latitude': 20.0002,
+                               'longitude': 50.0002,
+                               'date_time': '2025-10-10T18:16:00.000000'}]}
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        self.assertEqual(['artifact1'],
+                         list(User.objects.get(pk=8).items.values_list('uid', flat=True)))
+
+    def test_bulk_run_not_in_progress(self):
+        url = reverse('position-bulk')
+        data = {'run': 1,
+                'positions': [{'latitude': 20.0001,
+                               'longitude': 50.0001,
+                               'date_time': '2025-10-10T18:15:00.000000'}]}
+        response = self.client.post(url, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class PositionArchiveApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # хранилище поля задаётся при загрузке модели, override_settings его не меняет
+        patcher = mock.patch.object(Run._meta.get_field('positions_archive'), 'storage',
+                                    FileSystemStorage(location=directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.run = Run.objects.get(pk=15)
+        self.run.add_positions([Position(latitude=20.008, longitude=50.008,
+                                         date_time=datetime.fromisoformat('2025-10-10T18:04:00+00:00'))])
+        url = reverse('position-list')
+        self.positions = self.client.get(url, {'run': 15}).data
+        self.track = self.client.get(reverse('run-track', kwargs={'pk': 15})).data
+        response = self.client.post(reverse('run-stop', kwargs={'pk': 15}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.run.refresh_from_db()
+        self.run.archive_positions()
+
+    def tearDown(self):
+        self.run.positions_archive.delete(save=False)
+
+    def test_archive_positions(self):
+        self.assertFalse(Position.objects.filter(run_id=15).exists())
+        self.assertTrue(self.run.positions_archive.name.startswith('positions/15'))
+        self.assertEqual(2, len(self.run.get_archived_positions()))
+
+    def test_positions_read_through(self):
+        url = reverse('position-list')
+        response = self.client.get(url, {'run': 15})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(self.positions, response.data)
+
+    def test_positions_pagination(self):
+        response = self.client.get(reverse('position-list'), {'run': 15, 'size': 1})
+        self.assertEqual(self.positions[:1], response.data['results'])
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.positions[1:], response.data['results'])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.positions[:1], response.data['results'])
+        response = self.client.get(reverse('position-list'), {'run': 15, 'size': 1, 'cursor': 'bad'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_position_detail(self):
+        for position in self.positions:
+            response = self.client.get(reverse('position-detail', kwargs={'pk': position['id']}))
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(position, response.data)
+        response = self.client.get(reverse('position-detail', kwargs={'pk': 10 ** 6}))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_delete_run_removes_archive(self):
+        name = self.run.positions_archive.name
+        storage = self.run.positions_archive.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_track_read_through(self):
+        cache.clear()
+        response = self.client.get(reverse('run-track', kwargs={'pk': 15}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(self.track, response.data)
+
+    def test_restore_positions(self):
+        name = self.run.positions_archive.name
+        storage = self.run.positions_archive.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run.restore_positions()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(Run.objects.get(pk=15).positions_archive)
+        response = self.client.get(reverse('position-list'), {'run': 15})
+        self.assertEqual(self.positions, response.data)
+
+    def test_totals_after_archive(self):
+        self.assertEqual(2, self.run.calc_totals()['positions_count'])
+        self.assertAlmostEqual(self.run.distance, round(self.run.calc_totals()['distance'], 2))
+
+
+class ExportApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def get_content(self, url, num_queries):
+        with self.assertNumQueries(num_queries):
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode()
+        return response, content
+
+    def test_run_gpx(self):
+        url = reverse('run-export', kwargs={'pk': 14, 'file_format': 'gpx'})
+        response, content = self.get_content(url, 3)
+        self.assertEqual('application/gpx+xml', response['Content-Type'])
+        self.assertEqual('attachment; filename="run_14.gpx"', response['Content-Disposition'])
+        self.assertTrue(content.startswith('<?xml'))
+        self.assertIn('<trkpt lat="20.0000" lon="50.0000"><time>2025-10-10T18:00:00.000000Z</time></trkpt>',
+                      content)
+        self.assertEqual(1, content.count('<trk>'))
+        self.assertTrue(content.endswith('</gpx>\n'))
+
+    def test_run_csv(self):
+        url = reverse('run-export', kwargs={'pk': 13, 'file_format': 'csv'})
+        response, content = self.get_content(url, 3)
+        self.assertEqual('text/csv', response['Content-Type'])
+        lines = content.splitlines()
+        self.assertEqual(','.join(exporters.CSV_HEADERS), lines[0])
+        self.assertEqual(4, len(lines))
+        self.assertEqual('13,4,20.4000,50.4000,,0.0,60.89881869', lines[2])
+
+    def test_athlete_history(self):
+        url = reverse('user-export', kwargs={'pk': 3, 'file_format': 'gpx'})
+        response, content = self.get_content(url, 3)
+        self.assertEqual('attachment; filename="athlete_3.gpx"', response['Content-Disposition'])
+        self.assertEqual(10, content.count('<trk>'))
+
+    def test_athlete_history_chunks(self):
+        Run.objects.get(pk=15).add_positions(
+            [Position(latitude=Decimal(f'20.{index:04d}'), longitude=Decimal('50.0000'), date_time=None)
+             for index in range(1, 11)])
+        url = reverse('user-export', kwargs={'pk': 9, 'file_format': 'csv'})
+        with override_settings(EXPORT_CHUNK_SIZE=3):
+            response, content = self.get_content(url, 3)
+        self.assertEqual(12, len(content.splitlines()))
+
+    def test_not_found(self):
+        response = self.client.get(reverse('run-export', kwargs={'pk': 100, 'file_format': 'gpx'}))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        response = self.client.get(reverse('user-export', kwargs={'pk': 6, 'file_format': 'csv'}))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class RunImportApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    @staticmethod
+    def make_gpx(points):
+        trackpoints = ''.join(f'<trkpt lat="{latitude}" lon="{longitude}"><ele>120</ele>'
+                              f'<time>{date_time}</time></trkpt>'
+                              for latitude, longitude, date_time in points)
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">'
+                f'<trk><name>run</name><trkseg>{trackpoints}</trkseg></trk></gpx>').encode()
+
+    def post_file(self, content, name='run.gpx', athlete=9):
+        url = reverse('run-import')
+        data = {'file': SimpleUploadedFile(name, content), 'athlete': athlete, 'comment': 'offline'}
+        return self.client.post(url, data, format='multipart')
+
+    def test_import_gpx(self):
+        content = self.make_gpx([('20.0000', '50.0000', '2025-10-10T18:00:00Z'),
+                                 ('20.0080', '50.0080', '2025-10-10T18:04:00Z'),
+                                 ('20.0160', '50.0160', '2025-10-10T18:08:00Z')])
+        with mock.patch('app_run.jobs.submit_track_levels') as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post_file(content)
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        run = Run.objects.get(pk=response.data['id'])
+        self.assertEqual('finished', run.status)
+        self.assertEqual('offline', run.comment)
+        self.assertEqual(2.44, run.distance)
+        self.assertEqual(480, run.run_time_seconds)
+        self.assertEqual(3, run.positions.count())
+        self.assertEqual(5.08, round(run.positions.last().speed, 2))
+        submit.assert_called_once_with(run.pk)
+        self.assertTrue(Challenge.objects.filter(athlete_id=9,
+                                                 full_name='2 километра за 10 минут!').exists())
+
+    def test_import_tcx(self):
+        content = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">'
+            '<Activities><Activity Sport="Running"><Lap><Track>'
+            '<Trackpoint><Time>2025-10-10T18:00:00Z</Time><Position>'
+            '<LatitudeDegrees>20.0</LatitudeDegrees><LongitudeDegrees>50.0</LongitudeDegrees>'
+            '</Position></Trackpoint>'
+            '<Trackpoint><Time>2025-10-10T18:02:00Z</Time><HeartRateBpm><Value>150</Value>'
+            '</HeartRateBpm></Trackpoint>'
+            '<Trackpoint><Time>2025-10-10T18:04:00Z</Time><Position>'
+            '<LatitudeDegrees>20.008</LatitudeDegrees><LongitudeDegrees>50.008</LongitudeDegrees>'
+            '</Position></Trackpoint>'
+            '</Track></Lap></Activity></Activities></TrainingCenterDatabase>').encode()
+        response = self.post_file(content, name='run.tcx')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        run = Run.objects.get(pk=response.data['id'])
+        self.assertEqual(2, run.positions_count)
+        self.assertEqual(1.22, run.distance)
+        self.assertEqual(240, run.run_time_seconds)
+
+    def test_import_large_track(self):
+        start = datetime.fromisoformat('2025-10-10T18:00:00+00:00')
+        points = [(f'{20 + index * 0.0001:.4f}', '50.0000',
+                   (start + timedelta(seconds=index)).isoformat())
+                  for index in range(10000)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_file(self.make_gpx(points))
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+        self.assertEqual(10000, Run.objects.get(pk=response.data['id']).positions_count)
+        # запросы только на пачки bulk_create (на SQLite ~170 строк в пачке), не на точку
+        self.assertLess(len(context.captured_queries), 100)
+
+    def test_invalid_file(self):
+        response = self.post_file(b'<gpx><trk>')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.post_file(self.make_gpx([]))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.post_file(self.make_gpx([('95.0', '50.0', '2025-10-10T18:00:00Z')]))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertFalse(Run.objects.filter(comment='offline').exists())
+
+    def test_coach_cannot_import(self):
+        response = self.post_file(self.make_gpx([('20.0', '50.0', '2025-10-10T18:00:00Z')]), athlete=4)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class ConditionalGetApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_collectible_items(self):
+        url = reverse('collectibleitem-list')
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(2, len(response.data))
+
+        CollectibleItem.objects.bulk_create([CollectibleItem(name='new', uid='new', value=1,
+                                                             latitude=10, longitude=10,
+                                                             picture='https://example.com')])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual(3, len(response.data))
+
+    def test_collectible_item_detail(self):
+        url = reverse('collectibleitem-detail', kwargs={'pk': 1})
+        etag = self.client.get(url)['ETag']
+        CollectibleItem.objects.filter(pk=1).update(value=10)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(10, response.data['value'])
+
+    def test_company(self):
+        url = reverse('company-detail')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    def test_challenge_summary(self):
+        url = reverse('challenge-summary')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED,
+                         self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+        Challenge.objects.create(athlete_id=1, full_name='Сделай 10 Забегов!')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, response.data[0]['athletes_count'])
+
+    def test_finished_run(self):
+        url = reverse('run-detail', kwargs={'pk': 3})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        self.client.patch(url, data={'comment': 'updated'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('updated', response.data['comment'])
+
+    def test_run_in_progress(self):
+        response = self.client.get(reverse('run-detail', kwargs={'pk': 2}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotIn('ETag', response)
+
+
+class AnalyticsForCoachApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        cache.clear()
+        Subscribe.objects.create(athlete_id=3, coach_id=4)
+        Subscribe.objects.create(athlete_id=7, coach_id=4)
+        Run.objects.filter(pk__in=[3, 4]).update(distance=5, speed=3)
+        Run.objects.create(athlete_id=7, comment='run', status='finished', distance=8, speed=2)
+
+    def test_analytics(self):
+        url = reverse('analytics-for-coach', kwargs={'coach_id': 4})
+        stats = self.client.get(reverse('cache-stats')).data['analytics_for_coach']
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual({'longest_run_user': 7,
+                          'longest_run_value': 8,
+                          'total_run_user': 3,
+                          'total_run_value': 10,
+                          'speed_avg_user': 7,
+                          'speed_avg_value': 2}, response.data)
+
+        # версия аналитики тренера читается из БД
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual('HIT', response['X-Cache'])
+
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual({'hits': stats['hits'] + 1, 'misses': stats['misses'] + 1},
+                         response.data['analytics_for_coach'])
+
+    def test_analytics_without_athletes(self):
+        url = reverse('analytics-for-coach', kwargs={'coach_id': 5})
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'longest_run_user': None,
+                          'longest_run_value': None,
+                          'total_run_user': None,
+                          'total_run_value': None,
+                          'speed_avg_user': None,
+                          'speed_avg_value': None}, response.data)
+
+    def test_invalidate_on_run_finished(self):
+        url = reverse('analytics-for-coach', kwargs={'coach_id': 4})
+        self.client.get(url)
+        stale_key = caching.get_key('analytics_for_coach', 4, 0)
+        Run.objects.filter(pk=13).update(athlete_id=3)
+        response = self.client.post(reverse('run-stop', kwargs={'pk': 13}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        # запись прежней версии не удаляется: её, как и кэши других процессов, просто не читают
+        self.assertIsNotNone(cache.get(stale_key))
+
+        response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(3, response.data['longest_run_user'])
+        self.assertEqual(60.9, response.data['longest_run_value'])
+
+    def test_invalidate_on_subscribe(self):
+        url = reverse('analytics-for-coach', kwargs={'coach_id': 4})
+        self.client.get(url)
+        response = self.client.post(reverse('subscribe-create', kwargs={'id': 4}),
+                                    data={'athlete': 9}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.data)
+
+        response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+
+
+class RateCoachApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        Subscribe.objects.create(athlete_id=1, coach_id=4)
+        Subscribe.objects.create(athlete_id=2, coach_id=4)
+
+    def rate(self, athlete_id, rating):
+        url = reverse('rate-coach', kwargs={'coach_id': 4})
+        response = self.client.post(url, data={'athlete': athlete_id, 'rating': rating}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.data)
+
+    def get_rating(self):
+        response = self.client.get(reverse('user-list'), query_params={'type': 'coach'})
+        return {obj['id']: obj['rating'] for obj in response.data}
+
+    def test_rating(self):
+        self.assertEqual({4: None, 5: None}, self.get_rating())
+        self.rate(1, 5)
+        self.rate(2, 2)
+        self.assertEqual({4: 3.5, 5: None}, self.get_rating())
+
+        rating = CoachRating.objects.get(coach_id=4)
+        self.assertEqual((7, 2), (rating.rating_sum, rating.rating_count))
+
+    def test_rerate(self):
+        self.rate(1, 5)
+        self.rate(1, 1)
+        self.assertEqual({4: 1, 5: None}, self.get_rating())
+
+    def test_not_subscribed(self):
+        url = reverse('rate-coach', kwargs={'coach_id': 5})
+        response = self.client.post(url, data={'athlete': 1, 'rating': 5}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertFalse(CoachRating.objects.exists())
+
+
+@override_settings(METRICS_TOKEN='secret')
+class QueryBudgetApiTestCase(APITestCase):
+    """ Бюджет запросов к БД каждого маршрута project_run/urls.py (холодный кэш) """
+    fixtures = ['data_db']
+    path_file = settings.BASE_DIR / 'app_run' / 'tests' / 'upload_example.xlsx'
+
+    # SAVEPOINT/RELEASE тоже считаются запросами
+    BUDGETS = {
+        ('get', 'api-root'): 0,
+        ('get', 'company-detail'): 0,
+        ('get', 'run-list'): 1,
+        ('post', 'run-list'): 2,
+        ('get', 'run-detail'): 2,
+        ('patch', 'run-detail'): 2,
+        ('delete', 'run-detail'): 4,
+        ('get', 'run-track'): 2,
+        ('get', 'run-export'): 3,
+        ('post', 'run-import'): 22,
+        ('post', 'run-start'): 3,
+        ('post', 'run-stop'): 9,
+        ('get', 'user-list'): 1,
+        ('get', 'user-detail'): 3,
+        ('get', 'user-export'): 3,
+        ('get', 'position-list'): 3,
+        ('post', 'position-list'): 8,
+        ('get', 'position-detail'): 1,
+        ('delete', 'position-detail'): 9,
+        ('post', 'position-bulk'): 8,
+        ('post', 'position-async'): 6,
+        ('get', 'collectibleitem-list'): 2,
+        ('get', 'collectibleitem-detail'): 2,
+        ('get', 'athlete_info-detail'): 1,
+        ('put', 'athlete_info-detail'): 2,
+        ('get', 'challenge-list'): 1,
+        ('post', 'upload-file'): 8,
+        ('post', 'import-job-create'): 2,
+        ('get', 'import-job-detail'): 2,
+        ('post', 'subscribe-create'): 9,
+        ('get', 'challenge-summary'): 3,
+        ('post', 'rate-coach'): 12,
+        ('get', 'analytics-for-coach'): 4,
+        ('get', 'cache-stats'): 0,
+        ('get', 'metrics'): 0,
+    }
+
+    def setUp(self):
+        Subscribe.objects.create(athlete_id=1, coach_id=4)
+        self.import_job = ImportJob.objects.create(file='items.xlsx')
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(ImportJob._meta.get_field('file'), 'storage',
+                                    FileSystemStorage(location=media_root.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_requests(self):
+        """ (метод, имя маршрута, kwargs маршрута, аргументы запроса) """
+        with open(self.path_file, 'rb') as f_data:
+            workbook = f_data.read()
+
+        def upload():
+            return {'data': {'file': SimpleUploadedFile('items.xlsx', workbook)},
+                    'format': 'multipart'}
+
+        gpx = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>'
+               '<trkpt lat="20.0" lon="50.0"><time>2025-10-10T18:00:00Z</time></trkpt>'
+               '<trkpt lat="20.01" lon="50.01"><time>2025-10-10T18:05:00Z</time></trkpt>'
+               '</trkseg></trk></gpx>').encode()
+        position = {'run': 2, 'latitude': '20.0080', 'longitude': '50.0080',
+                    'date_time': '2025-10-10T18:10:00.000000'}
+        return [
+            ('get', 'api-root', {}, {}),
+            ('get', 'company-detail', {}, {}),
+            ('get', 'run-list', {}, {}),
+            ('post', 'run-list', {}, {'data': {'athlete': 1, 'comment': 'new'}, 'format': 'json'}),
+            ('get', 'run-detail', {'pk': 3}, {}),
+            ('patch', 'run-detail', {'pk': 2}, {'data': {'comment': 'edited'}, 'format': 'json'}),
+            ('delete', 'run-detail', {'pk': 13}, {}),
+            ('get', 'run-track', {'pk': 13}, {}),
+            ('get', 'run-export', {'pk': 13, 'file_format': 'gpx'}, {}),
+            ('post', 'run-import', {}, lambda: {'data': {'file': SimpleUploadedFile('run.gpx', gpx),
+                                                        'athlete': 9},
+                                               'format': 'multipart'}),
+            ('post', 'run-start', {'pk': 1}, {}),
+            ('post', 'run-stop', {'pk': 2}, {}),
+            ('get', 'user-list', {}, {}),
+            ('get', 'user-detail', {'pk': 3}, {}),
+            ('get', 'user-export', {'pk': 3, 'file_format': 'csv'}, {}),
+            ('get', 'position-list', {}, {'data': {'run': 13}}),
+            ('post', 'position-list', {}, {'data': position, 'format': 'json'}),
+            ('post', 'position-async', {}, {'data': position, 'format': 'json'}),
+            ('get', 'position-detail', {'pk': 4}, {}),
+            ('delete', 'position-detail', {'pk': 5}, {}),
+            ('post', 'position-bulk', {}, {'data': {'run': 2, 'positions': [position]},
+                                           'format': 'json'}),
+            ('get', 'collectibleitem-list', {}, {}),
+            ('get', 'collectibleitem-detail', {'pk': 1}, {}),
+            ('get', 'athlete_info-detail', {'id': 1}, {}),
+            ('put', 'athlete_info-detail', {'id': 1}, {'data': {'goals': 'run', 'weight': 70},
+                                                       'format': 'json'}),
+            ('get', 'challenge-list', {}, {}),
+            ('post', 'upload-file', {}, upload),
+            ('post', 'import-job-create', {}, upload),
+            ('get', 'import-job-detail', {'pk': self.import_job.pk}, {}),
+            ('post', 'subscribe-create', {'id': 5}, {'data': {'athlete': 2}, 'format': 'json'}),
+            ('get', 'challenge-summary', {}, {}),
+            ('post', 'rate-coach', {'coach_id': 4}, {'data': {'athlete': 1, 'rating': 5},
+                                                     'format': 'json'}),
+            ('get', 'analytics-for-coach', {'coach_id': 4}, {}),
+            ('get', 'cache-stats', {}, {}),
+            ('get', 'metrics', {}, {'HTTP_AUTHORIZATION': 'Bearer secret'}),
+        ]
+
+    def assertQueryBudget(self, method, name, kwargs, request):
+        """ Запрос укладывается в бюджет BUDGETS[(method, name)] на холодном кэше """
+        cache.clear()
+        request = request() if callable(request) else request
+        with capture_query_stats() as stats:
+            response = getattr(self.client, method)(reverse(name, kwargs=kwargs), **request)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+        budget = self.BUDGETS[method, name]
+        self.assertLessEqual(stats.count, budget,
+                             f'{method.upper()} {name}: {stats.count} queries, budget {budget}, '
+                             f'repeated {stats.get_repeated()}')
+        return stats
+
+    def test_routes_have_budget(self):
+        def get_names(patterns):
+            for pattern in patterns:
+                if hasattr(pattern, 'url_patterns'):
+                    if pattern.namespace != 'admin':
+                        yield from get_names(pattern.url_patterns)
+                elif pattern.name:
+                    yield pattern.name
+
+        names = set(get_names(get_resolver().url_patterns))
+        self.assertEqual(names, {name for _, name in self.BUDGETS})
+        self.assertEqual(set(self.BUDGETS), {(method, name)
+                                             for method, name, _, _ in self.get_requests()})
+
+    def test_budgets(self):
+        for method, name, kwargs, request in self.get_requests():
+            with self.subTest(f'{method} {name}'):
+                with transaction.atomic():
+                    self.assertQueryBudget(method, name, kwargs, request)
+                    transaction.set_rollback(True)
+
+
+class QueryStatsMiddlewareApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    @override_settings(QUERY_STATS_HEADERS=True)
+    def test_headers(self):
+        Subscribe.objects.create(athlete_id=1, coach_id=4)
+        url = reverse('rate-coach', kwargs={'coach_id': 4})
+        response = self.client.post(url, data={'athlete': 1, 'rating': 5}, format='json')
+        stats = response.wsgi_request.query_stats
+        self.assertEqual(str(stats.count), response.headers['X-DB-Query-Count'])
+        self.assertGreater(float(response.headers['X-DB-Time-Ms']), 0)
+        self.assertEqual('0', response.headers['X-DB-Duplicate-Queries'])
+        self.assertEqual(str(stats.similar), response.headers['X-DB-Similar-Queries'])
+
+    @override_settings(QUERY_STATS_HEADERS=False)
+    def test_headers_disabled(self):
+        response = self.client.get(reverse('run-list'))
+        stats = response.wsgi_request.query_stats
+        self.assertEqual(1, stats.count)
+        self.assertEqual({}, stats.get_repeated())
+        self.assertFalse(stats.queries)
+        self.assertNotIn('X-DB-Query-Count', response.headers)
+
+
+class ProfilingApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = FileSystemStorage(location=directory.name)
+        patcher = mock.patch('app_run.profiling.get_profile_storage', return_value=self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_signed_header(self):
+        url = reverse('run-detail', kwargs={'pk': 3})
+        response = self.client.get(url, headers={profiling.TOKEN_HEADER: profiling.make_token()})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        name = response.headers['X-Profile']
+        self.assertTrue(name.startswith('run-detail/'))
+        self.assertGreater(profiling.aggregate([name]).total_calls, 0)
+
+    def test_bad_token(self):
+        response = self.client.get(reverse('run-list'),
+                                   headers={profiling.TOKEN_HEADER: 'profile:bad'})
+        self.assertNotIn('X-Profile', response.headers)
+        self.assertEqual({}, profiling.list_profiles())
+
+    @override_settings(PROFILING_TOKEN_MAX_AGE=-1)
+    def test_expired_token(self):
+        response = self.client.get(reverse('run-list'),
+                                   headers={profiling.TOKEN_HEADER: profiling.make_token()})
+        self.assertNotIn('X-Profile', response.headers)
+
+    def test_sampling(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            response = self.client.get(reverse('challenge-list'))
+        self.assertTrue(response.headers['X-Profile'].startswith('challenge-list/'))
+
+        response = self.client.get(reverse('challenge-list'))
+        self.assertNotIn('X-Profile', response.headers)
+        self.assertEqual(1, len(profiling.list_profiles()['challenge-list']))
+
+    def test_unresolved(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            response = self.client.get('/api/missing/')
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertTrue(response.headers['X-Profile'].startswith(metrics.UNRESOLVED))
+
+
+class MetricsApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def get_value(self, name, **labels):
+        return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics(self):
+        labels = {'route': 'run-detail', 'method': 'GET'}
+        names = ['app_run_request_duration_seconds_count',
+                 'app_run_request_db_seconds_count',
+                 'app_run_request_serialization_seconds_count']
+        counts = [self.get_value(name, **labels) for name in names]
+        not_found = self.get_value('app_run_responses_total', status='404', **labels)
+        self.client.get(reverse('run-detail', kwargs={'pk': 3}))
+        self.client.get(reverse('run-detail', kwargs={'pk': 100}))
+
+        self.assertEqual([count + 2 for count in counts],
+                         [self.get_value(name, **labels) for name in names])
+        self.assertEqual(not_found + 1,
+                         self.get_value('app_run_responses_total', status='404', **labels))
+
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('app_run_request_duration_seconds_bucket'
+                      '{le="0.005",method="GET",route="run-detail"}',
+                      response.content.decode())
+
+    def test_domain_events(self):
+        positions = self.get_value('app_run_positions_ingested_total')
+        artifacts = self.get_value('app_run_artifacts_collected_total')
+        runs = self.get_value('app_run_runs_finished_total')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('position-list'),
+                             {'run': 2, 'latitude': '20.0', 'longitude': '50.0',
+                              'date_time': '2025-10-10T18:10:00.000000'},
+                             format='json')
+        self.assertEqual(positions + 1, self.get_value('app_run_positions_ingested_total'))
+        self.assertEqual(artifacts + 1, self.get_value('app_run_artifacts_collected_total'))
+
+        # артефакт уже собран: повторно не учитывается
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('position-list'),
+                             {'run': 2, 'latitude': '20.0', 'longitude': '50.0',
+                              'date_time': '2025-10-10T18:11:00.000000'},
+                             format='json')
+        self.assertEqual(positions + 2, self.get_value('app_run_positions_ingested_total'))
+        self.assertEqual(artifacts + 1, self.get_value('app_run_artifacts_collected_total'))
+
+        with mock.patch('app_run.jobs.submit_track_levels'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('run-stop', kwargs={'pk': 2}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(runs + 1, self.get_value('app_run_runs_finished_total'))
+
+    def test_challenges_awarded(self):
+        awarded = self.get_value('app_run_challenges_awarded_total')
+        run = Run.objects.get(pk=3)
+        run.distance, run.run_time_seconds = 3, 500
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(1, len(run.award_challenges()))
+        self.assertEqual(awarded + 1, self.get_value('app_run_challenges_awarded_total'))
+
+    def test_access(self):
+        url = reverse('metrics')
+        self.assertEqual(status.HTTP_404_NOT_FOUND, self.client.get(url).status_code)
+        self.assertEqual(status.HTTP_404_NOT_FOUND,
+                         self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(status.HTTP_404_NOT_FOUND,
+                             self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code)
+
+        self.client.force_login(User.objects.create_user('metrics', is_staff=True))
+        self.assertEqual(status.HTTP_200_OK, self.client.get(url).status_code)
+
+    def test_multiprocess(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict('os.environ', {'PROMETHEUS_MULTIPROC_DIR': directory}):
+            self.assertIsNot(metrics.REGISTRY, metrics.get_registry())
+            body, _ = metrics.export()
+        self.assertEqual(b'', body)
+
+
+class LiveRunApiTestCase(APITransactionTestCase):
+    """ Без обёртки в транзакцию: рассылка после commit выполняется сразу """
+    fixtures = ['data_db']
+    application = URLRouter(routing.websocket_urlpatterns)
+
+    def setUp(self):
+        # уровни трека строятся в фоне и не должны пережить очистку таблиц между тестами
+        patcher = mock.patch.object(jobs, 'submit_track_levels')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, run_id=2):
+        communicator = WebsocketCommunicator(self.application, f'/ws/runs/{run_id}/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_stream(self):
+        watch = await self.connect()
+        spectator = await self.connect()
+        state = await spectator.receive_json_from()
+        self.assertEqual({'type': 'state', 'run': 2, 'status': 'in_progress', 'positions_count': 2},
+                         {key: state[key] for key in ['type', 'run', 'status', 'positions_count']})
+        self.assertEqual(2, state['last_position']['id'])
+        await watch.receive_json_from()
+
+        await watch.send_json_to({'positions': [
+            {'latitude': '20.0080', 'longitude': '50.0080', 'date_time': '2025-10-10T18:01:00Z'},
+            {'latitude': '20.0120', 'longitude': '50.0120', 'date_time': '2025-10-10T18:02:00Z'},
+        ]})
+        self.assertEqual({'type': 'ack', 'created': 2}, await watch.receive_json_from())
+
+        message = await spectator.receive_json_from()
+        self.assertEqual('positions', message['type'])
+        self.assertEqual(['20.0080', '20.0120'],
+                         [position['latitude'] for position in message['positions']])
+        self.assertGreater(message['positions'][1]['distance'], message['positions'][0]['distance'])
+        self.assertIn('speed', message['positions'][0])
+        # отправитель не получает свои координаты обратно
+        self.assertTrue(await watch.receive_nothing())
+
+        await watch.disconnect()
+        await spectator.disconnect()
+
+    async def test_http_ingestion_and_finish(self):
+        spectator = await self.connect()
+        await spectator.receive_json_from()
+
+        response = await sync_to_async(self.client.post)(
+            reverse('position-list'),
+            {'run': 2, 'latitude': '20.0080', 'longitude': '50.0080',
+             'date_time': '2025-10-10T18:10:00.000000'},
+            format='json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        message = await spectator.receive_json_from()
+        self.assertEqual([response.data['id']], [position['id'] for position in message['positions']])
+
+        await sync_to_async(self.client.post)(reverse('run-stop', kwargs={'pk': 2}))
+        message = await spectator.receive_json_from()
+        self.assertEqual('finished', message['type'])
+        await spectator.disconnect()
+
+    async def test_invalid(self):
+        watch = await self.connect(run_id=3)
+        await watch.receive_json_from()
+        await watch.send_json_to({'positions': [{'latitude': '20.0'}]})
+        message = await watch.receive_json_from()
+        self.assertEqual('error', message['type'])
+        self.assertIn('run', message['errors'])
+        await watch.disconnect()
+
+    async def test_not_found(self):
+        communicator = WebsocketCommunicator(self.application, '/ws/runs/100/')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(consumers.CLOSE_NOT_FOUND, code)
+
+
+class PositionBufferApiTestCase(APITestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.journal_dir = directory.name
+        self.buffer = ingest.PositionBuffer(max_points=3, max_delay=0, journal_dir=self.journal_dir,
+                                            max_retries=1)
+        self.addCleanup(self.buffer.release)
+        patcher = mock.patch.object(ingest, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, run_id, latitude, longitude, date_time):
+        return self.client.post(reverse('position-list'),
+                                data={'run': run_id, 'latitude': latitude, 'longitude': longitude,
+                                      'date_time': date_time},
+                                format='json')
+
+    def get_journal(self):
+        return sorted(os.listdir(self.journal_dir))
+
+    def test_flush_by_size(self):
+        response = self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        self.assertEqual({'run': 15, 'latitude': '20.0080', 'longitude': '50.0080',
+                          'date_time': '2025-10-10T18:04:00.000000'}, response.json())
+        self.post(14, '20.0001', '50.0001', '2025-10-10T18:15:00.000000')
+        self.assertEqual(1, Position.objects.filter(run_id=15).count())
+        self.assertEqual(1, len(self.get_journal()))
+
+        with CaptureQueriesContext(connection) as context:
+            self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO "app_run_position"')]
+        self.assertEqual(1, len(inserts))
+        self.assertEqual([], self.buffer.positions)
+        self.assertEqual([], self.get_journal())
+
+        run = Run.objects.get(pk=15)
+        self.assertEqual(3, run.positions_count)
+        self.assertEqual(2.44, round(run.distance, 2))
+        self.assertEqual(run.calc_totals()['speed_sum'], run.speed_sum)
+        self.assertEqual(5.08, round(run.positions.last().speed, 2))
+        self.assertEqual(['artifact1'], list(User.objects.get(pk=8).items.values_list('uid', flat=True)))
+
+    def test_chaining_across_flushes(self):
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.assertEqual(1, len(ingest.flush_buffer()))
+        self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        self.assertEqual(1, len(ingest.flush_buffer()))
+
+        run = Run.objects.get(pk=15)
+        totals = run.calc_totals()
+        self.assertEqual(round(totals['distance'], 6), round(run.distance, 6))
+        self.assertEqual(2.44, round(run.positions.last().distance, 2))
+        self.assertEqual([], ingest.flush_buffer())
+
+    def test_flush_sorts_and_deduplicates(self):
+        self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.post(15, '20.0999', '50.0999', '2025-10-10T18:04:00.000000')
+        self.assertEqual([], self.buffer.positions)
+
+        run = Run.objects.get(pk=15)
+        self.assertEqual(3, run.positions_count)
+        self.assertEqual(2.44, round(run.distance, 2))
+        self.assertEqual([Decimal('20.0080'), Decimal('20.0160')],
+                         list(run.positions.order_by('date_time')[1:].values_list('latitude', flat=True)))
+        self.assertEqual(2.44, round(run.positions.order_by('date_time').last().distance, 2))
+
+    def test_flush_error_accepted(self):
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        with mock.patch.object(ingest, 'save_positions', side_effect=ValueError), \
+             self.assertLogs('app_run.ingest', 'ERROR'):
+            response = self.post(14, '20.0001', '50.0001', '2025-10-10T18:15:00.000000')
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        self.assertEqual(3, len(self.buffer.positions))
+
+    def test_invalid(self):
+        response = self.post(3, '20.0', '50.0', '2025-10-10T18:04:00.000000')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual([], self.buffer.positions)
+
+    def test_stop_flushes_buffer(self):
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        response = self.client.post(reverse('run-stop', kwargs={'pk': 15}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2.44, response.json()['distance'])
+        self.assertEqual(3, Position.objects.filter(run_id=15).count())
+        self.assertEqual([], self.get_journal())
+
+    def test_finished_run_dropped(self):
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        Run.objects.filter(pk=15).update(status='finished')
+        self.assertEqual([], ingest.flush_buffer())
+        self.assertEqual(1, Position.objects.filter(run_id=15).count())
+
+    def test_flush_failure_keeps_positions(self):
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        with mock.patch.object(ingest, 'save_positions', side_effect=DatabaseError), \
+             self.assertLogs('app_run.ingest', 'ERROR'):
+            response = self.post(14, '20.0001', '50.0001', '2025-10-10T18:15:00.000000')
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        self.assertEqual(3, len(self.buffer.positions))
+        self.assertEqual(1, len(self.get_journal()))
+
+        self.post(14, '20.0002', '50.0002', '2025-10-10T18:16:00.000000')
+        self.assertEqual([], self.buffer.positions)
+        self.assertEqual(3, Run.objects.get(pk=15).positions_count)
+        self.assertEqual([], self.get_journal())
+
+    def test_flush_failures_drop_batch(self):
+        dropped = metrics.REGISTRY.get_sample_value('app_run_position_buffer_dropped_total') or 0
+        self.post(15, '20.0080', '50.0080', '2025-10-10T18:04:00.000000')
+        self.post(15, '20.0160', '50.0160', '2025-10-10T18:08:00.000000')
+        with mock.patch.object(ingest, 'save_positions', side_effect=DatabaseError), \
+             self.assertLogs('app_run.ingest', 'ERROR') as logs:
+            self.post(14, '20.0001', '50.0001', '2025-10-10T18:15:00.000000')
+            self.assertEqual(3, len(self.buffer.positions))
+            self.post(14, '20.0002', '50.0002', '2025-10-10T18:16:00.000000')
+        self.assertEqual([], self.buffer.positions)
+        self.assertIn('dropped 4 positions', logs.output[-2])
+        self.assertEqual(dropped + 4,
+                         metrics.REGISTRY.get_sample_value('app_run_position_buffer_dropped_total'))
+
+        # сегменты отброшенной пачки освобождены и сохраняется из журнала
+        self.assertEqual((2, 4, 4), ingest.replay_journal(journal_dir=self.journal_dir))
+        self.assertEqual(3, Run.objects.get(pk=15).positions_count)
+        self.assertEqual([], self.get_journal())
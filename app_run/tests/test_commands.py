@@ -0,0 +1,252 @@
+import datetime
+import fcntl
+from decimal import Decimal
+from io import StringIO
+import os
+import tempfile
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from app_run import benchmarks, ingest, profiling, synthetic
+from app_run.models import CollectibleItem, Run, ImportJob, Position, Subscribe
+
+
+class RecomputeRunTotalsTestCase(TestCase):
+    fixtures = ['data_db']
+
+    def test_totals_match(self):
+        out = StringIO()
+        call_command('recompute_run_totals', stdout=out)
+        self.assertIn('mismatched 0', out.getvalue())
+
+    def test_totals_mismatch_fix(self):
+        Run.objects.filter(pk=13).update(distance=0, positions_count=0)
+        out = StringIO()
+        call_command('recompute_run_totals', '13', '--fix', stdout=out)
+        self.assertIn('run 13:', out.getvalue())
+        self.assertIn('mismatched 1, fixed', out.getvalue())
+
+        run = Run.objects.get(pk=13)
+        self.assertEqual(3, run.positions_count)
+        self.assertEqual(60.9, round(run.distance, 1))
+
+
+class ProcessImportJobsTestCase(TestCase):
+    def test_retry_failed(self):
+        job = ImportJob.objects.create(file='missing.xlsx', status='failed', error='error')
+        out = StringIO()
+        call_command('process_import_jobs', '--retry-failed', stdout=out)
+        self.assertIn('requeued 1', out.getvalue())
+        self.assertIn(f'job {job.pk}: failed', out.getvalue())
+        self.assertIn('processed 1', out.getvalue())
+
+
+class BenchmarkTrackSimplificationTestCase(TestCase):
+    fixtures = ['data_db']
+
+    def test_synthetic_track(self):
+        out = StringIO()
+        call_command('benchmark_track_simplification', '--points', '500', '--zooms', '14', stdout=out)
+        self.assertIn('synthetic, seed 0: 500 points', out.getvalue())
+        self.assertEqual(3, len(out.getvalue().splitlines()))
+
+    def test_run_track(self):
+        out = StringIO()
+        call_command('benchmark_track_simplification', '13', stdout=out)
+        self.assertIn('run 13: 3 points', out.getvalue())
+
+
+class ArchiveRunsTestCase(TestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # хранилище поля задаётся при загрузке модели, override_settings его не меняет
+        patcher = mock.patch.object(Run._meta.get_field('positions_archive'), 'storage',
+                                    FileSystemStorage(location=directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Run.objects.filter(pk=2).update(status='finished')
+
+    def test_archive_and_restore(self):
+        out = StringIO()
+        call_command('archive_runs', stdout=out)
+        self.assertIn('run 2: 2 positions', out.getvalue())
+        self.assertFalse(Position.objects.filter(run_id=2).exists())
+        self.assertEqual(2, len(Run.objects.get(pk=2).get_track_rows('id')))
+
+        call_command('archive_runs', '--restore', stdout=out)
+        self.assertIn('restored', out.getvalue())
+        self.assertEqual([1, 2], list(Position.objects.filter(run_id=2).order_by('id')
+                                                      .values_list('id', flat=True)))
+        self.assertFalse(Run.objects.get(pk=2).positions_archive)
+
+
+class BenchmarksTestCase(TestCase):
+    def test_scenarios(self):
+        sizes = {'positions': 20, 'batch': 5, 'items': 50, 'rows': 5, 'users': 5}
+        for name in benchmarks.SCENARIOS:
+            with self.subTest(name):
+                result = benchmarks.run_scenario(name, sizes, iterations=2)
+                self.assertEqual(2, result['requests'])
+                self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+                self.assertGreater(result['queries_max'], 0)
+        self.assertFalse(Run.objects.exists())
+
+    def test_unknown_scenario(self):
+        self.assertRaises(CommandError, call_command, 'benchmark_api', 'missing', stdout=StringIO())
+
+
+class IngestThroughputTestCase(TransactionTestCase):
+    # клиенты работают в других потоках и видят только зафиксированные данные
+    def test_modes(self):
+        for mode in benchmarks.INGEST_MODES:
+            with self.subTest(mode):
+                result = benchmarks.run_ingest_throughput(mode, requests=3, concurrency=1, items=10)
+                self.assertEqual(3, result['requests'])
+                self.assertEqual(0, result['errors'])
+                self.assertEqual(3, result['stored'])
+                self.assertGreater(result['throughput_rps'], 0)
+        self.assertFalse(Run.objects.exists())
+        self.assertFalse(Position.objects.exists())
+        self.assertFalse(CollectibleItem.objects.exists())
+
+    def test_unknown_mode(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown modes: grpc'):
+            call_command('benchmark_ingest', 'asgi', 'grpc')
+
+
+class GenerateDataTestCase(TestCase):
+    def generate(self, *args):
+        call_command('generate_data', '--seed', '7', '--users', '20', '--coaches', '2',
+                     '--runs', '6', '--positions', '30', '--items', '10', *args,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_generate_and_clear(self):
+        self.generate()
+        users = User.objects.filter(username__startswith='gen7_')
+        self.assertEqual(20, users.count())
+        self.assertEqual(2, users.filter(is_staff=True).count())
+        self.assertEqual(10, CollectibleItem.objects.filter(uid__startswith='gen7_').count())
+        self.assertTrue(Subscribe.objects.exists())
+        self.assertEqual(6, Run.objects.count())
+        for run in Run.objects.filter(status='finished'):
+            totals = run.calc_totals()
+            self.assertEqual(totals['positions_count'], run.positions_count)
+            self.assertAlmostEqual(totals['distance'], run.distance, places=2)
+
+        with self.assertRaisesMessage(CommandError, 'remove it with --clear first'):
+            self.generate()
+        self.assertEqual(6, Run.objects.count())
+
+        self.generate('--clear')
+        self.assertFalse(users.exists())
+        self.assertFalse(Run.objects.exists())
+        self.assertFalse(CollectibleItem.objects.exists())
+        self.generate()
+
+    def test_deterministic(self):
+        athlete = User.objects.create(username='athlete')
+        first_run, first_track = synthetic.build_run(7, 3, athlete.id, 50)
+        second_run, second_track = synthetic.build_run(7, 3, athlete.id, 50)
+        self.assertEqual(first_run.status, second_run.status)
+        self.assertEqual([(position.latitude, position.longitude, position.date_time)
+                          for position in first_track],
+                         [(position.latitude, position.longitude, position.date_time)
+                          for position in second_track])
+
+
+class ProfileReportTestCase(TestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('app_run.profiling.get_profile_storage',
+                             return_value=FileSystemStorage(location=directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_report(self):
+        client = APIClient(headers={profiling.TOKEN_HEADER: profiling.make_token()})
+        client.get(reverse('run-list'))
+        client.get(reverse('run-list'))
+        client.get(reverse('run-detail', kwargs={'pk': 3}))
+
+        out = StringIO()
+        call_command('profile_report', '--top', '5', stdout=out)
+        self.assertIn('run-list: 2 requests', out.getvalue())
+        self.assertIn('run-detail: 1 requests', out.getvalue())
+        self.assertIn('function calls', out.getvalue())
+
+        out = StringIO()
+        call_command('profile_report', 'run-list', '--sort', 'tottime', '--delete', stdout=out)
+        self.assertNotIn('run-detail', out.getvalue())
+        self.assertEqual([], profiling.list_profiles()['run-list'])
+        self.assertEqual(1, len(profiling.list_profiles()['run-detail']))
+
+    def test_missing_endpoint(self):
+        self.assertRaises(CommandError, call_command, 'profile_report', 'run-list', stdout=StringIO())
+
+    def test_token(self):
+        out = StringIO()
+        call_command('profile_report', '--token', stdout=out)
+        self.assertTrue(profiling.check_token(out.getvalue().strip()))
+
+
+class ReplayPositionJournalTestCase(TestCase):
+    fixtures = ['data_db']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.journal_dir = directory.name
+
+    def write_segment(self, pid, positions, tail=''):
+        path = os.path.join(self.journal_dir, f'{pid}-segment{ingest.JOURNAL_SUFFIX}')
+        with open(path, 'w') as file:
+            file.writelines(ingest.dump_position(position) + '\n' for position in positions)
+            file.write(tail)
+        return path
+
+    def test_replay(self):
+        stored = Position.objects.filter(run_id=15).last()
+        positions = [
+            # уже сохранена: пачка зафиксирована до удаления сегмента
+            Position(run_id=15, latitude=stored.latitude, longitude=stored.longitude,
+                     date_time=stored.date_time),
+            Position(run_id=15, latitude=Decimal('20.0080'), longitude=Decimal('50.0080'),
+                     date_time=datetime.datetime(2025, 10, 10, 18, 4, tzinfo=datetime.timezone.utc)),
+            Position(run_id=3, latitude=Decimal('20.0'), longitude=Decimal('50.0'),
+                     date_time=datetime.datetime(2025, 10, 10, 18, 4, tzinfo=datetime.timezone.utc)),
+        ]
+        # процессы с такими pid не существуют
+        self.write_segment(2 ** 22 + 1, positions[:2], tail='{"run": 15, "lat')
+        self.write_segment(2 ** 22 + 2, positions[2:])
+        alive = self.write_segment(os.getpid(), positions[1:2])
+        # сегмент работающего процесса заблокирован
+        locked = open(alive)
+        fcntl.flock(locked, fcntl.LOCK_EX)
+
+        out = StringIO()
+        call_command('replay_position_journal', '--journal-dir', self.journal_dir, stdout=out)
+        self.assertIn('segments 2, positions 3, saved 1, skipped 2', out.getvalue())
+        self.assertEqual([os.path.basename(alive)], os.listdir(self.journal_dir))
+
+        run = Run.objects.get(pk=15)
+        self.assertEqual(2, run.positions_count)
+        self.assertEqual(1.22, round(run.positions.last().distance, 2))
+
+        locked.close()
+        out = StringIO()
+        call_command('replay_position_journal', str(os.getpid()),
+                     '--journal-dir', self.journal_dir, stdout=out)
+        self.assertIn('segments 1, positions 1, saved 0', out.getvalue())
+        self.assertEqual([], os.listdir(self.journal_dir))
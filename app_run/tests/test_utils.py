@@ -0,0 +1,193 @@
+import datetime
+import random
+from decimal import Decimal
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from geopy import distance
+
+from django.db.models import F
+
+from app_run import archive, geodistance, simplify, utils
+from app_run.models import CollectibleItem
+from app_run.middleware import capture_query_stats
+
+
+class GridTestCase(SimpleTestCase):
+    def assertInBounds(self, center, point, radius):
+        (latitude_start, latitude_end), longitude_ranges = utils.get_grid_bounds(*center, radius)
+        cell_latitude, cell_longitude = utils.get_grid_cell(*point)
+        self.assertTrue(latitude_start <= cell_latitude <= latitude_end, (center, point))
+        self.assertTrue(any(start <= cell_longitude <= end for start, end in longitude_ranges),
+                        (center, point))
+
+    def test_grid_bounds_cover_radius(self):
+        rng = random.Random(1)
+        for _ in range(2000):
+            center = (rng.uniform(-89.99, 89.99), rng.uniform(-180, 180))
+            point = distance.distance(meters=rng.uniform(0, 100)).destination(center,
+                                                                               rng.uniform(0, 360))
+            self.assertInBounds(center, (point.latitude, point.longitude), 100)
+
+    def test_grid_bounds_antimeridian(self):
+        center = (10.0, 179.9995)
+        point = distance.distance(meters=99).destination(center, 90)
+        self.assertLess(point.longitude, 0)
+        self.assertInBounds(center, (point.latitude, point.longitude), 100)
+
+    def test_grid_bounds_pole(self):
+        latitude_cells, longitude_ranges = utils.get_grid_bounds(89.9995, 0, 100)
+        self.assertEqual([utils.LONGITUDE_CELLS], longitude_ranges)
+        self.assertEqual(utils.LATITUDE_CELLS[1], latitude_cells[1])
+
+    def test_grid_index_nearby(self):
+        class Item:
+            def __init__(self, latitude, longitude):
+                self.latitude, self.longitude = latitude, longitude
+
+        near, far = Item(20.0099, 50.0099), Item(20.1, 50.1)
+        index = utils.GridIndex([near, far])
+        self.assertEqual([near], list(index.nearby(20.0101, 50.0101, 100)))
+
+
+class CollectibleItemGridTestCase(TestCase):
+    def setUp(self):
+        self.item = CollectibleItem.objects.create(name='item', uid='item', value=1,
+                                                   latitude=20.0001, longitude=50.0001,
+                                                   picture='https://example.com')
+
+    def assertCell(self, latitude, longitude):
+        self.item.refresh_from_db()
+        self.assertEqual((latitude, longitude), (self.item.latitude, self.item.longitude))
+        self.assertEqual(utils.get_grid_cell(latitude, longitude),
+                         (self.item.cell_latitude, self.item.cell_longitude))
+
+    def test_update_recomputes_cell(self):
+        CollectibleItem.objects.filter(pk=self.item.pk).update(latitude=-30.5)
+        self.assertCell(-30.5, 50.0001)
+        CollectibleItem.objects.filter(pk=self.item.pk).update(longitude=F('longitude') + 1)
+        self.assertCell(-30.5, 51.0001)
+
+    def test_bulk_update_recomputes_cell(self):
+        self.item.latitude, self.item.longitude = 10.0, -120.0
+        CollectibleItem.objects.bulk_update([self.item], ['latitude', 'longitude'])
+        self.assertCell(10.0, -120.0)
+
+
+class GeodistanceTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.latitudes_1 = rng.uniform(-89, 89, 500)
+        self.longitudes_1 = rng.uniform(-180, 180, 500)
+        self.latitudes_2 = np.clip(self.latitudes_1 + rng.uniform(-3, 3, 500), -89, 89)
+        self.longitudes_2 = self.longitudes_1 + rng.uniform(-3, 3, 500)
+        self.reference = np.array([distance.geodesic(point_1, point_2).meters
+                                   for point_1, point_2
+                                   in zip(zip(self.latitudes_1, self.longitudes_1),
+                                          zip(self.latitudes_2, self.longitudes_2))])
+
+    def test_vincenty_error_bound(self):
+        result = geodistance.pairwise_distances(self.latitudes_1, self.longitudes_1,
+                                                self.latitudes_2, self.longitudes_2,
+                                                geodistance.VINCENTY)
+        self.assertLess(np.max(np.abs(result - self.reference)), 1e-4)
+
+    def test_vincenty_antipodal_fallback(self):
+        result = geodistance.pairwise_distances(0, 0, 0.5, 179.7, geodistance.VINCENTY)
+        self.assertAlmostEqual(distance.geodesic((0, 0), (0.5, 179.7)).meters, result[0], places=4)
+
+    def test_haversine_error_bound(self):
+        result = geodistance.pairwise_distances(self.latitudes_1, self.longitudes_1,
+                                                self.latitudes_2, self.longitudes_2,
+                                                geodistance.HAVERSINE)
+        self.assertLess(np.max(np.abs(result - self.reference) / self.reference), 0.006)
+
+    def test_path_length(self):
+        coordinates = [(20.0, 50.0), (20.008, 50.008), (20.016, 50.016)]
+        self.assertAlmostEqual(distance.geodesic(*coordinates).meters,
+                               geodistance.path_length(coordinates), places=4)
+        self.assertEqual(0.0, geodistance.path_length(coordinates[:1]))
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, geodistance.segment_distances, [0, 1], [0, 1], 'flat')
+
+
+class TrackEncodingTestCase(SimpleTestCase):
+    def test_encode_polyline(self):
+        coordinates = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual('_p~iF~ps|U_ulLnnqC_mqNvxq`@', utils.encode_polyline(coordinates))
+
+    def test_delta_encode(self):
+        self.assertEqual([10, 5, None, -3], utils.delta_encode([10, 15, None, 12]))
+        self.assertEqual([], utils.delta_encode([]))
+
+
+class SimplifyTestCase(SimpleTestCase):
+    def test_collinear_points(self):
+        coordinates = [(20.0, 50.0), (20.001, 50.001), (20.002, 50.002), (20.003, 50.003)]
+        [(indices, max_error)] = simplify.simplify(coordinates, [1])
+        self.assertEqual([0, 3], indices)
+        self.assertLess(max_error, 1)
+
+    def test_levels_match_tolerance(self):
+        rng = np.random.default_rng(2)
+        latitudes = 55.75 + np.cumsum(rng.normal(0, 0.0001, 2000))
+        longitudes = 37.62 + np.cumsum(rng.normal(0, 0.0001, 2000))
+        coordinates = list(zip(latitudes, longitudes))
+        tolerances = [100, 10, 1]
+        levels = simplify.simplify(coordinates, tolerances)
+        sizes = [len(indices) for indices, _ in levels]
+        self.assertEqual(sorted(sizes), sizes)
+        for tolerance, (indices, max_error) in zip(tolerances, levels):
+            self.assertEqual([0, 1999], [indices[0], indices[-1]])
+            self.assertLessEqual(max_error, tolerance)
+
+    def test_significance_floor(self):
+        rng = np.random.default_rng(3)
+        x = np.arange(5000, dtype=float)
+        y = rng.normal(0, 0.5, 5000)
+        weights = simplify.significance(x, y)
+        floored = simplify.significance(x, y, 5)
+        # шум ниже порога не делится, а точки выше порога сохраняют значимость
+        self.assertEqual(2, np.count_nonzero(floored))
+        for tolerance in [5, 10]:
+            self.assertEqual((weights > tolerance).tolist(), (floored > tolerance).tolist())
+        y[2500] = 20
+        floored = simplify.significance(x, y, 5)
+        self.assertIn(2500, np.flatnonzero(floored > 5).tolist())
+        self.assertEqual((simplify.significance(x, y) > 5).tolist(), (floored > 5).tolist())
+
+    def test_single_point(self):
+        self.assertEqual([([0], 0.0)], simplify.simplify([(20.0, 50.0)], [1]))
+        self.assertEqual([([], 0.0)], simplify.simplify([], [1]))
+
+    def test_zoom_tolerance(self):
+        self.assertAlmostEqual(156543.03, simplify.get_zoom_tolerance(0), places=2)
+        self.assertAlmostEqual(simplify.get_zoom_tolerance(10) / 2, simplify.get_zoom_tolerance(11))
+
+
+class ArchiveTestCase(SimpleTestCase):
+    def test_round_trip(self):
+        date_time = datetime.datetime(2025, 10, 10, 18, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        rows = [(7, Decimal('20.0000'), Decimal('50.0000'), None, 0.0, 0.0),
+                (8, Decimal('-20.0080'), Decimal('-179.9999'), date_time, 5.083, 1.2186),
+                (12, Decimal('20.0160'), Decimal('50.0160'),
+                 date_time + datetime.timedelta(minutes=4), 5.0831234567, 2.4373456789)]
+        self.assertEqual(rows, archive.unpack(archive.pack(rows)))
+
+    def test_empty(self):
+        self.assertEqual([], archive.unpack(archive.pack([])))
+
+
+class QueryStatsTestCase(TestCase):
+    def test_duplicates(self):
+        with capture_query_stats() as stats:
+            User.objects.filter(pk=1).first()
+            User.objects.filter(pk=1).first()
+            User.objects.filter(pk=2).first()
+            User.objects.count()
+        self.assertEqual(4, stats.count)
+        self.assertEqual(1, stats.duplicates)
+        self.assertEqual(2, stats.similar)
+        self.assertEqual([3], list(stats.get_repeated().values()))
+        self.assertGreater(stats.time, 0)
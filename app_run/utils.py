@@ -1,14 +1,169 @@
-from geopy import distance
+import collections
+import math
 
+from app_run import geodistance
 
-def get_distance_in_km(coordinates: list[tuple[float, float]]):
-    return round(distance.distance(*coordinates).kilometers, 2)
 
+GRID_CELL_DEGREES = 0.01
+EARTH_MIN_RADIUS_METERS = 6_356_000
+GRID_SAFETY_FACTOR = 1.01
+LATITUDE_CELLS = (math.floor(-90 / GRID_CELL_DEGREES), math.floor(90 / GRID_CELL_DEGREES))
+LONGITUDE_CELLS = (math.floor(-180 / GRID_CELL_DEGREES), math.floor(180 / GRID_CELL_DEGREES))
+POLYLINE_PRECISION = 5
 
-def get_distance_to_object(coordinates_1, coordinates_2):
-    return round(distance.distance(coordinates_1, coordinates_2).meters, 2)
+
+def get_distance_in_km(coordinates: list[tuple[float, float]], method=None):
+    return round(geodistance.path_length(coordinates, method) / 1000, 2)
+
+
+def get_distance_to_object(coordinates_1, coordinates_2, method=None):
+    return round(float(geodistance.pairwise_distances(*coordinates_1, *coordinates_2, method)[0]), 2)
 
 
 def get_seconds_between_dates(date_end, date_start):
     time_diff = date_end - date_start
-    return int(time_diff.total_seconds())
\ No newline at end of file
+    return int(time_diff.total_seconds())
+
+
+def get_speed(distance_km, date_end, date_start):
+    if date_end is None or date_start is None:
+        return 0
+    total_seconds = get_seconds_between_dates(date_end, date_start)
+    if total_seconds <= 0:
+        return 0
+    return (distance_km * 1000) / total_seconds
+
+
+def get_track_totals(rows):
+    """ Итоги трека по строкам (широта, долгота, время, скорость) в порядке записи """
+    rows = list(rows)
+    latitudes = [row[0] for row in rows]
+    longitudes = [row[1] for row in rows]
+    dates = [row[2] for row in rows if row[2] is not None]
+    return {
+        'distance': geodistance.path_length(list(zip(latitudes, longitudes))) / 1000,
+        'positions_count': len(rows),
+        'speed_sum': sum(row[3] or 0 for row in rows),
+        'first_position_at': min(dates) if dates else None,
+        'last_position_at': max(dates) if dates else None,
+    }
+
+
+def encode_polyline(coordinates, precision=5):
+    """ Encoded Polyline Algorithm Format (Google) """
+    factor = 10 ** precision
+    result = []
+    previous_latitude = previous_longitude = 0
+    for latitude, longitude in coordinates:
+        latitude, longitude = round(float(latitude) * factor), round(float(longitude) * factor)
+        for value in (latitude - previous_latitude, longitude - previous_longitude):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        previous_latitude, previous_longitude = latitude, longitude
+    return ''.join(result)
+
+
+def delta_encode(values):
+    """ Первое значение как есть, далее разности с предыдущим; None сохраняется """
+    result = []
+    previous = None
+    for value in values:
+        if value is None:
+            result.append(None)
+            continue
+        result.append(value if previous is None else value - previous)
+        previous = value
+    return result
+
+
+def get_grid_cell(latitude, longitude):
+    return (math.floor(float(latitude) / GRID_CELL_DEGREES),
+            math.floor(float(longitude) / GRID_CELL_DEGREES))
+
+
+def get_grid_bounds(latitude, longitude, radius_meters):
+    """ Диапазоны ячеек сетки, гарантированно покрывающие круг радиуса radius_meters
+
+    Возвращает диапазон ячеек по широте и список диапазонов по долготе
+    (с учётом перехода через 180-й меридиан).
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    radius_radians = radius_meters * GRID_SAFETY_FACTOR / EARTH_MIN_RADIUS_METERS
+    delta_latitude = math.degrees(radius_radians)
+    latitude_min = max(latitude - delta_latitude, -90)
+    latitude_max = min(latitude + delta_latitude, 90)
+    latitude_cells = (get_grid_cell(latitude_min, 0)[0], get_grid_cell(latitude_max, 0)[0])
+
+    # хорда между точками не длиннее дуги, поэтому |Δλ| <= 2·asin(r / (2R·cosφ))
+    max_cos = math.cos(math.radians(max(abs(latitude_min), abs(latitude_max))))
+    if max_cos <= 0 or radius_radians / (2 * max_cos) >= 1:
+        return latitude_cells, [LONGITUDE_CELLS]
+    delta_longitude = math.degrees(2 * math.asin(radius_radians / (2 * max_cos)))
+    if delta_longitude >= 180:
+        return latitude_cells, [LONGITUDE_CELLS]
+
+    longitude_min = longitude - delta_longitude
+    longitude_max = longitude + delta_longitude
+    longitude_ranges = [(get_grid_cell(0, max(longitude_min, -180))[1],
+                         get_grid_cell(0, min(longitude_max, 180))[1])]
+    if longitude_min < -180:
+        longitude_ranges.append((get_grid_cell(0, longitude_min + 360)[1], LONGITUDE_CELLS[1]))
+    if longitude_max > 180:
+        longitude_ranges.append((LONGITUDE_CELLS[0], get_grid_cell(0, longitude_max - 360)[1]))
+    return latitude_cells, longitude_ranges
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class GridIndex:
+    """ Сеточный индекс объектов с полями latitude и longitude """
+    def __init__(self, objects):
+        self.cells = collections.defaultdict(list)
+        for obj in objects:
+            self.cells[get_grid_cell(obj.latitude, obj.longitude)].append(obj)
+
+    def nearby(self, latitude, longitude, radius_meters):
+        """ Объекты из ячеек, покрывающих круг; точную проверку расстояния делает вызывающий """
+        (latitude_start, latitude_end), longitude_ranges = get_grid_bounds(latitude,
+                                                                           longitude,
+                                                                           radius_meters)
+        cells_count = (latitude_end - latitude_start + 1) * sum(end - start + 1
+                                                               for start, end in longitude_ranges)
+        if cells_count <= len(self.cells):
+            for cell_latitude in range(latitude_start, latitude_end + 1):
+                for start, end in longitude_ranges:
+                    for cell_longitude in range(start, end + 1):
+                        yield from self.cells.get((cell_latitude, cell_longitude), [])
+        else:
+            for (cell_latitude, cell_longitude), objects in self.cells.items():
+                if (latitude_start <= cell_latitude <= latitude_end
+                        and any(start <= cell_longitude <= end for start, end in longitude_ranges)):
+                    yield from objects
+
+
+def find_within_radius(coordinates, objects, radius_meters):
+    """ id объектов (с latitude и longitude) ближе radius_meters хотя бы к одной координате """
+    index = GridIndex(objects)
+    found = set()
+    for latitude, longitude in coordinates:
+        candidates = [obj for obj in index.nearby(latitude, longitude, radius_meters)
+                      if obj.id not in found]
+        if not candidates:
+            continue
+        distances = geodistance.distances_to_point([obj.latitude for obj in candidates],
+                                                   [obj.longitude for obj in candidates],
+                                                   latitude, longitude)
+        found.update(obj.id for obj, distance in zip(candidates, distances)
+                     if round(distance, 2) < radius_meters)
+    return found
@@ -1,48 +1,139 @@
-import collections
+import hashlib
+import json
+from xml.etree import ElementTree
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Count, Q, Sum, Min, Max, Avg
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Max, Avg, Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST
 from django.core.exceptions import ObjectDoesNotExist
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework import filters
 from rest_framework import viewsets
 from rest_framework import generics
 from rest_framework import mixins
-from rest_framework.exceptions import ParseError
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound, ParseError, ValidationError
+from rest_framework.pagination import PageNumberPagination, CursorPagination, Cursor
 from rest_framework import status
 from rest_framework import views
 from rest_framework import parsers
 from django_filters.rest_framework import DjangoFilterBackend
-from openpyxl import load_workbook
 
 from app_run.models import (
     Run,
+    RunNotInProgress,
     AthleteInfo,
     Challenge,
     Position,
     CollectibleItem,
     Subscribe,
+    ImportJob,
+    ChallengeSummary,
+    CoachRating,
+    TrackLevel,
+    ResourceVersion,
 )    
 from app_run.serializers import (
+    RUN_NOT_IN_PROGRESS,
     RunSerializer,
     UserSerializer,
     AthleteInfoSerializer,
     ChallengeSerializer,
+    PositionAcceptedSerializer,
     PositionSerializer,
+    PositionBulkSerializer,
+    PositionAsyncSerializer,
     CollectibleItemSerializer,
     UserDetailCoachSerializer,
     UserDetailAthleteSerializer,
     SubscribeSerializer,
     RateCoachSerializer,
     AnalyticsForCoachSerializer,
+    ImportJobSerializer,
+    ChallengeSummarySerializer,
+    ChallengeSummaryQuerySerializer,
+    TrackQuerySerializer,
+    RunImportSerializer,
 )
-from app_run import utils
+from app_run import caching, exporters, importers, ingest, jobs, live, metrics, simplify
+
+
+COACH_ANALYTICS_CACHE = 'analytics_for_coach'
+RUN_TRACK_CACHE = 'run_track'
+RUN_DETAIL_CACHE = 'run_detail'
+COLLECTIBLE_ITEMS_CACHE = 'collectible_items'
+CHALLENGE_SUMMARY_CACHE = 'challenge_summary'
+
+
+def get_company_version(request, *args, **kwargs):
+    data = json.dumps(settings.ABOUT_COMPANY, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(data.encode()).hexdigest(), None
+
+
+def get_finished_run_version(request, *args, **kwargs):
+    """ Версия завершённого забега по updated_at; незавершённые не кэшируются """
+    if not str(kwargs.get('pk')).isdigit():
+        return None
+    updated_at = Run.objects.filter(pk=kwargs['pk'], status='finished') \
+                            .values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return int(updated_at.timestamp() * 1_000_000), updated_at
+
+
+def get_resource_version(name):
+    def get_version(request, *args, **kwargs):
+        return ResourceVersion.get_version(name)
+    return get_version
+
+
+class KeysetPagination(CursorPagination):
+    """ Курсорная пагинация, включается параметром size
+
+    К сортировке добавляется id, чтобы порядок был однозначным.
+    """
+    page_size_query_param = 'size'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return tuple(ordering)
+
+    def paginate_list(self, items, request):
+        """ Страница упорядоченного списка (например, из архива): позиция курсора -- номер элемента """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+        if cursor is not None and not (cursor.position or '').isdigit():
+            raise NotFound(self.invalid_cursor_message)
+        if cursor is not None and cursor.reverse:
+            end = int(cursor.position)
+            start = max(end - page_size, 0)
+        else:
+            start = int(cursor.position) if cursor is not None else 0
+            end = start + page_size
+        self.list_links = (
+            self.encode_cursor(Cursor(offset=0, reverse=False, position=str(end))) if end < len(items) else None,
+            self.encode_cursor(Cursor(offset=0, reverse=True, position=str(start))) if start > 0 else None,
+        )
+        return items[start:end]
+
+    def get_list_response(self, data):
+        next_link, previous_link = self.list_links
+        return Response({'next': next_link, 'previous': previous_link, 'results': data})
 
 
 @api_view()
+@caching.resource_condition(get_company_version)
 def detail_company(request):
     """ Название компании, слоган, адрес """
     return Response(settings.ABOUT_COMPANY)
@@ -50,8 +141,8 @@ def detail_company(request):
 
 class RunViewSet(viewsets.ModelViewSet):
     """ Забеги """
-    class RunPagination(PageNumberPagination):
-        page_size_query_param = 'size'
+    class RunPagination(KeysetPagination):
+        ordering = ('created_at', 'id')
 
     queryset = Run.objects.select_related('athlete').all()
     serializer_class = RunSerializer
@@ -59,6 +150,89 @@ class RunViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['status', 'athlete']
     ordering_fields = ['created_at']
+    ordering = ['created_at', 'id']
+
+    @method_decorator(caching.resource_condition(get_finished_run_version))
+    @caching.cached_response_data(RUN_DETAIL_CACHE, settings.RESOURCE_CACHE_TIMEOUT)
+    def retrieve(self, request, *args, **kwargs):
+        """ Завершённый забег поддерживает условный GET и кэш ответа """
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True)
+    def track(self, request, *args, **kwargs):
+        """ Трек забега в компактном виде; для завершённых забегов кэшируется
+
+        Параметр zoom отдаёт упрощённый трек для масштаба карты (уровни строятся в
+        фоне после завершения забега; если их ещё нет, их строит сам запрос),
+        tolerance -- упрощённый с заданным допуском в метрах.
+        """
+        query_serializer = TrackQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        zoom = query_serializer.validated_data.get('zoom')
+        tolerance = query_serializer.validated_data.get('tolerance')
+
+        if zoom is not None and zoom <= max(settings.TRACK_SIMPLIFICATION_ZOOMS):
+            level = TrackLevel.objects.filter(run_id=self.kwargs['pk'], zoom__gte=zoom) \
+                                      .order_by('zoom').first()
+            if level is None:
+                run_object = get_object_or_404(Run.objects.only('id', 'status', 'positions_archive'),
+                                               pk=self.kwargs['pk'])
+                if run_object.status == 'finished':
+                    level = next(level for level in run_object.build_track_levels()
+                                 if level.zoom >= zoom)
+            if level:
+                return Response(level.get_track())
+            tolerance = simplify.get_zoom_tolerance(zoom)
+        if tolerance is not None:
+            run_object = get_object_or_404(Run.objects.only('id', 'positions_archive'),
+                                           pk=self.kwargs['pk'])
+            level = run_object.simplify_track([tolerance])[0]
+            level.zoom = zoom
+            return Response(level.get_track())
+
+        run_object = get_object_or_404(
+            Run.objects.only('id', 'status', 'positions_archive', 'updated_at'), pk=self.kwargs['pk'])
+        if run_object.status != 'finished':
+            return Response(run_object.get_track())
+        # версия в ключе -- время изменения забега, общее для всех процессов
+        key = caching.get_key(RUN_TRACK_CACHE, run_object.pk, run_object.updated_at.timestamp())
+        data = caching.get(RUN_TRACK_CACHE, key)
+        if data is None:
+            data = run_object.get_track()
+            cache.set(key, data, timeout=settings.RUN_TRACK_CACHE_TIMEOUT)
+        return Response(data)
+
+    @action(detail=False, methods=['post'], url_path='import', url_name='import',
+            serializer_class=RunImportSerializer, parser_classes=[parsers.MultiPartParser])
+    def import_run(self, request, *args, **kwargs):
+        """ Импорт завершённого забега из файла GPX или TCX """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            run_object = importers.import_run(**serializer.validated_data)
+        except (ElementTree.ParseError, ValueError, ArithmeticError) as error:
+            raise ParseError(f'Invalid track file: {error}')
+
+        transaction.on_commit(lambda: jobs.submit_track_levels(run_object.pk))
+        invalidate_coach_analytics(Subscribe.objects.filter(athlete=run_object.athlete)
+                                                    .values_list('coach_id', flat=True))
+        return Response(RunSerializer(run_object).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, url_path='export/(?P<file_format>gpx|csv)', url_name='export')
+    def export(self, request, file_format, *args, **kwargs):
+        """ Экспорт трека забега в GPX или CSV """
+        runs = Run.objects.filter(pk=self.kwargs['pk'])
+        if not runs.exists():
+            raise Http404
+        return export_runs(runs, file_format, f'run_{self.kwargs["pk"]}')
+
+
+def export_runs(runs, file_format, filename):
+    """ Потоковый ответ с экспортом забегов """
+    response = StreamingHttpResponse(exporters.export(runs, file_format),
+                                     content_type=exporters.CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
 
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
@@ -66,7 +240,7 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     class Userpagination(PageNumberPagination):
         page_size_query_param = 'size'
 
-    queryset = User.objects.prefetch_related('athletes') \
+    queryset = User.objects.select_related('coach_rating') \
                         .annotate(runs_finished=Count('athletes__status',
                                                      filter=Q(athletes__status='finished')))
     pagination_class = Userpagination
@@ -85,11 +259,27 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             return queryset
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        qs = User.objects.annotate(avg_rating=Avg('subscribes_coach__rating'))
-        context['avg_ratings'] = {obj.id: obj.avg_rating for obj in qs}
-        return context
+    def get_object(self):
+        if not hasattr(self, '_object'):
+            obj = super().get_object()
+            if obj.is_staff:
+                lookups = [Prefetch('subscribes_coach',
+                                    queryset=Subscribe.objects.only('athlete', 'coach'))]
+            else:
+                lookups = ['items',
+                           Prefetch('subscribes_athlete',
+                                    queryset=Subscribe.objects.only('athlete', 'coach').order_by('pk'))]
+            prefetch_related_objects([obj], *lookups)
+            self._object = obj
+        return self._object
+
+    @action(detail=True, url_path='export/(?P<file_format>gpx|csv)', url_name='export')
+    def export(self, request, file_format, *args, **kwargs):
+        """ Экспорт всех забегов атлета в GPX или CSV """
+        athlete = get_object_or_404(User.objects.only('id'),
+                                    pk=self.kwargs['pk'],
+                                    is_superuser=False)
+        return export_runs(Run.objects.filter(athlete=athlete), file_format, f'athlete_{athlete.id}')
 
     def get_serializer_class(self):
         if self.kwargs.get('pk'):
@@ -123,12 +313,20 @@ class RunViewStart(mixins.UpdateModelMixin, generics.GenericAPIView):
 
 
 class RunViewStop(mixins.UpdateModelMixin, generics.GenericAPIView):
-    """ Завершение забега """
-    queryset = Run.objects.select_related('athlete').prefetch_related('positions').all()
+    """ Завершение забега
+
+    Забег блокируется до проверки статуса: координата, пришедшая в момент
+    завершения, либо попадает в итоги, либо отклоняется.
+    """
+    queryset = Run.objects.select_related('athlete').select_for_update(of=('self',))
     serializer_class = RunSerializer
-    
+
     def post(self, request, *args, **kwargs):
-        return self.partial_update(request, *args, **kwargs)
+        # координаты из буфера отложенной записи должны попасть в итоги забега;
+        # сброс сам ждёт блокировки забега, поэтому выполняется до неё
+        ingest.flush_buffer()
+        with transaction.atomic():
+            return self.partial_update(request, *args, **kwargs)
 
     def get_object(self):
         obj = super().get_object()
@@ -140,39 +338,14 @@ class RunViewStop(mixins.UpdateModelMixin, generics.GenericAPIView):
             return obj
 
     def perform_update(self, serializer):
-        run_object = self.get_object()
-
-        total_distance = run_object.get_total_distance()
-        run_time_seconds = 0
-        run_avg_speed = 0
-
-        run_date_time = run_object.positions.aggregate(Min('date_time'), Max('date_time'))
-        if (run_date_time['date_time__min'] is not None
-                and run_date_time['date_time__max'] is not None):
-            run_time_seconds = utils.get_seconds_between_dates(run_date_time['date_time__max'],
-                                                               run_date_time['date_time__min'])
-            run_avg_speed = run_object.positions.aggregate(Avg('speed'))['speed__avg']
-
-        run_finished = serializer.save(status='finished',
-                                       distance=total_distance,
-                                       run_time_seconds=run_time_seconds,
-                                       speed=run_avg_speed)
-
-        run_challenges = self.get_queryset().filter(athlete=run_finished.athlete,
-                                                    status='finished') \
-                                            .aggregate(total_finished=Count('id'),
-                                                       total_distance=Sum('distance'))
-
-        if run_challenges['total_finished'] == 10:
-            Challenge.objects.create(athlete=run_finished.athlete,
-                                     full_name='Сделай 10 Забегов!')
-        if run_challenges['total_distance'] >= 50:
-            Challenge.objects.create(athlete=run_finished.athlete,
-                                     full_name='Пробеги 50 километров!')
-        if total_distance >= 2 and run_time_seconds <= 600:
-            Challenge.objects.create(athlete=run_finished.athlete,
-                                    full_name='2 километра за 10 минут!')
-
+        run_finished = serializer.instance
+        run_finished.finish()
+        # уровни детализации трека строятся в фоне после фиксации завершения
+        transaction.on_commit(lambda: jobs.submit_track_levels(run_finished.pk))
+        live.broadcast_finished(run_finished)
+
+        invalidate_coach_analytics(Subscribe.objects.filter(athlete=run_finished.athlete)
+                                                    .values_list('coach_id', flat=True))
         return run_finished
 
 
@@ -202,53 +375,119 @@ class AthleteInfoView(generics.RetrieveUpdateAPIView):
 
 class ChallengeView(generics.ListAPIView):
     """ Челенджи """
+    class ChallengePagination(KeysetPagination):
+        ordering = ('id',)
+
     queryset = Challenge.objects.all()
     serializer_class = ChallengeSerializer
+    pagination_class = ChallengePagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['athlete']
 
 
 class PositionViewSet(viewsets.ModelViewSet):
     """ Кооординаты атлета """
-    queryset = Position.objects.select_related('run').all()
+    class PositionPagination(KeysetPagination):
+        ordering = ('date_time', 'id')
+
+    queryset = Position.objects.all()
     serializer_class = PositionSerializer
+    pagination_class = PositionPagination
     http_method_names = ['get', 'post', 'delete', 'head', 'options', 'trace']
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['run']
 
-    def perform_create(self, serializer):
-        run_object = serializer.validated_data['run']
-        last_position = run_object.positions.last()
-
-        if last_position:
-            current_latitude = serializer.validated_data['latitude']
-            current_longitude = serializer.validated_data['longitude']
-
-            distance_last_position = utils.get_distance_in_km([
-                                        (last_position.latitude, last_position.longitude),
-                                        (current_latitude, current_longitude)
-                                        ])
-            distance_total = distance_last_position + last_position.distance
+    def list(self, request, *args, **kwargs):
+        """ Координаты архивированного забега читаются из архива """
+        run_id = request.query_params.get('run', '')
+        run_object = None
+        if run_id.isdigit():
+            run_object = Run.objects.only('id', 'positions_archive') \
+                                    .exclude(positions_archive='').filter(pk=run_id).first()
+        if run_object is None:
+            return super().list(request, *args, **kwargs)
+
+        positions = run_object.get_archived_positions()
+        page = self.paginator.paginate_list(positions, request)
+        if page is not None:
+            return self.paginator.get_list_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(positions, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """ Координата архивированного забега читается из архива """
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            position_id = self.kwargs['pk']
+            position = Run.get_archived_position(int(position_id)) if position_id.isdigit() else None
+            if position is None:
+                raise
+        return Response(self.get_serializer(position).data)
 
-            current_date = serializer.validated_data['date_time']
-            date_last_position = last_position.date_time
-            total_seconds = utils.get_seconds_between_dates(current_date, date_last_position)
-            speed_between_positions = (distance_last_position * 1000) / total_seconds
+    def create(self, request, *args, **kwargs):
+        """ При включённой отложенной записи координата принимается в буфер (202) """
+        buffer = ingest.get_buffer()
+        if buffer is None:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        position = Position(**serializer.validated_data)
+        buffer.add(position)
+        return Response(PositionAcceptedSerializer(position).data, status=status.HTTP_202_ACCEPTED)
 
-            position = serializer.save(distance=distance_total,
-                                       speed=speed_between_positions)
-        else:
-            position = serializer.save()
+    def perform_create(self, serializer):
+        run_object = serializer.validated_data['run']
+        position = Position(**serializer.validated_data)
+        try:
+            run_object.add_positions([position])
+        except RunNotInProgress:
+            raise ValidationError({'run': [RUN_NOT_IN_PROGRESS]})
+        live.broadcast_positions(run_object.id, [position])
+        serializer.instance = position
+
+    def perform_destroy(self, instance):
+        """ Удалять можно только координаты забега в процессе: трек завершённого неизменен """
+        try:
+            instance.run.delete_position(instance)
+        except RunNotInProgress:
+            raise ParseError('The race is already over')
 
-        CollectibleItem.objects.exclude(
-            Q(latitude__range=(-90, 90)) & Q(longitude__range=(-180, 180))).delete()
-        for artifact in CollectibleItem.objects.all():
-            distance = utils.get_distance_to_object(
-                            (artifact.latitude, artifact.longitude),
-                            (position.latitude, position.longitude))
-            if distance < 100:
-                user = position.run.athlete
-                user.items.add(artifact)
+    @action(detail=False, methods=['post'], serializer_class=PositionBulkSerializer)
+    def bulk(self, request, *args, **kwargs):
+        """ Пакетная загрузка координат одного забега """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        run_object = serializer.validated_data['run']
+        positions = [Position(**data) for data in serializer.validated_data['positions']]
+        try:
+            created = run_object.add_positions(positions, skip_stale=True)
+        except RunNotInProgress:
+            raise ValidationError({'run': [RUN_NOT_IN_PROGRESS]})
+        live.broadcast_positions(run_object.id, created)
+
+        return Response(PositionSerializer(created, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+
+@require_POST
+async def create_position_async(request):
+    """ Асинхронный приём координаты (ASGI), тело и ответ как у POST api/positions/ """
+    try:
+        data = json.loads(request.body)
+    except ValueError as exc:
+        return JsonResponse({'detail': f'JSON parse error - {exc}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    serializer = PositionAsyncSerializer(data=data)
+    if not await serializer.ais_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    position = Position(**serializer.validated_data)
+    try:
+        await position.run.aadd_positions([position])
+    except RunNotInProgress:
+        return JsonResponse({'run': [RUN_NOT_IN_PROGRESS]}, status=status.HTTP_400_BAD_REQUEST)
+    await live.abroadcast_positions(position.run_id, [position])
+    return JsonResponse(PositionSerializer(position).data, status=status.HTTP_201_CREATED)
 
 
 class CollectibleItemView(viewsets.ReadOnlyModelViewSet):
@@ -256,33 +495,56 @@ class CollectibleItemView(viewsets.ReadOnlyModelViewSet):
     queryset = CollectibleItem.objects.all()
     serializer_class = CollectibleItemSerializer
 
+    @method_decorator(caching.resource_condition(
+        get_resource_version(ResourceVersion.COLLECTIBLE_ITEMS)))
+    @caching.cached_response_data(COLLECTIBLE_ITEMS_CACHE, settings.RESOURCE_CACHE_TIMEOUT)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(caching.resource_condition(
+        get_resource_version(ResourceVersion.COLLECTIBLE_ITEMS)))
+    @caching.cached_response_data(COLLECTIBLE_ITEMS_CACHE, settings.RESOURCE_CACHE_TIMEOUT)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class FileUploadView(views.APIView):
     """ Загрузка коллекции предметов(артефактов) из файла """
     parser_classes = [parsers.MultiPartParser]
 
     def post(self, request):
-        workbook = load_workbook(filename=request.FILES.get('file'))
-        sheet = workbook.active
-        correct_row = []
         errors_row = []
-        headers = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
-        for i, row in enumerate(sheet):
-            if i == 0:
-                continue
-            data = {header: cell.value for header, cell in zip(headers, row)}
-            if CollectibleItemSerializer(data=data).is_valid():
-                correct_row.append(data)
-            else:
-                errors_row.append(list(data.values()))
 
-        serializer = CollectibleItemSerializer(data=correct_row, many=True)
-        serializer.is_valid()
-        serializer.save()
+        def on_chunk(rows_read, items_saved, chunk_errors):
+            errors_row.extend(chunk_errors)
 
+        rows = importers.iter_workbook_rows(request.FILES.get('file'))
+        importers.import_collectible_items(rows, on_chunk=on_chunk)
         return Response(data=errors_row, status=status.HTTP_200_OK)
 
 
+class ImportJobView(generics.CreateAPIView):
+    """ Фоновый импорт коллекции предметов(артефактов) из файла """
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+    parser_classes = [parsers.MultiPartParser]
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def perform_create(self, serializer):
+        serializer.save()
+        transaction.on_commit(jobs.submit_import_jobs)
+
+
+class ImportJobDetailView(generics.RetrieveAPIView):
+    """ Состояние фонового импорта """
+    queryset = ImportJob.objects.prefetch_related('errors_row').all()
+    serializer_class = ImportJobSerializer
+
+
 class SubscribeView(generics.CreateAPIView):
     """ Подписка на тренеров """
     queryset = Subscribe.objects.all()
@@ -299,33 +561,30 @@ class SubscribeView(generics.CreateAPIView):
         serializer.initial_data['coach'] = self.kwargs['id']
         return serializer
 
+    def perform_create(self, serializer):
+        subscribe = serializer.save()
+        CoachRating.update_rating(subscribe.coach_id, None, subscribe.rating)
+        invalidate_coach_analytics([subscribe.coach_id])
+
 
 class ChallengeSummaryView(views.APIView):
-    """ Итоговая таблица челенджей """
+    """ Итоговая таблица челенджей, постраничный вывод атлетов внутри челенджа """
+    @method_decorator(caching.resource_condition(
+        get_resource_version(ResourceVersion.CHALLENGE_SUMMARY)))
+    @caching.cached_response_data(CHALLENGE_SUMMARY_CACHE, settings.RESOURCE_CACHE_TIMEOUT)
     def get(self, request):
-        queryset = Challenge.objects \
-                            .select_related('athlete') \
-                            .filter(athlete__is_staff=False) \
-                            .order_by('full_name') \
-                            .all()
-
-        record = collections.defaultdict(list)
-        results = []
-        qs_list = list(queryset)
-        first_challenge = qs_list[0].full_name
-        for challenge in qs_list:
-            if first_challenge != challenge.full_name:
-                results.append(dict(record))
-                first_challenge = challenge.full_name
-                record = collections.defaultdict(list)
-            record['name_to_display'] = challenge.full_name
-            record['athletes'].append({'id': challenge.athlete_id,
-                                  'full_name': f'{challenge.athlete.first_name} {challenge.athlete.last_name}',
-                                  'username': challenge.athlete.username})
-        else:
-            results.append(dict(record))
+        query_serializer = ChallengeSummaryQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
 
-        return Response(results)
+        size = query_serializer.validated_data.get('size')
+        start = (query_serializer.validated_data['page'] - 1) * size if size else 0
+        queryset = ChallengeSummary.objects.order_by('full_name') \
+                                           .prefetch_related(
+                                                Prefetch('athletes',
+                                                         ChallengeSummary.get_athletes(start, size),
+                                                         to_attr='athletes_page'))
+        serializer = ChallengeSummarySerializer(queryset, many=True)
+        return Response(serializer.data)
 
 
 class RateCoachView(views.APIView):
@@ -336,13 +595,17 @@ class RateCoachView(views.APIView):
         serializator = RateCoachSerializer(data=data)
         serializator.is_valid(raise_exception=True)
 
-        try:
-            object = Subscribe.objects.get(athlete=serializator.validated_data['athlete'],
-                                           coach=serializator.validated_data['coach_id'])
+        with transaction.atomic():
+            try:
+                object = Subscribe.objects.select_for_update() \
+                                          .get(athlete=serializator.validated_data['athlete'],
+                                               coach=serializator.validated_data['coach_id'])
+            except ObjectDoesNotExist:
+                raise ParseError('Athlete not subsription on trainer')
+            old_rating = object.rating
             object.rating = serializator.validated_data.get('rating', object.rating)
             object.save()
-        except ObjectDoesNotExist:
-            raise ParseError('Athlete not subsription on trainer')
+            CoachRating.update_rating(object.coach_id, old_rating, object.rating)
 
         return Response(status.HTTP_200_OK)
 
@@ -350,41 +613,76 @@ class RateCoachView(views.APIView):
 class AnalyticsForCoachView(views.APIView):
     """ Аналитика для тренера """
     def get(self, request, *args, **kwargs):
+        version, _ = ResourceVersion.get_version(get_coach_analytics_name(self.kwargs['coach_id']))
+        key = caching.get_key(COACH_ANALYTICS_CACHE, self.kwargs['coach_id'], version)
+        data = caching.get(COACH_ANALYTICS_CACHE, key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
         get_object_or_404(User, id=self.kwargs['coach_id'])
 
         serializer = AnalyticsForCoachSerializer(data={'coach_id': self.kwargs['coach_id']})
         serializer.is_valid(raise_exception=True)
 
         coach = serializer.validated_data['coach_id']
-
-        althlete_max_distance = User.objects \
-                                    .filter(subscribes_athlete__coach=coach,
-                                            athletes__status='finished') \
-                                    .annotate(distance_max=Max('athletes__distance')) \
-                                    .order_by('-distance_max') \
-                                    .first()
-
-        althlete_max_sum_distance = User.objects \
-                                        .filter(subscribes_athlete__coach=coach,
-                                                athletes__status='finished') \
-                                        .annotate(distance_sum=Sum('athletes__distance')) \
-                                        .order_by('-distance_sum') \
-                                        .first()
-
-        althlete_max_avg_speed = User.objects \
-                                        .filter(subscribes_athlete__coach=coach,
-                                                athletes__status='finished') \
-                                        .annotate(distance_avg=Avg('athletes__speed')) \
-                                        .order_by('-distance_avg') \
-                                        .first()
-
-        data = {
-            'longest_run_user':  althlete_max_distance.id if althlete_max_distance else None,
-            'longest_run_value': althlete_max_distance.distance_max if althlete_max_distance else None,
-            'total_run_user': althlete_max_sum_distance.id if althlete_max_sum_distance else None,
-            'total_run_value': althlete_max_sum_distance.distance_sum if althlete_max_sum_distance else None,
-            'speed_avg_user': althlete_max_avg_speed.id if althlete_max_avg_speed else None,
-            'speed_avg_value': althlete_max_avg_speed.distance_avg if althlete_max_avg_speed else None 
+        data = self.get_analytics(coach)
+        cache.set(key, data, timeout=settings.COACH_ANALYTICS_CACHE_TIMEOUT)
+        return Response(data, headers={'X-Cache': 'MISS'})
+
+    @staticmethod
+    def get_analytics(coach):
+        athletes = User.objects \
+                       .filter(subscribes_athlete__coach=coach,
+                               athletes__status='finished') \
+                       .annotate(distance_max=Max('athletes__distance'),
+                                 distance_sum=Sum('athletes__distance'),
+                                 speed_avg=Avg('athletes__speed')) \
+                       .values_list('id', 'distance_max', 'distance_sum', 'speed_avg')
+        athletes = list(athletes)
+
+        def leader(index):
+            athlete = max(athletes, key=lambda row: row[index], default=None)
+            return (athlete[0], athlete[index]) if athlete else (None, None)
+
+        longest_run_user, longest_run_value = leader(1)
+        total_run_user, total_run_value = leader(2)
+        speed_avg_user, speed_avg_value = leader(3)
+
+        return {
+            'longest_run_user': longest_run_user,
+            'longest_run_value': longest_run_value,
+            'total_run_user': total_run_user,
+            'total_run_value': total_run_value,
+            'speed_avg_user': speed_avg_user,
+            'speed_avg_value': speed_avg_value,
         }
 
-        return Response(data)
\ No newline at end of file
+
+class CacheStatsView(views.APIView):
+    """ Счётчики попаданий и промахов кэша """
+    def get(self, request):
+        return Response({name: caching.get_stats(name)
+                         for name in [COACH_ANALYTICS_CACHE,
+                                      RUN_TRACK_CACHE,
+                                      RUN_DETAIL_CACHE,
+                                      COLLECTIBLE_ITEMS_CACHE,
+                                      CHALLENGE_SUMMARY_CACHE]})
+
+
+def export_metrics(request):
+    """ Метрики в текстовом формате Prometheus: по токену METRICS_TOKEN или для персонала """
+    if not (metrics.check_token(request) or request.user.is_staff):
+        raise Http404
+    body, content_type = metrics.export()
+    return HttpResponse(body, content_type=content_type)
+
+
+def get_coach_analytics_name(coach_id):
+    """ Имя версии аналитики тренера в ResourceVersion """
+    return caching.get_key(COACH_ANALYTICS_CACHE, coach_id)
+
+
+def invalidate_coach_analytics(coach_ids):
+    """ Новая версия аналитики тренеров: кэш прежней не используется ни одним процессом """
+    for coach_id in coach_ids:
+        ResourceVersion.bump(get_coach_analytics_name(coach_id))
@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_run.settings')
 
-application = get_asgi_application()
+django_asgi_app = get_asgi_application()
+
+from app_run import routing  # noqa: E402  модели доступны только после get_asgi_application
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(URLRouter(routing.websocket_urlpatterns)),
+})
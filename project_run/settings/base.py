@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,6 +32,7 @@ ALLOWED_HOSTS = ['*']
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -41,12 +43,16 @@ INSTALLED_APPS = [
     'rest_framework',
     'django_filters',
     'django_extensions',
+    'channels',
 
     'app_run',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'app_run.middleware.ProfilingMiddleware',
+    'app_run.middleware.MetricsMiddleware',
+    'app_run.middleware.QueryStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -74,6 +80,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project_run.wsgi.application'
+ASGI_APPLICATION = 'project_run.asgi.application'
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -112,6 +119,45 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = 'static'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+
+def get_file_storage(name):
+    """ Хранилище файлов приложения: каталог BASE_DIR/<name> или, если в переменной
+    окружения <NAME>_STORAGE задано s3, приватный префикс <name>/ бакета из настроек AWS_* """
+    if os.environ.get(f'{name.upper()}_STORAGE', 'local') == 's3':
+        return {
+            'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+            'OPTIONS': {
+                'location': name,
+                'default_acl': 'private',
+                'querystring_auth': True,
+            },
+        }
+    return {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': BASE_DIR / name,
+        },
+    }
+
+
+# Хранилище 'archive' -- архивы координат завершённых забегов, 'profiles' -- дампы профилировщика,
+# 'imports' -- файлы фонового импорта артефактов (общие для загрузки и обработчиков);
+# в S3 переводятся переменными окружения ARCHIVE_STORAGE=s3, PROFILES_STORAGE=s3, IMPORTS_STORAGE=s3
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'archive': get_file_storage('archive'),
+    'profiles': get_file_storage('profiles'),
+    'imports': get_file_storage('imports'),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -121,4 +167,71 @@ ABOUT_COMPANY = {
     'company_name': 'Альбатрос',
     'slogan':'Бвстрее, выше, сильнее!',
     'contacts':'г. Калининград, ул. Гайдара, 136'
-}    
\ No newline at end of file
+}
+
+# Метод расчёта расстояний: geodesic, vincenty или haversine (см. app_run/geodistance.py)
+GEODISTANCE_METHOD = 'vincenty'
+
+# Размер пачки bulk_create при импорте артефактов из xlsx
+COLLECTIBLE_ITEMS_IMPORT_CHUNK_SIZE = 1000
+
+# Фоновый импорт артефактов: число потоков обработки и время аренды задания
+IMPORT_JOBS_WORKERS = 2
+IMPORT_JOBS_LEASE_SECONDS = 300
+
+# Время жизни кэша аналитики тренера, секунды (сбрасывается при изменениях)
+COACH_ANALYTICS_CACHE_TIMEOUT = 3600
+
+# Время жизни кэша трека завершённого забега, секунды
+RUN_TRACK_CACHE_TIMEOUT = 86400
+
+# Масштабы карты, для которых при завершении забега сохраняется упрощённый трек
+TRACK_SIMPLIFICATION_ZOOMS = (8, 11, 14, 17)
+
+# Размер порции чтения координат и строк в ответе при экспорте в GPX/CSV
+EXPORT_CHUNK_SIZE = 2000
+
+# Время жизни кэша ответов редко меняющихся ресурсов, секунды (ключ включает версию ресурса)
+RESOURCE_CACHE_TIMEOUT = 86400
+
+# Заголовки X-DB-* со статистикой запросов к БД в ответах (app_run/middleware.py)
+QUERY_STATS_HEADERS = DEBUG
+
+# Профилирование запросов (app_run/profiling.py): доля профилируемых запросов
+# и время действия токена заголовка X-Profile-Token, секунды
+PROFILING_SAMPLE_RATE = 0
+PROFILING_TOKEN_MAX_AGE = 3600
+
+# Экспорт метрик Prometheus (/metrics) доступен персоналу и по заголовку
+# Authorization: Bearer <METRICS_TOKEN> (bearer_token в scrape_config)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Отложенная запись координат (app_run/ingest.py): POST api/positions/ отвечает 202,
+# а координаты сохраняются пачками, когда их накопится MAX_POINTS или раз в
+# MAX_DELAY_MS миллисекунд. Принятые координаты пишутся в журнал (None -- без
+# журнала), FSYNC -- сбрасывать журнал на диск на каждой координате
+POSITION_BUFFER_ENABLED = False
+POSITION_BUFFER_MAX_POINTS = 500
+POSITION_BUFFER_MAX_DELAY_MS = 200
+POSITION_BUFFER_JOURNAL_DIR = BASE_DIR / 'position_journal'
+POSITION_BUFFER_FSYNC = False
+# Неудачных сбросов подряд, после которых пачка убирается из буфера в журнал
+POSITION_BUFFER_MAX_RETRIES = 3
+
+# Слой каналов для трансляции забегов по WebSocket (app_run/live.py): Redis из
+# переменной окружения REDIS_URL, без неё in-memory -- только внутри одного процесса
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.environ['REDIS_URL']],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
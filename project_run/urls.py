@@ -15,14 +15,19 @@ router.register(r'api/collectible_item', views.CollectibleItemView)
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/company_details/', views.detail_company, name='company-detail'),
+    path('api/positions/async/', views.create_position_async, name='position-async'),
     path('', include(router.urls)),
     path('api/runs/<int:pk>/start/', views.RunViewStart.as_view(), name='run-start'),
     path('api/runs/<int:pk>/stop/', views.RunViewStop.as_view(), name='run-stop'),
     path('api/athlete_info/<int:id>/', views.AthleteInfoView.as_view(), name='athlete_info-detail'),
     path('api/challenges/', views.ChallengeView.as_view(), name='challenge-list'),
     path('api/upload_file/', views.FileUploadView.as_view(), name='upload-file'),
+    path('api/upload_file/jobs/', views.ImportJobView.as_view(), name='import-job-create'),
+    path('api/upload_file/jobs/<int:pk>/', views.ImportJobDetailView.as_view(), name='import-job-detail'),
     path('api/subscribe_to_coach/<int:id>/', views.SubscribeView.as_view(), name='subscribe-create'),
     path('api/challenges_summary/', views.ChallengeSummaryView.as_view(), name='challenge-summary'),
     path('api/rate_coach/<int:coach_id>/', views.RateCoachView.as_view(), name='rate-coach'),
     path('api/analytics_for_coach/<int:coach_id>/', views.AnalyticsForCoachView.as_view(), name='analytics-for-coach'),
+    path('api/cache_stats/', views.CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics/', views.export_metrics, name='metrics'),
 ]
\ No newline at end of file